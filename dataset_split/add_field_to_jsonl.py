@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 """
 向 JSONL 文件添加新字段
+一遍读取可以同时添加多个字段：--field name=value 为固定值（字符串），--field name:=expr 为 Python 表达式
+（变量 record 为当前记录，仅用于可信数据）。表达式只编译一次，各字段按给出的顺序计算，后面的表达式可以使用前面添加的字段。
+输入输出路径为 - 时读标准输入、写标准输出，可以和其他脚本用管道串联。
 
 用法：
   # 添加固定值字段
-  python add_field_to_jsonl.py split_1000.jsonl output.jsonl --field-name source --field-value ancient_poem
+  python add_field_to_jsonl.py split_1000.jsonl output.jsonl --field source=ancient_poem
   # 添加来源标记
 python add_field_to_jsonl.py split_1000.jsonl split_1000_system.jsonl \
-  --field-name system \
-  --field-value "
+  --field "system=
 你是一位精通中国古典诗词的诗人。当用户要求你创作一首指定体裁的诗（如五言绝句、七言绝句、五言律诗、七言律诗等），你必须严格遵守以下规则：
 
 1. **仅输出诗句本身**，不得包含标题（如《XXX》）、序号（如“其一”）、注释、赏析、解释、引导语（如“好的”“我写一首……”）或任何额外文字。
@@ -25,63 +27,153 @@ python add_field_to_jsonl.py split_1000.jsonl split_1000_system.jsonl \
 
 
   # 基于现有字段动态生成（使用 Python 表达式）
-  python add_field_to_jsonl.py input.jsonl output.jsonl --field-name full_title --expr "record.get('title', '') + '·' + record.get('dynasty', '')"
+  python add_field_to_jsonl.py input.jsonl output.jsonl --field "full_title:=record.get('title', '') + '·' + record.get('dynasty', '')"
+
+  # 一遍同时添加多个字段，并从标准输入读取、写到标准输出
+  zcat poems.jsonl.gz | python add_field_to_jsonl.py - - --field source=ancient_poem --field "label:=record['instruct'] + '/' + record['source']" > out.jsonl
 
-  # 同时添加多个字段（多次运行或修改脚本）
+  # 旧的单字段参数仍然可用
+  python add_field_to_jsonl.py split_1000.jsonl output.jsonl --field-name source --field-value ancient_poem
 """
 
-import json
 import argparse
+import json
+import os
 import sys
 
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的 JSON 编解码
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import STDIO_PATH, add_compression_arguments, compression_from_args, open_input, open_text_input
+
+
+class FieldError(Exception):
+    """计算某个字段的值失败"""
+
+    def __init__(self, field: str, error: Exception):
+        super().__init__(f"计算字段 '{field}' 失败: {error}")
+        self.field = field
+
+
+def parse_field_spec(spec: str) -> tuple:
+    """
+    解析 --field 参数
+    Args:
+        spec: 'name=value'（固定字符串值）或 'name:=expr'（Python 表达式）
+    Returns:
+        (字段名, 值或表达式源码, 是否为表达式)
+    """
+    name, sep, value = spec.partition('=')
+    if not sep:
+        raise ValueError(f"无效的字段 '{spec}'，应为 name=value 或 name:=expr")
+    is_expr = name.endswith(':')
+    if is_expr:
+        name = name[:-1]
+    if not name:
+        raise ValueError(f"无效的字段 '{spec}'，缺少字段名")
+    return name, value, is_expr
+
+
+class FieldAdder:
+    """按顺序给记录添加若干字段，表达式在构造时编译为代码对象，之后每条记录直接求值"""
+
+    def __init__(self, fields):
+        """
+        Args:
+            fields: [(字段名, 值或表达式源码, 是否为表达式), ...]
+        """
+        self.names = [name for name, _, _ in fields]
+        self._fields = [(name, None, compile(value, f'<{name}>', 'eval')) if is_expr else (name, value, None)
+                        for name, value, is_expr in fields]
+        self._globals = {"__builtins__": {}}
+
+    def apply(self, record: dict) -> dict:
+        """
+        添加字段（原地修改并返回 record）
+        Raises:
+            FieldError: 某个表达式求值失败，此时 record 可能已添加了前面的字段
+        """
+        env = {"record": record}
+        for name, value, code in self._fields:
+            if code is not None:
+                try:
+                    value = eval(code, self._globals, env)
+                except Exception as e:
+                    raise FieldError(name, e) from e
+            record[name] = value
+        return record
+
 
 def main():
     parser = argparse.ArgumentParser(description="向 JSONL 文件添加新字段")
-    parser.add_argument("input", help="输入 JSONL 文件路径")
-    parser.add_argument("output", help="输出 JSONL 文件路径")
-    parser.add_argument("--field-name", required=True, help="新字段的名称")
+    parser.add_argument("input", help="输入 JSONL 文件路径（可以是 .gz/.zst/.xz 压缩文件，- 表示标准输入）")
+    parser.add_argument("output", help="输出 JSONL 文件路径（以 .gz/.zst/.xz 结尾时压缩，- 表示标准输出）")
+    parser.add_argument("--field", action="append", default=[], metavar="SPEC",
+                        help="要添加的字段，name=value 为固定值，name:=expr 为 Python 表达式（变量 record），可多次指定")
+    parser.add_argument("--field-name", default=None, help="新字段的名称（单字段的旧用法，与 --field-value 或 --expr 一起使用）")
     parser.add_argument("--field-value", default=None, help="新字段的固定值（字符串）")
     parser.add_argument("--expr", default=None, help="Python 表达式，用于动态生成字段值（使用变量 'record'）")
     parser.add_argument("--encoding", default="utf-8", help="文件编码（默认: utf-8）")
+    add_compression_arguments(parser)
 
     args = parser.parse_args()
 
-    if not (args.field_value is not None) ^ (args.expr is not None):
-        print("错误：必须且只能指定 --field-value 或 --expr 之一", file=sys.stderr)
+    try:
+        fields = [parse_field_spec(spec) for spec in args.field]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.field_name is not None:
+        if not (args.field_value is not None) ^ (args.expr is not None):
+            print("错误：必须且只能指定 --field-value 或 --expr 之一", file=sys.stderr)
+            sys.exit(1)
+        fields.append((args.field_name, args.expr if args.expr is not None else args.field_value,
+                       args.expr is not None))
+    elif args.field_value is not None or args.expr is not None:
+        parser.error("--field-value 和 --expr 需要与 --field-name 一起使用")
+    if not fields:
+        parser.error("至少需要指定一个 --field（或 --field-name）")
+    try:
+        adder = FieldAdder(fields)
+    except SyntaxError as e:
+        parser.error(f"表达式语法错误: {e}")
+
+    # UTF-8 输入按字节读取，直接交给解码器，省去逐行转成 str
+    if args.encoding.lower().replace('_', '-') in ('utf-8', 'utf8'):
+        fin = open_input(args.input)
+    else:
+        fin = open_text_input(args.input, encoding=args.encoding)
+
+    options = compression_from_args(args)
+    try:
+        with fin, json_codec.JsonlWriter(args.output, encoding=args.encoding, options=options) as fout:
+
+            for line_num, line in enumerate(fin, 1):
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    record = json_codec.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    print(f"警告：第 {line_num} 行 JSON 解析失败，跳过: {e}", file=sys.stderr)
+                    continue
+
+                try:
+                    adder.apply(record)
+                except FieldError as e:
+                    print(f"警告：第 {line_num} 行{e}，跳过", file=sys.stderr)
+                    continue
+
+                # 写入输出（JsonlWriter 攒够一块再写）
+                fout.write(record)
+    except BrokenPipeError:
+        # 下游（如 head）提前关闭了管道，不再继续写出
         sys.exit(1)
 
-    with open(args.input, 'r', encoding=args.encoding) as fin, \
-            open(args.output, 'w', encoding=args.encoding) as fout:
-
-        for line_num, line in enumerate(fin, 1):
-            line = line.strip()
-            if not line:
-                continue
-
-            try:
-                record = json.loads(line)
-            except json.JSONDecodeError as e:
-                print(f"警告：第 {line_num} 行 JSON 解析失败，跳过: {e}", file=sys.stderr)
-                continue
-
-            # 计算新字段值
-            try:
-                if args.field_value is not None:
-                    new_value = args.field_value
-                else:
-                    # 使用 eval 执行表达式（注意：仅用于可信数据）
-                    new_value = eval(args.expr, {"__builtins__": {}}, {"record": record})
-            except Exception as e:
-                print(f"警告：第 {line_num} 行计算字段 '{args.field_name}' 失败，跳过: {e}", file=sys.stderr)
-                continue
-
-            # 添加新字段
-            record[args.field_name] = new_value
-
-            # 写入输出
-            fout.write(json.dumps(record, ensure_ascii=False) + '\n')
-
-    print(f"✅ 已完成！新增字段 '{args.field_name}'，结果保存至: {args.output}")
+    # 写到标准输出时，提示信息改写到标准错误，不混入数据
+    print(f"✅ 已完成！新增字段 {', '.join(repr(name) for name in adder.names)}，共 {fout.count} 条，结果保存至: "
+          f"{', '.join(fout.paths)}", file=sys.stderr if args.output == STDIO_PATH else sys.stdout)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+"""
+按诗歌正文去重：完全重复（只保留汉字后相同）和近似重复（字符 n-gram 的 MinHash + LSH）
+保留每组重复中最先出现的一条，其余行原样写出；可输出报告，列出每组重复中保留和去掉的诗
+
+用法：
+  python dedup.py ../data/raw/poems.jsonl ../data/output/poems_dedup.jsonl --report ../data/output/dedup_report.json
+  python dedup.py poems.jsonl poems_dedup.jsonl --workers 4 --bands 16   # 4 个进程计算指纹，放宽近似重复阈值
+"""
+
+import argparse
+import os
+import sys
+
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的去重工具
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer.compressed_io import add_compression_arguments, compression_from_args
+from poetry_scorer.dedup import MinHasher, deduplicate_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按诗歌正文去掉完全重复和近似重复的记录")
+    parser.add_argument("input", help="输入 JSONL 文件路径（可以是 .gz/.zst/.xz 压缩文件）")
+    parser.add_argument("output", help="输出 JSONL 文件路径（以 .gz/.zst/.xz 结尾时压缩）")
+    parser.add_argument("--content-field", default="content", help="诗歌文本字段名（默认: content）")
+    parser.add_argument("--exact-only", action="store_true", help="只去掉完全重复，不检测近似重复")
+    parser.add_argument("--num-perm", type=int, default=64, help="MinHash 签名长度（默认: 64）")
+    parser.add_argument("--bands", type=int, default=8,
+                        help="LSH 段数，段数越多判定越宽松，阈值约为 (1/段数)^(段数/签名长度)（默认: 8，约 0.77）")
+    parser.add_argument("--ngram", type=int, default=3, help="字符 n-gram 的长度（默认: 3）")
+    parser.add_argument("--seed", type=int, default=1, help="MinHash 哈希函数的随机种子（默认: 1）")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并行计算指纹的进程数，输入按字节范围切块（不支持压缩文件），结果与单进程相同（默认: 1）")
+    parser.add_argument("--report", default=None, help="去重报告输出路径（JSON，可选）")
+    add_compression_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        hasher = None if args.exact_only else MinHasher(args.num_perm, args.bands, args.ngram, args.seed)
+        print("正在去重...")
+        stats = deduplicate_file(args.input, args.output, args.content_field, not args.exact_only, hasher,
+                                 args.workers, compression_from_args(args), args.report)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"\n✅ 完成！保留 {stats['kept']} 条，去掉完全重复 {stats['exact_duplicates']} 条、"
+          f"近似重复 {stats['near_duplicates']} 条，已保存至 {', '.join(stats['output_files'])}")
+    if stats['invalid_lines']:
+        print(f"⚠️  跳过无效行 {stats['invalid_lines']} 行")
+    if args.report:
+        print(f"去重报告已保存至 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
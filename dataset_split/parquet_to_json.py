@@ -1,22 +1,158 @@
+#!/usr/bin/env python3
 """
 将 Parquet 转为 JSONL（保留中文）
+
+按行组流式读取，可用多个进程并行转换各行组，输出顺序与输入文件、行组的顺序一致；
+转换好的行直接写入输出文件（可压缩、可分卷），内存占用只与同时在处理的行组数有关，与数据集大小无关。
+
+用法：
+  python parquet_to_json.py ../data/raw/train-00000-of-00001.parquet -o ../data/output/output.jsonl
+  # 多个文件（支持通配符）、4 个进程、只保留部分列并改名、输出 gzip 压缩
+  python parquet_to_json.py '../data/raw/*.parquet' -o ../data/output/output.jsonl.gz --workers 4 \
+    --columns title content author --rename content=poem
 """
 
-import pandas as pd
+import argparse
 import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的 Parquet 和 JSONL 读写工具
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import add_compression_arguments, compression_from_args, expand_inputs
+from poetry_scorer.parquet_io import BATCH_SIZE, pq, require_pyarrow
+
+
+def _json_default(value):
+    """JSON 无法直接表示的列值（日期时间、Decimal、二进制等）转为字符串"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def convert_row_group(file_path: str, row_group: int, columns=None, renames=None,
+                      batch_size: int = BATCH_SIZE) -> list:
+    """
+    把一个行组转换为 JSONL 行
+    Args:
+        file_path: Parquet 文件路径
+        row_group: 行组序号
+        columns: 需要的列（原列名），None 表示全部
+        renames: 原列名 -> 新列名
+        batch_size: 每批读取的行数
+    Returns:
+        编码好的行（bytes，不含换行符）列表
+    """
+    renames = renames or {}
+    lines = []
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=[row_group], columns=columns):
+        for row in batch.to_pylist():
+            if renames:
+                row = {renames.get(key, key): value for key, value in row.items()}
+            lines.append(json_codec.dumps(row, default=_json_default))
+    return lines
+
+
+def _convert_task(task: tuple) -> list:
+    """进程池中执行的转换任务"""
+    return convert_row_group(*task)
+
+
+def parse_renames(items: list) -> dict:
+    """解析 old=new 形式的列改名"""
+    renames = {}
+    for item in items:
+        old, sep, new = item.partition('=')
+        if not sep or not old or not new:
+            raise ValueError(f"列改名格式应为 原列名=新列名: {item}")
+        renames[old] = new
+    return renames
+
+
+def convert(input_files: list, writer, columns=None, renames=None, workers: int = 1,
+            batch_size: int = BATCH_SIZE) -> int:
+    """
+    按顺序转换各文件的全部行组并写出
+    Args:
+        input_files: Parquet 文件列表
+        writer: json_codec.JsonlWriter
+        columns: 需要的列（原列名），None 表示全部
+        renames: 原列名 -> 新列名
+        workers: 并行转换的进程数，1 表示在当前进程中转换
+        batch_size: 每批读取的行数
+    Returns:
+        写出的行数
+    """
+    require_pyarrow()
+    tasks = []
+    for file_path in input_files:
+        parquet_file = pq.ParquetFile(file_path)
+        if columns is not None:
+            missing = [name for name in columns if name not in parquet_file.schema_arrow.names]
+            if missing:
+                raise ValueError(f"{file_path} 中没有列: {missing}")
+        tasks.extend((file_path, group, columns, renames, batch_size)
+                     for group in range(parquet_file.metadata.num_row_groups))
+
+    count = 0
+    if workers <= 1:
+        for task in tasks:
+            for line in _convert_task(task):
+                writer.write_line(line)
+                count += 1
+        return count
+
+    # 最多同时提交 2 * workers 个行组，按提交顺序取回结果，保证输出顺序且内存有界
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append(executor.submit(_convert_task, task))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            lines = pending.popleft().result()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append(executor.submit(_convert_task, next_task))
+            for line in lines:
+                writer.write_line(line)
+            count += len(lines)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将 Parquet 文件流式转换为 JSONL（保留中文）")
+    parser.add_argument("inputs", nargs="+", help="输入 Parquet 文件，支持通配符（如 'data/*.parquet'）")
+    parser.add_argument("-o", "--output", required=True, help="输出 JSONL 文件路径（以 .gz/.zst/.xz 结尾时压缩）")
+    parser.add_argument("--columns", nargs="+", default=None, help="只输出这些列（原列名，默认: 全部）")
+    parser.add_argument("--rename", nargs="+", default=[], metavar="OLD=NEW", help="列改名，如 content=poem")
+    parser.add_argument("--workers", type=int, default=1, help="并行转换的进程数 (默认: 1)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"每批读取的行数 (默认: {BATCH_SIZE})")
+    add_compression_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        input_files = expand_inputs(args.inputs)
+        renames = parse_renames(args.rename)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
 
-# 读取 Parquet
-input_file = '../data/raw/train-00000-of-00001.parquet'
-if not os.path.exists(input_file):
-    print(f"错误: 文件 '{input_file}' 不存在")
-    print("请确保poem1.parquet文件存在于当前目录")
-    exit(1)
+    with json_codec.JsonlWriter(args.output, options=compression_from_args(args)) as writer:
+        count = convert(input_files, writer, args.columns, renames, args.workers, args.batch_size)
 
-df = pd.read_parquet(input_file)
+    print(f"✅ 已转换 {len(input_files)} 个文件，共 {count} 行，结果保存至: {', '.join(writer.paths)}")
 
-# 转为 JSON，保留中文（不转义为 \uXXXX）
-json_str = df.to_json(orient='records', lines=True, force_ascii=False)
 
-# 写入文件（注意指定 encoding='utf-8'）
-with open('../data/output/output.jsonl', 'w', encoding='utf-8') as f:
-    f.write(json_str)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""
+一遍完成的数据集处理流水线
+按 YAML/JSON 配置把 读取 -> 分类 -> 去重 -> 按评分过滤 -> 抽样 -> 添加字段 -> 写出 串成一条流水线，
+记录逐条流过各阶段，不产生中间文件；结束时打印各阶段的条数、耗时和吞吐量。
+
+配置示例（pipeline.yaml）：
+  input: ../data/raw/*.jsonl          # 字符串或列表，支持通配符；JSONL、JSON 数组（均可压缩）或 Parquet
+  workers: 4                          # 可选，见下
+  stages:
+    - classify: {content_field: content}                   # poemsplit 的诗体分类，设置 instruct、去掉 content 中的换行
+    - dedupe: {bands: 8}                                    # 去掉完全重复和近似重复，exact_only: true 只去完全重复
+    - score_filter: {min_score: 80, poem_field: content, score_field: total_score}
+    - sample: {per_type: 10000, by: instruct, seed: 42}     # 或 {count: 1000}
+    - add_fields: {set: {source: chinese-poetry}, expr: {full_title: "record['title'] + '·' + record['instruct']"}}
+    - write: {path: ../data/output/train.jsonl.gz, keep_fields: [title, content, instruct, total_score]}
+
+workers 大于 1 时，输入按字节范围（Parquet 按行组）切块，开头连续的逐条处理阶段（classify、score_filter、add_fields）
+在进程池中执行，其余阶段在主进程中按输入顺序执行，结果与单进程相同；压缩文件和 JSON 数组无法切块，只能单进程处理。
+读取时无法解析或不是 JSON 对象的行（数组元素）计数后跳过并在标准错误上警告，一条记录都没有读到时报错退出。
+
+用法：
+  python pipeline.py pipeline.yaml
+  python pipeline.py pipeline.json --workers 8
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的读写、去重、抽样和评分工具
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import CompressOptions, detect_compression, expand_inputs
+from poetry_scorer.dedup import Deduplicator, MinHasher, fingerprint
+from poetry_scorer.json_array_reader import is_json_array, iter_json_array
+from poetry_scorer.jsonl_reader import iter_projected_records
+from poetry_scorer.parquet_io import iter_parquet_records, is_parquet
+from poetry_scorer.sampling import Reservoir
+from poetry_scorer.sharding import ShardSpec
+
+from poemsplit import TARGET_TYPES, classify_poem, clean_content_for_output
+from add_field_to_jsonl import FieldAdder, FieldError
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# 多个输入文件时，记录序号 = (文件序号 << SEQ_FILE_SHIFT) + 文件内序号（行首字节偏移或 Parquet 行号）
+SEQ_FILE_SHIFT = 48
+# 并行时每块的目标字节数，以及每个进程平均分到的最少块数
+CHUNK_BYTES = 64 << 20
+CHUNKS_PER_WORKER = 4
+
+
+class Stage:
+    """流水线阶段：process 返回处理后的记录，返回 None 表示丢弃"""
+
+    # 是否可以在工作进程中按块独立执行（只看单条记录、不依赖输入顺序）
+    parallel = False
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count_in = 0
+        self.count_out = 0
+        self.seconds = 0.0
+
+    def process(self, seq: int, record: dict):
+        raise NotImplementedError
+
+    def finish(self):
+        """输入结束后还要输出的 (序号, 记录)，只有抽样这样先收集再输出的阶段使用"""
+        return ()
+
+    def close(self):
+        """释放资源（如关闭输出文件）"""
+
+
+class ClassifyStage(Stage):
+    """按 poemsplit 的规则判断诗体，只保留目标诗体，写入 instruct 并去掉正文中的换行"""
+    parallel = True
+
+    def __init__(self, name, content_field='content', title_field='title', types=None):
+        super().__init__(name)
+        self.content_field = content_field
+        self.title_field = title_field
+        self.types = set(types or TARGET_TYPES)
+
+    def process(self, seq, record):
+        poem_type = classify_poem(record.get(self.content_field, ""), record.get(self.title_field, ""))
+        if poem_type not in self.types:
+            return None
+        record[self.content_field] = clean_content_for_output(record[self.content_field])
+        record['instruct'] = poem_type
+        return record
+
+
+class DedupeStage(Stage):
+    """去掉正文完全重复和近似重复的记录，保留最先出现的一条"""
+
+    def __init__(self, name, content_field='content', exact_only=False, num_perm=64, bands=8, ngram=3, seed=1):
+        super().__init__(name)
+        self.content_field = content_field
+        self.hasher = None if exact_only else MinHasher(num_perm, bands, ngram, seed)
+        self.deduplicator = Deduplicator()
+
+    def process(self, seq, record):
+        if self.deduplicator.add(seq, fingerprint(record, self.content_field, self.hasher)) is not None:
+            return None
+        return record
+
+
+class ScoreFilterStage(Stage):
+    """按格律评分过滤：只保留总分不低于 min_score 的记录，可把总分写入 score_field"""
+    parallel = True
+
+    def __init__(self, name, min_score=0.0, poem_field='content', instruct_field='instruct', rhyme_system='pingshui',
+                 score_field=None):
+        super().__init__(name)
+        self.min_score = min_score
+        self.poem_field = poem_field
+        self.instruct_field = instruct_field
+        self.rhyme_system = rhyme_system
+        self.score_field = score_field
+        self._extractor = None
+
+    def process(self, seq, record):
+        poem = record.get(self.poem_field)
+        instruct = record.get(self.instruct_field)
+        if poem is None or instruct is None:
+            return None
+        if self._extractor is None:
+            # 在用到时才加载评分器，并行时主进程不必加载
+            from poetry_scorer.poetry_quality_extractor import PoetryQualityExtractor
+            self._extractor = PoetryQualityExtractor(self.rhyme_system)
+        # 总分上界低于 min_score 时停止评分：score_poem 在上界 <= min_total 时剪枝，取 min_score 之前的一个浮点数
+        min_total = math.nextafter(self.min_score, -math.inf) if self.min_score > 0 else None
+        _, _, total = self._extractor.score_record(poem, instruct, min_total)
+        if total is None or total < self.min_score:
+            return None
+        if self.score_field:
+            record[self.score_field] = total
+        return record
+
+
+class SampleStage(Stage):
+    """流式蓄水池抽样：per_type 为按 by 字段分组后每组的条数，count 为总条数；输出为随机顺序"""
+
+    def __init__(self, name, count=None, per_type=None, by='instruct', seed=42):
+        super().__init__(name)
+        if (count is None) == (per_type is None):
+            raise ValueError("sample 阶段必须且只能指定 count 或 per_type 之一")
+        self.by = by if per_type is not None else None
+        self.size = per_type if per_type is not None else count
+        self.seed = seed
+        self.reservoirs = {}
+
+    def process(self, seq, record):
+        group = record.get(self.by) if self.by else None
+        reservoir = self.reservoirs.get(group)
+        if reservoir is None:
+            reservoir = self.reservoirs[group] = Reservoir(self.size, self.seed)
+        reservoir.offer(seq, (seq, record))
+        return None
+
+    def finish(self):
+        entries = [entry for reservoir in self.reservoirs.values() for entry in reservoir.entries()]
+        entries.sort(key=lambda entry: entry[0])
+        return [item for _, item in entries]
+
+
+class AddFieldsStage(Stage):
+    """添加字段：set 为固定值，expr 为 Python 表达式（变量 record 为当前记录，仅用于可信的配置）"""
+    parallel = True
+
+    def __init__(self, name, set=None, expr=None):
+        super().__init__(name)
+        self.adder = FieldAdder([(field, value, False) for field, value in (set or {}).items()] +
+                                [(field, source, True) for field, source in (expr or {}).items()])
+
+    def process(self, seq, record):
+        try:
+            return self.adder.apply(record)
+        except FieldError as e:
+            print(f"警告：序号 {seq} 的记录{e}，跳过", file=sys.stderr)
+            return None
+
+
+class WriteStage(Stage):
+    """写出 JSONL（文件名以 .gz/.zst/.xz 结尾时压缩），keep_fields 指定时只写出这些字段"""
+
+    def __init__(self, name, path, keep_fields=None, compress_level=None, compress_threads=0, max_part_bytes=0):
+        super().__init__(name)
+        self.keep_fields = keep_fields
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.writer = json_codec.JsonlWriter(path, options=CompressOptions(compress_level, compress_threads,
+                                                                          max_part_bytes))
+
+    def process(self, seq, record):
+        if self.keep_fields is not None:
+            record = {field: record[field] for field in self.keep_fields if field in record}
+        self.writer.write(record)
+        return record
+
+    def close(self):
+        self.writer.close()
+
+
+STAGES = {
+    'classify': ClassifyStage,
+    'dedupe': DedupeStage,
+    'score_filter': ScoreFilterStage,
+    'sample': SampleStage,
+    'add_fields': AddFieldsStage,
+    'write': WriteStage,
+}
+
+
+def load_spec(spec_path: str) -> dict:
+    """读取 YAML（需要 pyyaml）或 JSON 格式的流水线配置"""
+    if spec_path.lower().endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise ImportError("读取 YAML 配置需要安装 pyyaml（pip install -e .[pipeline]），或改用 JSON 配置")
+        with open(spec_path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f)
+    return json_codec.load_file(spec_path)
+
+
+def build_stages(stage_specs: list, first: int = 0, last: int = None) -> list:
+    """
+    由配置创建各阶段
+    Args:
+        stage_specs: 配置中的 stages 列表，每项为 {阶段名: 参数} 或阶段名
+        first, last: 只创建 [first, last) 范围内的阶段（工作进程只需要可并行的前几个阶段）
+    Returns:
+        Stage 列表
+    """
+    stages = []
+    for spec in stage_specs[first:last]:
+        if isinstance(spec, str):
+            spec = {spec: None}
+        if not isinstance(spec, dict) or len(spec) != 1:
+            raise ValueError(f"每个阶段应写成 {{阶段名: 参数}}: {spec}")
+        (kind, options), = spec.items()
+        if kind not in STAGES:
+            raise ValueError(f"未知的阶段: {kind}，可选: {', '.join(STAGES)}")
+        stages.append(STAGES[kind](kind, **(options or {})))
+    return stages
+
+
+def iter_input(file_path: str, file_index: int, shard: ShardSpec = None, on_invalid=None):
+    """
+    读取一个输入文件（或其中一块）
+    Args:
+        file_path: JSONL、JSON 数组（均可压缩）或 Parquet 文件路径
+        file_index: 文件在输入列表中的下标，放在全局序号的高位
+        shard: 按字节范围（Parquet 按行组）切出的一块，None 表示读取全部
+        on_invalid: 遇到无法解析或不是 JSON 对象的行（数组元素）时的回调 on_invalid(序号, 行)
+    Returns:
+        (全局序号, 记录) 的迭代器
+    """
+    base = file_index << SEQ_FILE_SHIFT
+    if is_parquet(file_path):
+        records = iter_parquet_records(file_path, shard=shard)
+    elif shard is None and is_json_array(file_path):
+        records = iter_json_array(file_path, on_invalid=on_invalid)
+    else:
+        # 未压缩的 JSONL 整个按一个字节范围读取，序号为行首的字节偏移，与切块并行时相同
+        if shard is None and detect_compression(file_path) is None:
+            shard = ShardSpec(0, 1, 'range')
+        records = iter_projected_records(file_path, shard=shard, on_invalid=on_invalid)
+    for seq, record in records:
+        yield base + seq, record
+
+
+def _run_stages(stages: list, start: int, seq: int, record: dict):
+    """让一条记录依次流过 stages[start:]，返回最后的记录（中途被丢弃时为 None）"""
+    for stage in stages[start:]:
+        stage.count_in += 1
+        begin = time.perf_counter()
+        record = stage.process(seq, record)
+        stage.seconds += time.perf_counter() - begin
+        if record is None:
+            return None
+        stage.count_out += 1
+    return record
+
+
+# 工作进程中按配置缓存的阶段对象，评分器等只加载一次
+_worker_stages = {}
+
+
+def _run_chunk(task):
+    """工作进程：读取一块输入，执行可并行的前几个阶段，返回留下的记录、读取和跳过的条数以及各阶段的计数"""
+    stage_specs, prefix, file_path, file_index, shard = task
+    key = repr(stage_specs[:prefix])
+    stages = _worker_stages.get(key)
+    if stages is None:
+        stages = _worker_stages[key] = build_stages(stage_specs, 0, prefix)
+    for stage in stages:
+        stage.count_in = stage.count_out = 0
+        stage.seconds = 0.0
+
+    read_seconds = time.perf_counter()
+    survivors = []
+    count = 0
+    invalid = []
+    for seq, record in iter_input(file_path, file_index, shard, lambda seq, line: invalid.append(seq)):
+        count += 1
+        record = _run_stages(stages, 0, seq, record)
+        if record is not None:
+            survivors.append((seq, record))
+    read_seconds = time.perf_counter() - read_seconds - sum(stage.seconds for stage in stages)
+    counters = [(stage.count_in, stage.count_out, stage.seconds) for stage in stages]
+    return survivors, count, len(invalid), read_seconds, counters
+
+
+def _chunk_tasks(stage_specs: list, prefix: int, input_files: list, workers: int) -> list:
+    """把每个输入文件切成若干块"""
+    tasks = []
+    for file_index, file_path in enumerate(input_files):
+        if not is_parquet(file_path):
+            if detect_compression(file_path) is not None:
+                raise ValueError(f"并行处理需要按字节范围切分输入，不支持压缩文件: {file_path}")
+            if is_json_array(file_path):
+                raise ValueError(f"并行处理需要按字节范围切分输入，不支持 JSON 数组: {file_path}")
+        num_chunks = max(workers * CHUNKS_PER_WORKER, -(-os.path.getsize(file_path) // CHUNK_BYTES))
+        tasks.extend((stage_specs, prefix, file_path, file_index, ShardSpec(i, num_chunks, 'range'))
+                     for i in range(num_chunks))
+    return tasks
+
+
+def run_pipeline(spec: dict, workers: int = None) -> list:
+    """
+    按配置运行流水线
+    Args:
+        spec: 流水线配置（input、stages，可选 workers）
+        workers: 进程数，None 表示使用配置中的值（默认 1）
+    Returns:
+        各阶段的计数 [(阶段名, 输入条数, 输出条数, 耗时), ...]，第一项为读取
+    """
+    input_files = expand_inputs(spec['input'])
+    stage_specs = spec.get('stages') or []
+    workers = workers or spec.get('workers') or 1
+    stages = build_stages(stage_specs)
+    read = Stage('read')
+    # 各输入文件中跳过的无效行数
+    invalid_counts = [0] * len(input_files)
+
+    try:
+        if workers > 1:
+            # 开头连续的可并行阶段在工作进程中执行
+            prefix = 0
+            while prefix < len(stages) and stages[prefix].parallel:
+                prefix += 1
+            tasks = _chunk_tasks(stage_specs, prefix, input_files, workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # 最多同时提交 2 * workers 块，按提交顺序取回结果，保证顺序且内存有界；task[3] 为文件下标
+                pending = deque()
+                task_iter = iter(tasks)
+                for task in task_iter:
+                    pending.append((task[3], executor.submit(_run_chunk, task)))
+                    if len(pending) >= 2 * workers:
+                        break
+                while pending:
+                    file_index, future = pending.popleft()
+                    survivors, count, invalid, read_seconds, counters = future.result()
+                    next_task = next(task_iter, None)
+                    if next_task is not None:
+                        pending.append((next_task[3], executor.submit(_run_chunk, next_task)))
+                    invalid_counts[file_index] += invalid
+                    read.count_in += count + invalid
+                    read.count_out += count
+                    read.seconds += read_seconds
+                    for stage, (count_in, count_out, seconds) in zip(stages, counters):
+                        stage.count_in += count_in
+                        stage.count_out += count_out
+                        stage.seconds += seconds
+                    for seq, record in survivors:
+                        _run_stages(stages, prefix, seq, record)
+        else:
+            for file_index, file_path in enumerate(input_files):
+                invalid = []
+                records = iter_input(file_path, file_index, on_invalid=lambda seq, line: invalid.append(seq))
+                while True:
+                    begin = time.perf_counter()
+                    item = next(records, None)
+                    read.seconds += time.perf_counter() - begin
+                    if item is None:
+                        break
+                    read.count_in += 1
+                    read.count_out += 1
+                    _run_stages(stages, 0, *item)
+                invalid_counts[file_index] = len(invalid)
+                read.count_in += len(invalid)
+
+        for file_path, invalid in zip(input_files, invalid_counts):
+            if invalid:
+                print(f"警告：{file_path} 中有 {invalid} 行无法解析或不是 JSON 对象，已跳过", file=sys.stderr)
+        if read.count_out == 0:
+            raise ValueError(f"没有从输入中读到任何记录（跳过 {read.count_in} 行无效内容）: {', '.join(input_files)}")
+
+        # 抽样等阶段在输入结束后才输出，输出的记录继续流过后面的阶段
+        for index, stage in enumerate(stages):
+            for seq, record in stage.finish():
+                stage.count_out += 1
+                _run_stages(stages, index + 1, seq, record)
+    finally:
+        for stage in stages:
+            stage.close()
+
+    return [(stage.name, stage.count_in, stage.count_out, stage.seconds) for stage in [read] + stages]
+
+
+# 计数表各列的显示宽度
+COLUMN_WIDTHS = (14, 12, 12, 12, 14)
+
+
+def _pad(text: str, width: int, left: bool = False) -> str:
+    """按终端显示宽度补齐（中文等全角字符占两列）"""
+    display = sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+    padding = ' ' * max(width - display, 0)
+    return text + padding if left else padding + text
+
+
+def _table_row(cells) -> str:
+    """第一列左对齐、其余右对齐的一行"""
+    return ''.join(_pad(str(cell), width, index == 0) for index, (cell, width) in enumerate(zip(cells, COLUMN_WIDTHS)))
+
+
+def print_counters(counters: list, total_seconds: float):
+    """打印各阶段的条数、耗时和吞吐量"""
+    print('\n' + _table_row(('阶段', '输入', '输出', '耗时(秒)', '条/秒')))
+    for name, count_in, count_out, seconds in counters:
+        rate = f"{count_in / seconds:,.0f}" if seconds > 0 else '-'
+        print(_table_row((name, count_in, count_out, f"{seconds:.2f}", rate)))
+    print(f"总耗时 {total_seconds:.2f} 秒（并行时各阶段耗时为所有进程之和）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按配置一遍完成读取、分类、去重、评分过滤、抽样、添加字段和写出")
+    parser.add_argument("spec", help="流水线配置文件（.yaml/.yml 或 .json）")
+    parser.add_argument("--workers", type=int, default=None, help="并行的进程数，覆盖配置中的 workers（默认: 1）")
+    args = parser.parse_args()
+
+    try:
+        spec = load_spec(args.spec)
+        start = time.perf_counter()
+        counters = run_pipeline(spec, args.workers)
+    except (FileNotFoundError, ValueError, TypeError, ImportError) as e:
+        parser.error(str(e))
+
+    print_counters(counters, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 """
 检测5、7言绝句和律诗，提取出来，并在对应字段标明类型
-支持常见古籍排版格式（单行、多行、两行八句等）
+支持常见古籍排版格式（单行、多行、两行八句等），诗体识别见 poetry_scorer.poem_form
 """
 
-import json
-import re
-import random
+import os
+import sys
 import argparse
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的 JSONL 读写工具
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer.compressed_io import add_compression_arguments, compression_from_args, detect_compression
+from poetry_scorer.json_codec import JsonlWriter
+from poetry_scorer.jsonl_reader import iter_projected_records, splice_fields
+from poetry_scorer.poem_form import classify
+from poetry_scorer.sampling import Reservoir, assign_splits, parse_splits, split_output_path
+from poetry_scorer.sharding import ShardSpec
+from poetry_scorer.title_filter import TitleFilter
 
 def clean_content_for_output(text):
     """仅移除换行符，保留所有标点、数字、括号等"""
@@ -16,44 +26,21 @@ def clean_content_for_output(text):
     return text.replace('\n', '').replace('\r', '')
 
 
+# 白名单：少数著名组诗可保留（可选）
+SERIES_WHITELIST = {"秋兴八首", "咏怀古迹五首", "诸将五首", "羌村三首"}
+
+# 快速排除已知非目标诗歌
+REJECT_TITLES = {'龟虽寿', '短歌行', '观沧海', '蒿里行', '燕歌行', '白马篇'}
+
+
 def is_part_of_series(title):
     """
     判断标题是否为组诗（包括总称或其中一篇）
     返回 True 表示应过滤
     """
-    if not title:
-        return False
-
-    # 白名单：少数著名组诗可保留（可选）
-    SERIES_WHITELIST = {"秋兴八首", "咏怀古迹五首", "诸将五首", "羌村三首"}
-    for white in SERIES_WHITELIST:
-        if white in title:
-            return False
-
-    # === 新增：匹配 "X诗Y首" 总标题 ===
-    # 模式：任意文字 + 数字 + (首|章|篇|阕)
-    # 例如：杂诗七首、古风五章、绝句四首、田园诗六篇
-    total_series_pattern = r'.*[一二三四五六七八九十\d]+[首篇章阕]'
-
-    # === 原有：匹配 "其X" 子篇 ===
-    part_patterns = [
-        r'[一二三四五六七八九十\d]+[首篇章阕]\s*[·\.]?\s*其?[一二三四五六七八九十\d]+',
-        r'其[一二三四五六七八九十\d]+\s*$',
-        r'第[一二三四五六七八九十\d]+[首篇章]',
-        r'[一二三四五六七八九十\d]+[首篇章]\s+.*其[一二三四五六七八九十\d]+',
-        r'[（\(]其[一二三四五六七八九十\d]+[）\)]'
-    ]
-
-    # 如果匹配总标题模式（且不含白名单），则过滤
-    if re.search(total_series_pattern, title):
-        return True
-
-    # 如果匹配子篇模式，也过滤
-    for pattern in part_patterns:
-        if re.search(pattern, title):
-            return True
-
-    return False
+    # 匹配 "X诗Y首" 总标题（杂诗七首、古风五章、绝句四首、田园诗六篇）
+    # 以及 "其X" 子篇（其二、第三首、（其四）），见 poetry_scorer.title_filter.SERIES_PATTERN
+    return TITLE_FILTER.is_part_of_series(title)
 
 
 # 常见词牌名及非目标诗歌标题
@@ -113,213 +100,173 @@ CI_KEYWORDS = {
     '将进酒', '蜀道难', '兵车行', '丽人行','玉阑干','鹊桥仙','南歌子','杂曲','恋绣衾','锦帐春'
 }
 
+# 词牌名、排除标题和组诗规则编译成一个过滤器，每个标题只判断一次
+TITLE_FILTER = TitleFilter(CI_KEYWORDS, REJECT_TITLES, SERIES_WHITELIST)
+
+
 def is_likely_ci(title):
     """判断是否为词或非目标诗歌"""
-    if not title:
-        return False
-
-    clean_title = re.sub(r'[·（）().\d一二三四五六七八九十\s]', '', title)
-
-    # 1. 关键词匹配
-    for kw in CI_KEYWORDS:
-        if kw in clean_title:
-            return True
-
-    # 2. 词牌特征字
-    if re.search(r'[令引近慢犯摊破减字]', clean_title):
-        return True
-
-    # 3. 启发式：长标题且不含诗题常见结尾
-    if len(clean_title) >= 3 and not re.search(r'(诗|吟|歌|行|引|谣|篇|辞|叹|作|题)$', clean_title):
-        common_endings = {'诗', '吟', '歌', '行', '引', '谣', '篇', '辞'}
-        if not any(end in clean_title for end in common_endings):
-            return True
-
-    return False
-
-def split_into_lines(content):
-    """智能分行：支持标准多行、单行多句、两行八句等格式"""
-    content = content.strip()
-    if not content:
-        return []
-
-    # 先按 \n 分割
-    lines_by_nl = [line.strip() for line in content.split('\n') if line.strip()]
-
-    # 情况1: 已是4或8行 → 直接返回
-    if len(lines_by_nl) in (4, 8):
-        return lines_by_nl
-
-    # 情况2: 2行 → 尝试每行切为4句（针对七律/五律）
-    if len(lines_by_nl) == 2:
-        all_parts = []
-        for line in lines_by_nl:
-            parts = re.split(r'[，。；！？]', line)
-            parts = [p.strip() for p in parts if p.strip()]
-            all_parts.extend(parts)
-        if len(all_parts) == 8:
-            return [p + '。' for p in all_parts]
-
-    # 情况3: 无换行 → 按句末标点切
-    if '\n' not in content:
-        sentences = re.split(r'[。！？；]', content)
-        sentences = [s.strip() for s in sentences if s.strip()]
-        if len(sentences) in (4, 8):
-            return [s + '。' for s in sentences]
-
-    # 情况4: fallback 到固定字数（仅限标准长度）
-    han_only = ''.join(re.findall(r'[\u4e00-\u9fa5]', content))
-    total = len(han_only)
-    if total == 56:  # 七律
-        return [han_only[i:i+7] for i in range(0, 56, 7)]
-    elif total == 40:  # 五律
-        return [han_only[i:i+5] for i in range(0, 40, 5)]
-    elif total == 28:  # 七绝
-        return [han_only[i:i+7] for i in range(0, 28, 7)]
-    elif total == 20:  # 五绝
-        return [han_only[i:i+5] for i in range(0, 20, 5)]
-
-    return lines_by_nl if lines_by_nl else [content]
+    # 1. 关键词匹配  2. 词牌特征字  3. 启发式：长标题且不含诗题常见结尾
+    return TITLE_FILTER.is_likely_ci(title)
 
 def classify_poem(raw_content, title=""):
+    """
+    判断诗歌是否为五、七言绝句或律诗
+    诗体由 poetry_scorer.poem_form 按各句字数识别（整段不分行的律诗、两行八句等排版都能识别），
+    置信度不低于 MIN_FORM_CONFIDENCE 时才采用
+    Returns:
+        诗体名称（见 TARGET_TYPES），不是目标诗歌时返回 None
+    """
     if not raw_content or not isinstance(raw_content, str):
         return None
 
-        # === 新增：过滤组诗中的单篇 ===
-    if is_part_of_series(title):
-        return None
-
-    # 快速排除已知非目标诗歌
-    reject_titles = {'龟虽寿', '短歌行', '观沧海', '蒿里行', '燕歌行', '白马篇'}
-    if any(rt in title for rt in reject_titles):
+    # 过滤组诗、已知非目标诗歌和词
+    if TITLE_FILTER.rejects(title):
         return None
 
-    # 过滤词
-    if is_likely_ci(title):
+    # 过滤联句等
+    if '--' in raw_content or '〔' in raw_content or '［' in raw_content:
         return None
 
-    # 智能分行
-    lines = split_into_lines(raw_content)
-    num_lines = len(lines)
-
-    # 允许绝句=4行，律诗=7~9行（容忍变体）
-    if num_lines == 4:
-        poem_form = "jueju"
-    elif 7 <= num_lines <= 9:
-        poem_form = "lvshi"
-    else:
+    result = classify(raw_content)
+    if result.form.value not in TARGET_TYPES or result.confidence < MIN_FORM_CONFIDENCE:
         return None
+    return result.form.value
 
-    # 过滤联句等
-    full_text = "".join(lines)
-    if '--' in full_text or '〔' in full_text or '［' in full_text:
-        return None
 
-    # 提取每行汉字数
-    han_counts = []
-    for line in lines:
-        han_only = re.findall(r'[\u4e00-\u9fa5]', line)
-        han_counts.append(len(han_only))
+TARGET_TYPES = ["五言绝句", "七言绝句", "五言律诗", "七言律诗"]
+# 采用诗体识别结果的最低置信度：绝句 4 句中至少 3 句、律诗至少 6 句为标准句长，只能按总字数判断的也接受
+MIN_FORM_CONFIDENCE = 0.75
+# 并行分类时每个进程平均分到的字节范围数，范围切得细一些，各进程的负载更均衡
+CHUNKS_PER_WORKER = 4
 
-    # 快速排除非5/7言
-    if not any(c in (5, 6, 7, 8) for c in han_counts):
-        return None
 
-    # 确定主字数（必须是5或7）
-    main_count = None
-    if poem_form == "jueju":
-        cnt = Counter(han_counts)
-        for num in [7, 5]:
-            if cnt.get(num, 0) >= 3:  # 4句中至少3句标准
-                main_count = num
-                break
-        if main_count is None:
-            return None
-    else:  # lvshi
-        cnt = Counter(han_counts)
-        for num in [7, 5]:
-            if cnt.get(num, 0) >= 5:  # 7-9句中至少5句标准
-                main_count = num
-                break
-        if main_count is None:
-            return None
-
-    # 验证合规句比例
-    threshold = 4 if poem_form == "jueju" else 7
-    valid_count = sum(1 for c in han_counts if abs(c - main_count) <= 1)
-    if valid_count < threshold:
-        return None
+def collect_candidates(input_path, content_field="content", keep_fields=None, sample_size=10000, seed=42,
+                       shard=None):
+    """
+    读取并分类诗歌，每种诗体用一个蓄水池流式抽样
+    Args:
+        input_path: 输入 JSONL 文件路径
+        content_field: 诗歌文本字段名
+        keep_fields: 要保留的字段列表，None 表示保留所有字段
+        sample_size: 每种诗体保留的条数
+        seed: 随机种子
+        shard: 只处理这个分片（并行分类时为字节范围），None 表示整个文件
+    Returns:
+        诗体 -> Reservoir；保留所有字段时每条为 (原始行, 改写的字段)，否则为输出的记录
+    """
+    poems_by_type = {t: Reservoir(sample_size, seed) for t in TARGET_TYPES}
+
+    # 读取时只保留分类和输出需要的字段；保留全部字段时记下原始行，输出时在原始行上改写 content 和 instruct，
+    # 其余字段按原始字节写出，不必把整条记录留在内存中再重新编码
+    keep_all = keep_fields is None
+    fields = {content_field, "title", *(keep_fields or [])}
+
+    # 抽样键由原始行（去掉首尾空白）计算，与序号无关：抽样结果不受进程数、是否压缩和行在文件中的位置影响，
+    # 同一行在 split.py 中的抽样键也相同
+    for seq, record in iter_projected_records(input_path, fields, shard, keep_raw=True):
+        raw_content = record.get(content_field, "")
+        title = record.get("title", "")
+        poem_type = classify_poem(raw_content, title)
+
+        if poem_type in poems_by_type:
+            updates = {}
+            if content_field in record:
+                updates[content_field] = clean_content_for_output(record[content_field])
+            updates["instruct"] = poem_type
+
+            if keep_all:
+                poems_by_type[poem_type].offer(seq, (record.raw, updates), record.raw)
+            else:
+                new_record = {k: record[k] for k in keep_fields if k in record}
+                new_record.update(updates)
+                poems_by_type[poem_type].offer(seq, new_record, record.raw)
+    return poems_by_type
+
+
+def _collect_chunk(task):
+    """进程池中执行的分类任务"""
+    return collect_candidates(*task)
+
+
+def collect_candidates_parallel(input_path, content_field="content", keep_fields=None, sample_size=10000, seed=42,
+                                workers=2):
+    """
+    把输入按字节范围（对齐到行首）切块，在进程池中分类和抽样，再合并各块的蓄水池，
+    结果与 collect_candidates 处理整个文件相同，因此抽样结果只取决于 --seed，与进程数无关
+    """
+    num_chunks = workers * CHUNKS_PER_WORKER
+    tasks = [(input_path, content_field, keep_fields, sample_size, seed, ShardSpec(i, num_chunks, 'range'))
+             for i in range(num_chunks)]
+    poems_by_type = {t: Reservoir(sample_size, seed) for t in TARGET_TYPES}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in executor.map(_collect_chunk, tasks):
+            for ptype, reservoir in chunk.items():
+                poems_by_type[ptype].merge(reservoir)
+    return poems_by_type
 
-    # 返回类型
-    if poem_form == "jueju":
-        return "五言绝句" if main_count == 5 else "七言绝句"
-    else:
-        return "五言律诗" if main_count == 5 else "七言律诗"
 
 def main():
     parser = argparse.ArgumentParser(description="抽取古诗并标注诗体，保留 content 中的标点，仅去除换行符")
-    parser.add_argument("input", help="输入 JSONL 文件路径")
-    parser.add_argument("output", help="输出 JSONL 文件路径")
+    parser.add_argument("input", help="输入 JSONL 文件路径（可以是 .gz/.zst/.xz 压缩文件）")
+    parser.add_argument("output", help="输出 JSONL 文件路径（以 .gz/.zst/.xz 结尾时压缩）")
     parser.add_argument("--content-field", default="content", help="诗歌文本字段名（默认: content）")
     parser.add_argument("--keep-fields", nargs="+", default=None,
                         help="要保留的字段列表（默认保留所有字段）")
     parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--samples-per-type", type=int, default=10000,
+                        help="每种诗体抽取的条数，指定 --splits 时不使用（默认: 10000）")
+    parser.add_argument("--splits", nargs="+", default=None, metavar="NAME=N",
+                        help="一遍读取抽出互不重叠的多份，N 为每种诗体的条数，如 train=8000 val=1000 test=1000，"
+                             "分别写入 <输出文件名>_train.jsonl 等")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并行分类的进程数，输入按字节范围切块（不支持压缩文件），结果与单进程相同（默认: 1）")
+    add_compression_arguments(parser)
     args = parser.parse_args()
 
-    random.seed(args.seed)
+    if args.workers > 1 and detect_compression(args.input) is not None:
+        parser.error("--workers 需要按字节范围切分输入，不支持压缩文件")
+    try:
+        splits = parse_splits(args.splits) if args.splits else [(None, args.samples_per_type)]
+    except ValueError as e:
+        parser.error(str(e))
+    n_needed = sum(count for _, count in splits)
 
-    target_types = ["五言绝句", "七言绝句", "五言律诗", "七言律诗"]
-    poems_by_type = {t: [] for t in target_types}
+    keep_all = args.keep_fields is None
 
     print("正在读取并分类诗歌...")
-    with open(args.input, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            if not line.strip():
-                continue
-            try:
-                record = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            raw_content = record.get(args.content_field, "")
-            title = record.get("title", "")
-            poem_type = classify_poem(raw_content, title)
-
-            if poem_type in target_types:
-                if args.keep_fields is None:
-                    new_record = record.copy()
-                else:
-                    new_record = {k: record[k] for k in args.keep_fields if k in record}
-
-                if args.content_field in record:
-                    clean_content = clean_content_for_output(record[args.content_field])
-                    new_record[args.content_field] = clean_content
-
-                new_record["instruct"] = poem_type
-                poems_by_type[poem_type].append(new_record)
-
-    # 抽样：n_needed控制输出多少条数据，每种类型各占四分之一
-    sampled = []
-    for ptype in target_types:
-        pool = poems_by_type[ptype]
-        n_needed = 10000    # 控制输出多少条数据
-        if len(pool) < n_needed:
-            print(f"⚠️  警告：{ptype} 只有 {len(pool)} 条，少于{n_needed}条")
-            sampled.extend(pool)
-        else:
-            sampled.extend(random.sample(pool, n_needed))
+    if args.workers > 1:
+        poems_by_type = collect_candidates_parallel(args.input, args.content_field, args.keep_fields, n_needed,
+                                                    args.seed, args.workers)
+    else:
+        poems_by_type = collect_candidates(args.input, args.content_field, args.keep_fields, n_needed, args.seed)
 
-    random.shuffle(sampled)
+    # 每种诗体按抽样键的顺序切成各份，每份内再按抽样键排序，各诗体随机交错
+    sampled = {name: [] for name, _ in splits}
+    for ptype in TARGET_TYPES:
+        reservoir = poems_by_type[ptype]
+        if reservoir.seen < n_needed:
+            print(f"⚠️  警告：{ptype} 只有 {reservoir.seen} 条，少于{n_needed}条")
+        for name, entries in assign_splits(reservoir.entries(), splits).items():
+            sampled[name].extend(entries)
 
     # 写入输出
-    with open(args.output, 'w', encoding='utf-8') as f:
-        for rec in sampled:
-            f.write(json.dumps(rec, ensure_ascii=False) + '\n')
-
-    print(f"\n✅ 完成！共抽取 {len(sampled)} 条诗歌，已保存至 {args.output}")
-    for t in target_types:
-        count = sum(1 for x in sampled if x.get("instruct") == t)
-        print(f"  - {t}: {count} 条")
+    options = compression_from_args(args)
+    for name, entries in sampled.items():
+        entries.sort(key=lambda entry: entry[0])
+        output = args.output if name is None else split_output_path(args.output, name)
+        with JsonlWriter(output, options=options) as writer:
+            for _, rec in entries:
+                if keep_all:
+                    raw, updates = rec
+                    writer.write_line(splice_fields(raw, updates))
+                else:
+                    writer.write(rec)
+
+        print(f"\n✅ 完成！共抽取 {len(entries)} 条诗歌，已保存至 {output}")
+        for t in TARGET_TYPES:
+            count = sum(1 for _, x in entries if (x[1] if keep_all else x).get("instruct") == t)
+            print(f"  - {t}: {count} 条")
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,57 @@
 """
-从jsonl数据集文件里面随机抽取1000条数据
+从jsonl数据集文件里面随机抽取若干条数据（默认 1000 条），或一遍读取抽出互不重叠的 train/val/test 等多份
+流式蓄水池抽样，内存只与抽样条数有关；输入输出文件名以 .gz/.zst/.xz 结尾时自动解压/压缩
+
+用法：
+  python split.py output.jsonl split_1000.jsonl
+  python split.py output.jsonl split.jsonl --splits train=10000 val=1000 test=1000   # split_train.jsonl ...
 """
 
-import json
-import random
+import argparse
+import os
+import sys
+
+# 以脚本方式运行时把项目根目录加入搜索路径，复用 poetry_scorer 包中的压缩文件读写和抽样工具
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poetry_scorer.compressed_io import add_compression_arguments, compression_from_args, open_input
+from poetry_scorer.json_codec import JsonlWriter
+from poetry_scorer.sampling import Reservoir, assign_splits, parse_splits, split_output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 JSONL 文件中随机抽取数据")
+    parser.add_argument("input", nargs="?", default="output.jsonl", help="输入 JSONL 文件路径（默认: output.jsonl）")
+    parser.add_argument("output", nargs="?", default="split_1000.jsonl",
+                        help="输出 JSONL 文件路径（默认: split_1000.jsonl）")
+    parser.add_argument("-n", "--num-samples", type=int, default=1000, help="抽取的条数，指定 --splits 时不使用（默认: 1000）")
+    parser.add_argument("--splits", nargs="+", default=None, metavar="NAME=N",
+                        help="一遍读取抽出互不重叠的多份，如 train=10000 val=1000 test=1000，分别写入 <输出文件名>_train.jsonl 等")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（默认: 42）")
+    add_compression_arguments(parser)
+    args = parser.parse_args()
 
-input_file = "output.jsonl"
-output_file = "split_1000.jsonl"
-n_samples = 1000
+    try:
+        splits = parse_splits(args.splits) if args.splits else [(None, args.num_samples)]
+    except ValueError as e:
+        parser.error(str(e))
 
-# 读取所有行
-with open(input_file, 'r', encoding='utf-8') as f:
-    lines = f.readlines()
+    # 逐行读取，只在蓄水池中保留被抽中的行（若总行数不足，则全部保留）；
+    # 抽样键由去掉首尾空白的行计算，与行号无关，同一行在 poemsplit.py 中的抽样键相同
+    reservoir = Reservoir(sum(count for _, count in splits), args.seed)
+    with open_input(args.input) as f:
+        for seq, line in enumerate(f):
+            reservoir.offer(seq, line[:-1] if line.endswith(b'\n') else line, line.strip())
 
-# 随机抽样（若总行数 < 1000，则全部保留）
-sample_lines = random.sample(lines, min(n_samples, len(lines)))
+    # 写入新文件
+    options = compression_from_args(args)
+    for name, entries in assign_splits(reservoir.entries(), splits).items():
+        output_file = args.output if name is None else split_output_path(args.output, name)
+        with JsonlWriter(output_file, options=options) as writer:
+            for _, line in entries:
+                writer.write_line(line)
+        print(f"已抽取 {len(entries)} 条数据到 {', '.join(writer.paths)}")
 
-# 写入新文件
-with open(output_file, 'w', encoding='utf-8') as f:
-    f.writelines(sample_lines)
 
-print(f"已抽取 {len(sample_lines)} 条数据到 {output_file}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+用真实数据测量各处理环节的吞吐量，比较不同实现之间的差异
+
+用法：
+  python poetry_scorer/benchmark.py json data/raw/split_12540.jsonl
+  python poetry_scorer/benchmark.py forms data/raw/split_12540.jsonl
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+
+if __package__ in (None, ''):
+    # 直接以脚本方式运行时，用项目根目录替换脚本所在目录，保证只经由 poetry_scorer 包导入（避免韵表被重复加载）
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from poetry_scorer import json_codec
+from poetry_scorer.poem_form import classify, classify_many, tokenize
+from poetry_scorer.poetry_scorer_jiujiu import extract_chinese
+
+
+def _measure(func, repeat: int) -> float:
+    """运行 repeat 次，返回最快一次的耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _print_row(name: str, seconds: float, count: int, size: int):
+    """打印一行结果：耗时、每秒记录数、每秒 MB 数"""
+    # 汉字占两个字符宽度
+    name += ' ' * max(24 - len(name) - sum(1 for c in name if ord(c) > 0x7f), 0)
+    print(f"  {name}{seconds * 1000:>10.1f} ms{count / seconds:>14,.0f} 条/秒{size / seconds / 1e6:>10.1f} MB/秒")
+
+
+def bench_json(input_file: str, repeat: int = 3):
+    """
+    比较各 JSON 后端解析 JSONL、编码单行记录、编码缩进文档的吞吐量，以及逐行写入和成块写入的差异
+    Args:
+        input_file: JSONL 文件路径
+        repeat: 每项重复次数，取最快一次
+    """
+    with open(input_file, 'rb') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    size = sum(len(line) + 1 for line in lines)
+    records = [json_codec.loads(line) for line in lines]
+    print(f"输入: {input_file}，{len(lines)} 条记录，{size / 1e6:.1f} MB")
+
+    backends = ['json'] + (['orjson'] if json_codec.orjson is not None else [])
+    previous = json_codec.BACKEND
+    try:
+        for backend in backends:
+            json_codec.set_backend(backend)
+            print(f"\n后端: {backend}")
+            seconds = _measure(lambda: [json_codec.loads(line) for line in lines], repeat)
+            _print_row('解析 JSONL', seconds, len(lines), size)
+            seconds = _measure(lambda: [json_codec.dumps(record) for record in records], repeat)
+            _print_row('编码单行记录', seconds, len(records), size)
+            document = json_codec.dumps(records, indent=True)
+            seconds = _measure(lambda: json_codec.dumps(records, indent=True), repeat)
+            _print_row('编码缩进文档', seconds, len(records), len(document))
+    finally:
+        json_codec.set_backend(previous)
+
+    print("\n写入 JSONL")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = os.path.join(tmp_dir, 'output.jsonl')
+
+        def write_per_line():
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json_codec.dumps(record).decode('utf-8') + '\n')
+
+        def write_batched():
+            with json_codec.JsonlWriter(output_file) as writer:
+                for record in records:
+                    writer.write(record)
+
+        _print_row('逐行写入文本文件', _measure(write_per_line, repeat), len(records), size)
+        _print_row('JsonlWriter 成块写入', _measure(write_batched, repeat), len(records), size)
+
+
+def _legacy_poemsplit_form(content: str):
+    """改用 poem_form 之前 poemsplit 的诗体判断（不含标题过滤），仅用于对比"""
+    content = content.strip()
+    lines = [line.strip() for line in content.split('\n') if line.strip()]
+    if len(lines) not in (4, 8):
+        parts = []
+        if len(lines) == 2:
+            parts = [p.strip() + '。' for line in lines for p in re.split(r'[，。；！？]', line) if p.strip()]
+        if len(parts) == 8:
+            lines = parts
+        else:
+            sentences = [] if '\n' in content else [s.strip() + '。' for s in re.split(r'[。！？；]', content) if s.strip()]
+            if len(sentences) in (4, 8):
+                lines = sentences
+            else:
+                han_only = ''.join(re.findall(r'[\u4e00-\u9fa5]', content))
+                size = {56: 7, 40: 5, 28: 7, 20: 5}.get(len(han_only))
+                if size is not None:
+                    lines = [han_only[i:i + size] for i in range(0, len(han_only), size)]
+                elif not lines:
+                    lines = [content]
+    if len(lines) != 4 and not 7 <= len(lines) <= 9:
+        return None
+    full_text = ''.join(lines)
+    if '--' in full_text or '〔' in full_text or '［' in full_text:
+        return None
+    counts = [len(re.findall(r'[\u4e00-\u9fa5]', line)) for line in lines]
+    minimum, threshold = (3, 4) if len(lines) == 4 else (5, 7)
+    main_count = next((num for num in (7, 5) if Counter(counts).get(num, 0) >= minimum), None)
+    if main_count is None or sum(1 for c in counts if abs(c - main_count) <= 1) < threshold:
+        return None
+    return f"{'五' if main_count == 5 else '七'}言{'绝句' if len(lines) == 4 else '律诗'}"
+
+
+def _legacy_scorer_form(poem: str):
+    """评分器 check_format 原来的判断：清理后的总字数对 5、7 取模"""
+    length = len(extract_chinese(poem))
+    if length and length % 5 == 0:
+        return 5, length // 5
+    if length and length % 7 == 0:
+        return 7, length // 7
+    return None
+
+
+def _legacy_extractor_category(poem: str):
+    """提取器 _determine_category 原来的判断：按清理后的总字数分支"""
+    return {20: 'five_quatrain', 28: 'seven_quatrain', 40: 'eight_five', 56: 'eight_seven'}.get(
+        len(extract_chinese(poem)))
+
+
+def bench_forms(input_file: str, field: str = 'content', label_field: str = 'instruct', repeat: int = 3):
+    """
+    比较诗体识别的吞吐量：poemsplit、评分器、提取器原来各自的判断与 poem_form 统一的切分和识别，
+    输入带有诗体标注时（label_field）还比较 poemsplit 原来的判断和 poem_form 与标注一致的条数
+    Args:
+        input_file: JSONL 文件路径
+        field: 诗句字段名
+        label_field: 诗体标注字段名（如 instruct，值为 五言绝句 等）
+        repeat: 每项重复次数，取最快一次
+    """
+    with open(input_file, 'rb') as f:
+        records = [json_codec.loads(line) for line in f if line.strip()]
+    texts = [record.get(field) if isinstance(record.get(field), str) else '' for record in records]
+    size = sum(len(text.encode('utf-8')) for text in texts)
+    print(f"输入: {input_file}，{len(texts)} 首，{size / 1e6:.1f} MB")
+
+    print("\n原来的三处判断")
+    _print_row('poemsplit 分行计数', _measure(lambda: [_legacy_poemsplit_form(t) for t in texts], repeat),
+               len(texts), size)
+    _print_row('评分器 取模', _measure(lambda: [_legacy_scorer_form(t) for t in texts], repeat), len(texts), size)
+    _print_row('提取器 按字数', _measure(lambda: [_legacy_extractor_category(t) for t in texts], repeat),
+               len(texts), size)
+    print("\npoem_form")
+    _print_row('tokenize', _measure(lambda: [tokenize(t) for t in texts], repeat), len(texts), size)
+    _print_row('classify', _measure(lambda: [classify(t) for t in texts], repeat), len(texts), size)
+    _print_row('classify_many', _measure(lambda: classify_many(texts), repeat), len(texts), size)
+
+    labels = [record.get(label_field) for record in records]
+    if any(isinstance(label, str) for label in labels):
+        legacy = [_legacy_poemsplit_form(t) for t in texts]
+        unified = [result.form.value for result in classify_many(texts)]
+        print(f"\n与 {label_field} 标注一致的条数（共 {len(texts)} 首）")
+        print(f"  poemsplit 原来的判断  {sum(1 for a, b in zip(legacy, labels) if a == b)}")
+        print(f"  poem_form.classify    {sum(1 for a, b in zip(unified, labels) if a == b)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', help='基准测试项目')
+    json_parser = subparsers.add_parser('json', help='JSON 编解码后端和写入方式的吞吐量')
+    json_parser.add_argument('input_file', help='输入JSONL文件路径')
+    json_parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次 (默认: 3)')
+    forms_parser = subparsers.add_parser('forms', help='诗体识别：原来的三处判断与 poem_form 的吞吐量和准确率')
+    forms_parser.add_argument('input_file', help='输入JSONL文件路径')
+    forms_parser.add_argument('--field', default='content', help='诗句字段名 (默认: content)')
+    forms_parser.add_argument('--label-field', default='instruct', help='诗体标注字段名 (默认: instruct)')
+    forms_parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次 (默认: 3)')
+    args = parser.parse_args()
+
+    if args.command == 'json':
+        bench_json(args.input_file, args.repeat)
+    elif args.command == 'forms':
+        bench_forms(args.input_file, args.field, args.label_field, args.repeat)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
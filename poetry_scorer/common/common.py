@@ -1,12 +1,24 @@
 """一些都会用到的通用模块。"""
 
+import hashlib
 import re
+from contextlib import contextmanager
 
-import rhythm.new_rhythm as nw
-from rhythm.pingshui_rhythm import hanzi_rhythm
+import poetry_scorer.hanzi.hanzi_class as hanzi_class
+import poetry_scorer.hanzi.hanzi_pinyin_class as hanzi_pinyin_class
+import poetry_scorer.rhythm.new_rhythm as nw
+import poetry_scorer.rhythm.pingshui_rhythm as pingshui_rhythm
+from poetry_scorer.rhythm.pingshui_rhythm import hanzi_rhythm
 
 cn_nums = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
 
+# 预先算好的简体汉字平仄代码和韵部列表，按韵书代码分表（只在 precomputed_codes 的 with 块内有效，见 poetry_scorer.poem_pack）
+_precomputed_pingze = {}
+_precomputed_yun = {}
+# 决定 hanzi_to_pingze、hanzi_to_yun 结果的韵表和查表代码所在的模块
+_RHYME_TABLE_MODULES = (hanzi_class, hanzi_pinyin_class, pingshui_rhythm, nw)
+_rhyme_fingerprint = None
+
 
 def show_all_rhythm(single_hanzi: str, is_trad: bool) -> str | None:
     """
@@ -47,13 +59,18 @@ def hanzi_to_yun(hanzi: str, yun_shu: int, is_trad: bool, ci_lin: bool = False)
     Returns:
         汉字的韵部列表
     """
+    if not is_trad and not ci_lin:
+        yun = _precomputed_yun.get(yun_shu, {}).get(hanzi)
+        if yun is not None:
+            # 调用方可能修改结果，返回副本
+            return list(yun)
     if yun_shu == 1:
         if ci_lin:
             return hanzi_rhythm(hanzi, is_trad, ci_lin=True)
         return hanzi_rhythm(hanzi, is_trad)
     elif yun_shu == 2:
-        return nw.convert_yun(nw.get_new_yun(hanzi), nw.xin_yun)
-    return nw.convert_yun(nw.get_new_yun(hanzi), nw.tong_yun)
+        return nw.hanzi_new_yun(hanzi, nw.xin_yun)
+    return nw.hanzi_new_yun(hanzi, nw.tong_yun)
 
 
 def hanzi_to_pingze(hanzi: str, yun_shu: int, is_trad: bool) -> str:
@@ -66,9 +83,52 @@ def hanzi_to_pingze(hanzi: str, yun_shu: int, is_trad: bool) -> str:
     Returns:
         平仄代码
     """
+    if not is_trad:
+        code = _precomputed_pingze.get(yun_shu, {}).get(hanzi)
+        if code is not None:
+            return code
     if yun_shu == 1:
         return hanzi_rhythm(hanzi, is_trad, only_ping_ze=True)
-    return nw.new_ping_ze(nw.get_new_yun(hanzi))
+    return nw.hanzi_new_ping_ze(hanzi)
+
+
+def rhyme_table_fingerprint() -> str:
+    """
+    韵表的指纹：韵表和查表代码所在模块源文件的哈希，任何一个模块有改动指纹都会改变。
+    预先算好的平仄和韵部只有在指纹相同时才与 hanzi_to_pingze、hanzi_to_yun 的结果一致
+    Returns:
+        十六进制字符串
+    """
+    global _rhyme_fingerprint
+    if _rhyme_fingerprint is None:
+        digest = hashlib.blake2b(digest_size=16)
+        for module in _RHYME_TABLE_MODULES:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _rhyme_fingerprint = digest.hexdigest()
+    return _rhyme_fingerprint
+
+
+@contextmanager
+def precomputed_codes(yun_shu: int, pingze: dict, yun: dict):
+    """
+    在 with 块内 hanzi_to_pingze、hanzi_to_yun 对这些简体汉字直接查表，退出时恢复原来的查表
+    Args:
+        yun_shu: 韵书代码
+        pingze: {汉字: 平仄代码}，须与 hanzi_to_pingze 的结果相同（由同一指纹的韵表算出）
+        yun: {汉字: 韵部列表}，须与 hanzi_to_yun 的结果相同（顺序也相同）
+    """
+    saved = [(table, table.get(yun_shu)) for table in (_precomputed_pingze, _precomputed_yun)]
+    _precomputed_pingze[yun_shu] = pingze
+    _precomputed_yun[yun_shu] = yun
+    try:
+        yield
+    finally:
+        for table, previous in saved:
+            if previous is None:
+                table.pop(yun_shu, None)
+            else:
+                table[yun_shu] = previous
 
 
 def result_check(post_result: str, temp_result: str) -> str:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压缩文件读写
+按扩展名（.gz/.zst/.xz）或文件头的魔数识别压缩格式，读取时流式解压，写出时流式压缩，
+调用方拿到的都是普通的二进制文件对象。gzip 和 xz 使用标准库，zstd 需要另外安装 zstandard。
+写出时可以指定压缩级别和（zstd 的）压缩线程数；JSONL 输出还可以按未压缩的字节数分卷（见 json_codec.JsonlWriter）。
+文件路径为 '-' 时读标准输入、写标准输出（不解压、不压缩），便于用管道串联多个脚本
+"""
+
+import glob
+import gzip
+import io
+import lzma
+import os
+import sys
+from typing import NamedTuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 扩展名 -> 压缩格式
+EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd', '.zstd': 'zstd', '.xz': 'xz'}
+# 文件头魔数 -> 压缩格式
+MAGIC_NUMBERS = ((b'\x1f\x8b', 'gzip'), (b'\x28\xb5\x2f\xfd', 'zstd'), (b'\xfd7zXZ\x00', 'xz'))
+# 未指定压缩级别时使用的级别
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3, 'xz': 6}
+# 表示标准输入/标准输出的文件路径
+STDIO_PATH = '-'
+
+
+class CompressOptions(NamedTuple):
+    """写出压缩文件的设置（parquet_codec 为 Parquet 输出的压缩编码）"""
+    level: int = None
+    threads: int = 0
+    max_part_bytes: int = 0
+    parquet_codec: str = 'zstd'
+
+
+def compression_of(file_path: str):
+    """由扩展名判断压缩格式，不是压缩文件时返回 None"""
+    return EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+
+
+def detect_compression(file_path: str):
+    """
+    判断已有文件的压缩格式：先看扩展名，再看文件头的魔数
+    Returns:
+        'gzip'、'zstd'、'xz'，不是压缩文件时返回 None
+    """
+    if file_path == STDIO_PATH:
+        return None
+    compression = compression_of(file_path)
+    if compression is not None:
+        return compression
+    with open(file_path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def strip_compression_suffix(file_path: str) -> str:
+    """去掉压缩扩展名：out.jsonl.gz -> out.jsonl"""
+    if compression_of(file_path) is not None:
+        return os.path.splitext(file_path)[0]
+    return file_path
+
+
+def part_path(file_path: str, index: int) -> str:
+    """分卷输出第 index 卷的路径：out.jsonl.gz -> out-00000.jsonl.gz"""
+    base = strip_compression_suffix(file_path)
+    stem, ext = os.path.splitext(base)
+    return f"{stem}-{index:05d}{ext}{file_path[len(base):]}"
+
+
+def expand_inputs(patterns) -> list:
+    """
+    展开输入的文件名和通配符，每个通配符内按文件名排序
+    Args:
+        patterns: 文件名或通配符，字符串或列表
+    Returns:
+        文件路径列表；某个通配符没有匹配的文件时抛出 FileNotFoundError
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"没有匹配的文件: {pattern}")
+        files.extend(matches)
+    return files
+
+
+def _open_stdio(stream, mode: str):
+    """
+    标准输入/输出的二进制文件对象，复制文件描述符后打开，关闭它不会关闭 sys.stdin/sys.stdout
+    """
+    if 'w' in mode:
+        sys.stdout.flush()
+    return os.fdopen(os.dup(stream.fileno()), mode)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("读写 .zst 文件需要安装 zstandard（pip install zstandard）")
+    return zstandard
+
+
+def open_input(file_path: str):
+    """
+    以二进制方式打开输入文件，压缩文件流式解压
+    Args:
+        file_path: 文件路径，'-' 表示标准输入
+    Returns:
+        可按行迭代的二进制文件对象
+    """
+    if file_path == STDIO_PATH:
+        return _open_stdio(sys.stdin, 'rb')
+    compression = detect_compression(file_path)
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+    if compression == 'xz':
+        return lzma.open(file_path, 'rb')
+    if compression == 'zstd':
+        reader = _require_zstandard().ZstdDecompressor().stream_reader(open(file_path, 'rb'),
+                                                                      read_across_frames=True)
+        return io.BufferedReader(reader)
+    return open(file_path, 'rb')
+
+
+def open_text_input(file_path: str, encoding: str = 'utf-8'):
+    """以文本方式打开输入文件，压缩文件流式解压"""
+    return io.TextIOWrapper(open_input(file_path), encoding=encoding)
+
+
+def open_output(file_path: str, options: CompressOptions = None):
+    """
+    以二进制方式打开输出文件，扩展名为 .gz/.zst/.xz 时流式压缩
+    Args:
+        file_path: 文件路径，'-' 表示标准输出
+        options: 压缩设置，None 表示使用默认级别、单线程
+    Returns:
+        二进制文件对象
+    """
+    if file_path == STDIO_PATH:
+        return _open_stdio(sys.stdout, 'wb')
+    compression = compression_of(file_path)
+    if compression is None:
+        return open(file_path, 'wb')
+    options = options or CompressOptions()
+    level = DEFAULT_LEVELS[compression] if options.level is None else options.level
+    if compression == 'gzip':
+        return gzip.open(file_path, 'wb', compresslevel=level)
+    if compression == 'xz':
+        return lzma.open(file_path, 'wb', preset=level)
+    compressor = _require_zstandard().ZstdCompressor(level=level, threads=options.threads)
+    return compressor.stream_writer(open(file_path, 'wb'))
+
+
+def add_compression_arguments(parser):
+    """给命令行解析器加上压缩输出的参数"""
+    parser.add_argument('--compress-level', type=int, default=None,
+                        help='输出文件名以 .gz/.zst/.xz 结尾时的压缩级别 (默认: gzip 6, zstd 3, xz 6)')
+    parser.add_argument('--compress-threads', type=int, default=0,
+                        help='zstd 压缩线程数，0 表示单线程 (默认: 0)')
+    parser.add_argument('--max-part-bytes', type=int, default=0,
+                        help='JSONL 输出按未压缩的字节数分卷（out-00000.jsonl.gz, ...），0 表示不分卷 (默认: 0)')
+    parser.add_argument('--parquet-compression', default='zstd', choices=['zstd', 'snappy', 'gzip', 'brotli', 'none'],
+                        help='输出文件名以 .parquet 结尾时的压缩编码，级别同 --compress-level (默认: zstd)')
+
+
+def compression_from_args(args) -> CompressOptions:
+    """由命令行参数得到压缩设置"""
+    return CompressOptions(args.compress_level, args.compress_threads, args.max_part_bytes, args.parquet_compression)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+诗歌去重
+按诗歌正文去重，保留每组重复中在输入里最先出现的一条：
+- 完全重复：只保留汉字（去掉标点、空白和括号内的注释）后的文本相同，比较其 64 位哈希
+- 近似重复：对汉字文本的字符 n-gram 计算 MinHash 签名，分成若干段做 LSH，任一段相同即视为近似重复，
+  判定阈值约为 Jaccard 相似度 (1/bands)^(1/rows)
+
+计算指纹（最耗时的部分）可以按字节范围切块并行；判定在主进程中按输入顺序进行，
+只记住保留下来的记录的哈希和各段的键，不保存正文，内存与记录数成正比但每条只占几十个字节
+"""
+
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import CompressOptions, detect_compression
+from poetry_scorer.jsonl_reader import iter_projected_records
+from poetry_scorer.poem_form import extract_chinese
+from poetry_scorer.sharding import ShardSpec, iter_jsonl_lines
+
+# 并行计算指纹时每个进程平均分到的字节范围数
+CHUNKS_PER_WORKER = 4
+# 报告中每条诗歌正文保留的字数
+REPORT_PREVIEW_CHARS = 40
+
+
+def normalize_text(text) -> str:
+    """只保留汉字（去掉标点、空白和括号内的注释），非字符串返回空串"""
+    if not isinstance(text, str):
+        return ''
+    return extract_chinese(text)
+
+
+def exact_key(normalized: str) -> int:
+    """汉字文本的 64 位哈希"""
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class MinHasher:
+    """字符 n-gram 的 MinHash 签名及其 LSH 分段键"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, ngram: int = 3, seed: int = 1):
+        """
+        Args:
+            num_perm: 签名长度（哈希函数个数），须为 bands 的整数倍
+            bands: LSH 段数，每段 num_perm // bands 行
+            ngram: 字符 n-gram 的长度
+            seed: 哈希函数的随机种子
+        """
+        if num_perm % bands:
+            raise ValueError(f"签名长度 {num_perm} 不是段数 {bands} 的整数倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.seed = seed
+        self._salt = b'%d:' % seed
+
+    @property
+    def threshold(self) -> float:
+        """近似重复判定的大致 Jaccard 相似度阈值"""
+        return (1 / self.bands) ** (1 / self.rows)
+
+    def signature(self, normalized: str) -> list:
+        """汉字文本的 MinHash 签名，文本短于 n 时整段作为一个 n-gram"""
+        # 按 UTF-32 编码后每个字正好 4 个字节，n-gram 直接按字节切片，不必逐个编码
+        data = normalized.encode('utf-32-le')
+        width = 4 * self.ngram
+        shingles = {data[i:i + width] for i in range(0, max(len(data) - width, 0) + 1, 4)}
+        # 每个 n-gram 用一次 SHAKE-128 生成 num_perm 个 32 位哈希值（相当于 num_perm 个独立的哈希函数），
+        # 再逐位取最小值，循环都在 C 代码中完成
+        size = 4 * self.num_perm
+        hashes = [memoryview(hashlib.shake_128(self._salt + shingle).digest(size)).cast('I') for shingle in shingles]
+        return list(map(min, zip(*hashes)))
+
+    def band_keys(self, normalized: str) -> tuple:
+        """LSH 各段的键（整数哈希，各进程中结果相同）"""
+        signature = self.signature(normalized)
+        rows = self.rows
+        return tuple(hash((band, *signature[band * rows:(band + 1) * rows])) for band in range(self.bands))
+
+
+def fingerprint(record: dict, content_field: str, hasher: MinHasher = None):
+    """
+    记录的去重指纹
+    Returns:
+        (完全重复哈希, LSH 分段键或 None)；正文为空（不含汉字）时返回 None，这样的记录不参与去重
+    """
+    normalized = normalize_text(record.get(content_field))
+    if not normalized:
+        return None
+    return exact_key(normalized), hasher.band_keys(normalized) if hasher is not None else None
+
+
+class Deduplicator:
+    """按输入顺序逐条判定是否重复，保留每组重复中最先出现的一条"""
+
+    def __init__(self):
+        # 完全重复哈希 -> 保留的记录序号
+        self._exact = {}
+        # LSH 分段键 -> 保留的记录序号
+        self._bands = {}
+        # 被去掉的记录序号 -> (保留的记录序号, 'exact' 或 'near')
+        self.dropped = {}
+        self.kept = 0
+
+    def add(self, seq: int, keys):
+        """
+        判定一条记录
+        Args:
+            seq: 记录序号
+            keys: fingerprint 的结果，None 表示不参与去重
+        Returns:
+            None 表示保留，否则为 (保留的记录序号, 'exact' 或 'near')
+        """
+        if keys is None:
+            self.kept += 1
+            return None
+        exact, bands = keys
+        match = self._exact.get(exact)
+        if match is not None:
+            self.dropped[seq] = (match, 'exact')
+            return self.dropped[seq]
+        if bands is not None:
+            for key in bands:
+                match = self._bands.get(key)
+                if match is not None:
+                    self.dropped[seq] = (match, 'near')
+                    return self.dropped[seq]
+            for key in bands:
+                self._bands[key] = seq
+        self._exact[exact] = seq
+        self.kept += 1
+        return None
+
+
+def fingerprint_file(file_path: str, content_field: str = 'content', hasher: MinHasher = None,
+                     shard: ShardSpec = None) -> tuple:
+    """
+    计算一个文件（或其中一个分片）中每条记录的指纹
+    Returns:
+        ([(序号, 指纹), ...], 无效行的序号列表)
+    """
+    invalid = []
+    fingerprints = [(seq, fingerprint(record, content_field, hasher))
+                    for seq, record in iter_projected_records(file_path, (content_field,), shard,
+                                                              on_invalid=lambda seq, line: invalid.append(seq))]
+    return fingerprints, invalid
+
+
+def _fingerprint_chunk(task):
+    """进程池中执行的指纹计算任务"""
+    return fingerprint_file(*task)
+
+
+def _preview(record: dict, content_field: str) -> str:
+    """报告中显示的正文开头"""
+    content = record.get(content_field)
+    return content[:REPORT_PREVIEW_CHARS] if isinstance(content, str) else ''
+
+
+def deduplicate_file(input_file: str, output_file: str, content_field: str = 'content', near: bool = True,
+                     hasher: MinHasher = None, workers: int = 1, options: CompressOptions = None,
+                     report_file: str = None) -> dict:
+    """
+    对 JSONL 文件去重，按原样写出保留的行
+    Args:
+        input_file: 输入 JSONL 文件路径（可以是压缩文件；workers 大于 1 时不支持压缩文件）
+        output_file: 输出 JSONL 文件路径
+        content_field: 诗歌正文字段名
+        near: 是否去掉近似重复
+        hasher: 近似重复使用的 MinHasher，None 表示默认参数
+        workers: 并行计算指纹的进程数
+        options: 输出的压缩和分卷设置
+        report_file: 报告文件路径：各组重复中保留和去掉的记录（序号及正文开头），None 表示不写报告
+    Returns:
+        统计信息
+    """
+    if near and hasher is None:
+        hasher = MinHasher()
+    if not near:
+        hasher = None
+    compressed = detect_compression(input_file) is not None
+    if workers > 1 and compressed:
+        raise ValueError("并行去重需要按字节范围切分输入，不支持压缩文件")
+    # 未压缩的文件整个按一个字节范围读取，序号为行首的字节偏移，与切块并行时相同
+    whole = None if compressed else ShardSpec(0, 1, 'range')
+
+    deduplicator = Deduplicator()
+    skipped = set()
+    if workers > 1:
+        num_chunks = workers * CHUNKS_PER_WORKER
+        tasks = [(input_file, content_field, hasher, ShardSpec(i, num_chunks, 'range')) for i in range(num_chunks)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(_fingerprint_chunk, tasks)
+            for fingerprints, invalid in chunks:
+                skipped.update(invalid)
+                for seq, keys in fingerprints:
+                    deduplicator.add(seq, keys)
+    else:
+        for seq, record in iter_projected_records(input_file, (content_field,), whole,
+                                                  on_invalid=lambda seq, line: skipped.add(seq)):
+            deduplicator.add(seq, fingerprint(record, content_field, hasher))
+
+    # 第二遍：按原样写出保留的行，同时收集报告中用到的正文
+    dropped = deduplicator.dropped
+    clusters = {}
+    if report_file is not None:
+        for seq, (kept_seq, kind) in dropped.items():
+            clusters.setdefault(kept_seq, []).append((seq, kind))
+    previews = {}
+    with json_codec.JsonlWriter(output_file, options=options) as writer:
+        for seq, line in iter_jsonl_lines(input_file, whole, as_bytes=True):
+            if seq in skipped:
+                continue
+            if report_file is not None and (seq in clusters or seq in dropped):
+                previews[seq] = _preview(json_codec.loads(line), content_field)
+            if seq not in dropped:
+                writer.write_line(line)
+
+    exact = sum(1 for _, kind in dropped.values() if kind == 'exact')
+    stats = {
+        'input_file': input_file,
+        'output_files': writer.paths,
+        'seq': 'byte_offset' if whole is not None else 'line_number',
+        'kept': deduplicator.kept,
+        'exact_duplicates': exact,
+        'near_duplicates': len(dropped) - exact,
+        'invalid_lines': len(skipped),
+    }
+    if hasher is not None:
+        stats['minhash'] = {'num_perm': hasher.num_perm, 'bands': hasher.bands, 'ngram': hasher.ngram,
+                            'threshold': round(hasher.threshold, 3)}
+    if report_file is not None:
+        report = {
+            'summary': stats,
+            'clusters': [{'kept': {'seq': kept_seq, 'content': previews.get(kept_seq, '')},
+                          'dropped': [{'seq': seq, 'match': kind, 'content': previews.get(seq, '')}
+                                      for seq, kind in members]}
+                         for kept_seq, members in sorted(clusters.items())],
+        }
+        json_codec.dump_file(report, report_file)
+    return stats
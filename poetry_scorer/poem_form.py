@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+诗体识别
+把诗句一次切分为汉字串和各句的字数，再据此判断诗体（五言/七言绝句、律诗、排律或其他）并给出置信度：
+- 有句读（换行或标点）时按各句字数判断：4 句为绝句，7~9 句为律诗（容忍多一句或少一句），10 句以上的偶数句为排律，
+  句长取 5、7 中出现较多的一个，置信度为与句长相同的句数 / max(句数, 该诗体的标准句数)
+- 没有句读时只能按总字数判断（form_of_length），置信度为 LENGTH_ONLY_CONFIDENCE
+
+评分器清理诗句用的 extract_chinese 也在这里定义，tokenize 得到的汉字串即 extract_chinese 的结果。
+评分器的格式分和提取器的自动归类只看清理后的总字数，共用 form_of_length 的规则
+"""
+
+import re
+from enum import Enum
+from typing import NamedTuple
+
+# 汉字的 Unicode 范围（含扩展区和兼容汉字）
+HANZI_RANGE = (r'\u2642\u2E80-\u2EFF\u2F00-\u2FDF\u4e00-\u9fff\u3400-\u4dbf\u3007\uF900-\uFAFF'
+               r'\U00020000-\U0002A6DF'
+               r'\U0002F800-\U0002FA1F')
+# 括号及其中的注释（不跨行）
+BRACKET_PATTERN = re.compile(r'[(（].*?[)）]')
+# 分句的字符：换行和句读标点（全角、半角）
+SENTENCE_BREAKS = '\n\r，。；！？,.;!?'
+_BREAK_PATTERN = re.compile(f'[{re.escape(SENTENCE_BREAKS)}]')
+# 连续的汉字
+_HANZI_RUN_PATTERN = re.compile(f'[{HANZI_RANGE}]+')
+# extract_chinese 用到的正则
+_HANZI_PATTERN = re.compile(f'[{HANZI_RANGE}]')
+_HANZI_COMMA_PATTERN = re.compile(f'[{HANZI_RANGE}' + r',\.\?!:，。？！、：]')
+
+# 只按总字数判断时的置信度
+LENGTH_ONLY_CONFIDENCE = 0.8
+
+
+class Form(Enum):
+    """诗体"""
+    FIVE_QUATRAIN = '五言绝句'
+    SEVEN_QUATRAIN = '七言绝句'
+    FIVE_REGULATED = '五言律诗'
+    SEVEN_REGULATED = '七言律诗'
+    PAILV = '排律'
+    OTHER = '其他'
+
+
+class PoemShape(NamedTuple):
+    """切分结果：汉字串（同 extract_chinese）和各句的汉字数（不含没有汉字的句子）"""
+    hanzi: str
+    line_lengths: tuple
+
+
+class FormResult(NamedTuple):
+    """识别结果：诗体、句长（5 或 7，无法判断时为 None）、句数和置信度（0~1，OTHER 为 0）"""
+    form: Form
+    sentence_length: int
+    num_lines: int
+    confidence: float
+
+
+OTHER = FormResult(Form.OTHER, None, 0, 0.0)
+
+
+def extract_chinese(text: str, comma_remain=False) -> str:
+    """删除输入文本中的非汉字部分以及括号内的部分"""
+    # 首先删除括号及其中的内容
+    text = BRACKET_PATTERN.sub('', text)
+    pattern = _HANZI_COMMA_PATTERN if comma_remain else _HANZI_PATTERN
+    filtered_text = ''.join(pattern.findall(text)).replace('\n', '')
+    return filtered_text
+
+
+def tokenize(text: str) -> PoemShape:
+    """
+    一次切分出汉字串和各句字数
+    Args:
+        text: 诗句原文
+    Returns:
+        PoemShape；非字符串返回空结果
+    """
+    if not isinstance(text, str):
+        return PoemShape('', ())
+    # 先分句，再取各句中连续的汉字，比逐字匹配少产生很多对象
+    find_runs = _HANZI_RUN_PATTERN.findall
+    parts = [''.join(find_runs(part)) for part in _BREAK_PATTERN.split(BRACKET_PATTERN.sub('', text))]
+    return PoemShape(''.join(parts), tuple(filter(None, map(len, parts))))
+
+
+def form_of_length(length: int):
+    """
+    只按汉字总数判断句长和句数：能被 5 整除按五言，否则能被 7 整除按七言
+    Returns:
+        (句长, 句数)，不符合时返回 None
+    """
+    if length == 0:
+        return None
+    if length % 5 == 0:
+        return 5, length // 5
+    if length % 7 == 0:
+        return 7, length // 7
+    return None
+
+
+def _typed_form(sentence_length: int, num_lines: int):
+    """句长和句数对应的诗体及其标准句数，不是绝句、律诗、排律时返回 (None, 0)"""
+    if num_lines == 4:
+        return (Form.FIVE_QUATRAIN if sentence_length == 5 else Form.SEVEN_QUATRAIN), 4
+    if 7 <= num_lines <= 9:
+        return (Form.FIVE_REGULATED if sentence_length == 5 else Form.SEVEN_REGULATED), 8
+    if num_lines >= 10 and num_lines % 2 == 0:
+        return Form.PAILV, num_lines
+    return None, 0
+
+
+def classify(text) -> FormResult:
+    """
+    识别诗体
+    Args:
+        text: 诗句原文，或 tokenize 的结果
+    Returns:
+        FormResult
+    """
+    shape = text if isinstance(text, PoemShape) else tokenize(text)
+    lengths = shape.line_lengths
+    num_lines = len(lengths)
+    if num_lines > 2:
+        sevens = lengths.count(7)
+        fives = lengths.count(5)
+        if sevens or fives:
+            sentence_length, matched = (7, sevens) if sevens >= fives else (5, fives)
+            form, standard = _typed_form(sentence_length, num_lines)
+            if form is None:
+                return OTHER
+            return FormResult(form, sentence_length, num_lines, matched / max(num_lines, standard))
+        return OTHER
+
+    # 没有句读（或只有一两处），按总字数切分
+    by_length = form_of_length(len(shape.hanzi))
+    if by_length is None:
+        return OTHER
+    sentence_length, num_lines = by_length
+    form, standard = _typed_form(sentence_length, num_lines)
+    if form is None or num_lines != standard:
+        return OTHER
+    return FormResult(form, sentence_length, num_lines, LENGTH_ONLY_CONFIDENCE)
+
+
+def classify_many(texts) -> list:
+    """
+    批量识别诗体，相同的诗句只识别一次
+    Args:
+        texts: 诗句原文的可迭代对象
+    Returns:
+        与输入一一对应的 FormResult 列表
+    """
+    cache = {}
+    results = []
+    append = results.append
+    for text in texts:
+        result = cache.get(text) if isinstance(text, str) else None
+        if result is None:
+            result = classify(text)
+            if isinstance(text, str):
+                cache[text] = result
+        append(result)
+    return results
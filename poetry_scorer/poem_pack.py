@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+诗歌语料的二进制打包格式
+把 JSONL / JSON / Parquet 语料一次转换为紧凑的二进制文件，评分和提取时用 mmap 直接读取，不再解析 JSON：
+- 诗句原文、清理后的汉字串（tokenize / extract_chinese 的结果）和保留句读的汉字串，各自存为 UTF-32 码点数组加偏移数组
+- 指令存为枚举列（uint16 下标，取值表在文件尾），记录的 id 存为 int64 列（全为整数时）或 UTF-8 字符串加偏移
+- 可选：需要原样保留的其他字段（如标题、作者），字符串存为 UTF-8 加偏移，其他类型的值存为 JSON 文本
+- 可选：语料中出现的每个汉字在各韵书下的平仄代码和韵部列表，连同当时韵表的指纹（common.rhyme_table_fingerprint）；
+  读取时指纹与当前韵表相同才在打包文件关闭之前用于评分查表（common.precomputed_codes），不再逐字查韵表
+
+文件格式（小端）：32 字节文件头 = 8 字节魔数 b'POEMPACK'，uint32 版本，uint32 保留，uint64 尾部信息偏移，uint64 尾部信息长度；
+随后是按 8 字节对齐的各数据段，最后是 JSON 格式的尾部信息（记录数、字段名、指令取值表、各数据段的偏移、长度和类型码）。
+数据段都是定长数组，可以直接用 numpy.frombuffer 按偏移读取
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from contextlib import ExitStack
+
+from poetry_scorer import json_codec
+from poetry_scorer.common.common import hanzi_to_pingze, hanzi_to_yun, precomputed_codes, rhyme_table_fingerprint
+from poetry_scorer.poem_form import extract_chinese, tokenize
+from poetry_scorer.sharding import ShardSpec
+
+PACK_MAGIC = b'POEMPACK'
+PACK_VERSION = 1
+PACK_EXTENSION = '.poempack'
+_HEADER = struct.Struct('<8sIIQQ')
+_ALIGN = 8
+# 可以预先计算平仄和韵部的韵书及其代码
+RHYME_SYSTEM_IDS = {'pingshui': 1, 'xin': 2, 'tong': 3}
+# 指令缺失时的枚举值
+MISSING_INSTRUCT = 0xFFFF
+# 记录标志位：有诗句、原记录有 id 字段
+FLAG_HAS_POEM = 1
+FLAG_HAS_ID = 2
+# 保留字段的值类型：缺失、字符串、JSON 文本
+FIELD_MISSING = 0
+FIELD_STR = 1
+FIELD_JSON = 2
+# 三个文本列：(数据段名, 由诗句原文得到该列的函数)
+_TEXT_COLUMNS = (
+    ('poem', lambda poem: poem),
+    ('hanzi', lambda poem: tokenize(poem).hanzi),
+    ('hanzi_comma', lambda poem: extract_chinese(poem, comma_remain=True)),
+)
+
+
+class PackedRecord(dict):
+    """从打包文件读出的记录：字典部分与原记录相同（只含 id、诗句、指令和保留字段），另带清理好的汉字串，评分时不必再清理"""
+    __slots__ = ('hanzi', 'hanzi_comma')
+
+
+def is_poem_pack(file_path: str) -> bool:
+    """由文件头的魔数判断是否为打包文件"""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(PACK_MAGIC)) == PACK_MAGIC
+    except OSError:
+        return False
+
+
+def _to_little_endian(values: array) -> array:
+    """大端机器上写出前转换字节序"""
+    if sys.byteorder != 'little' and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class _PackWriter:
+    """依次写出各数据段，记录其位置"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+        f.write(b'\0' * _HEADER.size)
+
+    def _start(self, name: str, typecode: str):
+        offset = self.f.tell()
+        self.sections[name] = [offset, 0, typecode]
+        return offset
+
+    def _finish(self, name: str, offset: int):
+        nbytes = self.f.tell() - offset
+        self.sections[name][1] = nbytes
+        self.f.write(b'\0' * (-nbytes % _ALIGN))
+
+    def add_array(self, name: str, values: array):
+        offset = self._start(name, values.typecode)
+        _to_little_endian(values).tofile(self.f)
+        self._finish(name, offset)
+
+    def add_file(self, name: str, source, typecode: str):
+        """把临时文件中的内容作为一个数据段写出"""
+        offset = self._start(name, typecode)
+        source.seek(0)
+        shutil.copyfileobj(source, self.f)
+        self._finish(name, offset)
+
+    def close(self, info: dict):
+        info['sections'] = self.sections
+        footer = json_codec.dumps(info)
+        footer_offset = self.f.tell()
+        self.f.write(footer)
+        self.f.seek(0)
+        self.f.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, footer_offset, len(footer)))
+
+
+def _rhyme_codes(chars: list, yun_shu: int) -> tuple:
+    """各汉字在给定韵书下的平仄代码（uint8）、韵部列表的偏移和拼接的韵部（int16）"""
+    pingze = array('B')
+    yun_offsets = array('I', [0])
+    yun = array('h')
+    for char in chars:
+        pingze.append(int(hanzi_to_pingze(char, yun_shu, False)))
+        yun.extend(hanzi_to_yun(char, yun_shu, False))
+        yun_offsets.append(len(yun))
+    return pingze, yun_offsets, yun
+
+
+def write_pack(records, output_path: str, poem_field: str, instruct_field: str, id_field: str = 'id',
+               keep_fields=(), rhyme_systems=()) -> dict:
+    """
+    把记录写成打包文件（先写临时文件再替换）
+    Args:
+        records: (序号, 记录) 的迭代器
+        output_path: 输出文件路径
+        poem_field: 诗句字段名
+        instruct_field: 指令字段名
+        id_field: id 字段名，记录中没有该字段时用输入中的序号作为 id
+        keep_fields: 需要原样保留的其他字段
+        rhyme_systems: 需要预先计算平仄和韵部的韵书（RHYME_SYSTEM_IDS 的键）
+    Returns:
+        统计信息：记录数、缺少诗句 / 指令的记录数、指令取值数、汉字数
+    """
+    unknown = [name for name in rhyme_systems if name not in RHYME_SYSTEM_IDS]
+    if unknown:
+        raise ValueError(f"未知的韵书: {unknown}（可选: {list(RHYME_SYSTEM_IDS)}）")
+
+    keep_fields = [field for field in dict.fromkeys(keep_fields) if field not in (poem_field, instruct_field, id_field)]
+    text_files = {name: tempfile.TemporaryFile() for name, _ in _TEXT_COLUMNS}
+    field_files = [tempfile.TemporaryFile() for _ in keep_fields]
+    field_offsets = [array('Q', [0]) for _ in keep_fields]
+    field_kinds = [array('B') for _ in keep_fields]
+    text_offsets = {name: array('Q', [0]) for name, _ in _TEXT_COLUMNS}
+    instructs = {}
+    instruct_codes = array('H')
+    flags = array('B')
+    ids = []
+    chars = set()
+    stats = {'records': 0, 'missing_poem': 0, 'missing_instruct': 0}
+
+    tmp_path = output_path + '.tmp'
+    try:
+        for seq, record in records:
+            poem = record.get(poem_field)
+            instruct = record.get(instruct_field)
+            record_id = record.get(id_field)
+
+            # 非字符串的诗句、指令按缺失处理（评分时跳过这条记录）
+            flag = 0
+            if isinstance(poem, str):
+                flag |= FLAG_HAS_POEM
+            else:
+                poem = ''
+                stats['missing_poem'] += 1
+            if isinstance(instruct, str):
+                code = instructs.setdefault(instruct, len(instructs))
+                if code >= MISSING_INSTRUCT:
+                    raise ValueError(f"指令的取值超过 {MISSING_INSTRUCT} 种，不适合存为枚举")
+            else:
+                code = MISSING_INSTRUCT
+                stats['missing_instruct'] += 1
+            if record_id is not None:
+                flag |= FLAG_HAS_ID
+            else:
+                record_id = seq
+
+            for name, convert in _TEXT_COLUMNS:
+                text = convert(poem)
+                if name == 'hanzi':
+                    chars.update(text)
+                text_files[name].write(text.encode('utf-32-le'))
+                text_offsets[name].append(text_offsets[name][-1] + len(text))
+            for i, field in enumerate(keep_fields):
+                value = record.get(field)
+                if value is None:
+                    kind, data = FIELD_MISSING, b''
+                elif isinstance(value, str):
+                    kind, data = FIELD_STR, value.encode('utf-8')
+                else:
+                    kind, data = FIELD_JSON, json_codec.dumps(value)
+                field_files[i].write(data)
+                field_offsets[i].append(field_offsets[i][-1] + len(data))
+                field_kinds[i].append(kind)
+            instruct_codes.append(code)
+            flags.append(flag)
+            ids.append(record_id)
+            stats['records'] += 1
+
+        with open(tmp_path, 'wb') as f:
+            writer = _PackWriter(f)
+            for name, _ in _TEXT_COLUMNS:
+                writer.add_array(f'{name}_offsets', text_offsets[name])
+                writer.add_file(name, text_files[name], 'I')
+            writer.add_array('instruct', instruct_codes)
+            writer.add_array('flags', flags)
+            for i in range(len(keep_fields)):
+                writer.add_array(f'field{i}_kinds', field_kinds[i])
+                writer.add_array(f'field{i}_offsets', field_offsets[i])
+                writer.add_file(f'field{i}', field_files[i], 'B')
+
+            # id 全为整数（不含 bool）时存为 int64，否则统一转成字符串
+            int_ids = all(type(record_id) is int and -2 ** 63 <= record_id < 2 ** 63 for record_id in ids)
+            if int_ids:
+                writer.add_array('ids', array('q', ids))
+            else:
+                encoded = [str(record_id).encode('utf-8') for record_id in ids]
+                id_offsets = array('Q', [0])
+                for item in encoded:
+                    id_offsets.append(id_offsets[-1] + len(item))
+                writer.add_array('id_offsets', id_offsets)
+                writer.add_array('id_text', array('B', b''.join(encoded)))
+
+            sorted_chars = sorted(chars)
+            if rhyme_systems:
+                writer.add_array('chars', array('I', map(ord, sorted_chars)))
+                for name in rhyme_systems:
+                    pingze, yun_offsets, yun = _rhyme_codes(sorted_chars, RHYME_SYSTEM_IDS[name])
+                    writer.add_array(f'pingze_{name}', pingze)
+                    writer.add_array(f'yun_{name}_offsets', yun_offsets)
+                    writer.add_array(f'yun_{name}', yun)
+
+            writer.close({
+                'count': stats['records'],
+                'poem_field': poem_field,
+                'instruct_field': instruct_field,
+                'id_field': id_field,
+                'id_type': 'int' if int_ids else 'str',
+                'instructs': list(instructs),
+                'keep_fields': keep_fields,
+                'rhyme_systems': list(rhyme_systems),
+                'rhyme_fingerprint': rhyme_table_fingerprint() if rhyme_systems else None,
+            })
+        os.replace(tmp_path, output_path)
+    finally:
+        for f in [*text_files.values(), *field_files]:
+            f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    stats['instructs'] = len(instructs)
+    stats['chars'] = len(chars)
+    return stats
+
+
+class PoemPack:
+    """用 mmap 打开的打包文件，按下标读取记录"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        # install_rhyme_codes 载入的查表，关闭时恢复
+        self._rhyme_tables = ExitStack()
+        self._file = open(file_path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{file_path} 不是有效的打包文件（文件为空）")
+        self._views = []
+        try:
+            magic, version, _, footer_offset, footer_size = _HEADER.unpack_from(self._mm)
+            if magic != PACK_MAGIC:
+                raise ValueError(f"{file_path} 不是有效的打包文件")
+            if version != PACK_VERSION:
+                raise ValueError(f"不支持的打包文件版本: {version}")
+            info = json_codec.loads(self._mm[footer_offset:footer_offset + footer_size])
+            self._sections = info['sections']
+            self.count = info['count']
+            self.poem_field = info['poem_field']
+            self.instruct_field = info['instruct_field']
+            self.id_field = info['id_field']
+            self.instructs = info['instructs']
+            self.rhyme_systems = info['rhyme_systems']
+            self.rhyme_fingerprint = info.get('rhyme_fingerprint')
+            self.keep_fields = info['keep_fields']
+
+            self._text = {name: self._section(name, raw=True) for name, _ in _TEXT_COLUMNS}
+            self._text_offsets = {name: self._section(f'{name}_offsets') for name, _ in _TEXT_COLUMNS}
+            self._instruct = self._section('instruct')
+            self._flags = self._section('flags')
+            self._fields = [(field, self._section(f'field{i}_kinds'), self._section(f'field{i}_offsets'),
+                             self._section(f'field{i}', raw=True)) for i, field in enumerate(self.keep_fields)]
+            if info['id_type'] == 'int':
+                self._ids = self._section('ids')
+            else:
+                self._ids = None
+                self._id_offsets = self._section('id_offsets')
+                self._id_text = self._section('id_text', raw=True)
+        except (struct.error, KeyError) as e:
+            self.close()
+            raise ValueError(f"{file_path} 不是有效的打包文件: {e}") from e
+        except Exception:
+            self.close()
+            raise
+
+    def _section(self, name: str, raw: bool = False):
+        """数据段的只读视图：raw 为 True 时为字节视图，否则按类型码转换（大端机器上复制为 array 并转换字节序）"""
+        offset, nbytes, typecode = self._sections[name]
+        view = memoryview(self._mm)[offset:offset + nbytes]
+        self._views.append(view)
+        if raw or typecode == 'B':
+            return view
+        if sys.byteorder != 'little':
+            values = array(typecode)
+            values.frombytes(view)
+            values.byteswap()
+            return values
+        cast = view.cast(typecode)
+        self._views.append(cast)
+        return cast
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text(self, name: str, index: int) -> str:
+        """第 index 条记录的文本列：'poem'（原文）、'hanzi' 或 'hanzi_comma'"""
+        offsets = self._text_offsets[name]
+        return str(self._text[name][4 * offsets[index]:4 * offsets[index + 1]], 'utf-32-le')
+
+    def instruct(self, index: int):
+        """第 index 条记录的指令，缺失时为 None"""
+        code = self._instruct[index]
+        return None if code == MISSING_INSTRUCT else self.instructs[code]
+
+    def record_id(self, index: int):
+        """第 index 条记录的 id（原记录没有 id 时为打包时的输入序号）"""
+        if self._ids is not None:
+            return self._ids[index]
+        return str(self._id_text[self._id_offsets[index]:self._id_offsets[index + 1]], 'utf-8')
+
+    def record(self, index: int) -> PackedRecord:
+        """第 index 条记录（id、诗句、指令和保留字段），缺失的字段不出现在记录中（与 JSONL 中缺少字段相同）"""
+        record = PackedRecord()
+        flags = self._flags[index]
+        if flags & FLAG_HAS_ID:
+            record[self.id_field] = self.record_id(index)
+        if flags & FLAG_HAS_POEM:
+            record[self.poem_field] = self.text('poem', index)
+        instruct = self.instruct(index)
+        if instruct is not None:
+            record[self.instruct_field] = instruct
+        for field, kinds, offsets, data in self._fields:
+            kind = kinds[index]
+            if kind != FIELD_MISSING:
+                value = data[offsets[index]:offsets[index + 1]]
+                record[field] = str(value, 'utf-8') if kind == FIELD_STR else json_codec.loads(bytes(value))
+        record.hanzi = self.text('hanzi', index)
+        record.hanzi_comma = self.text('hanzi_comma', index)
+        return record
+
+    def indices(self, shard: ShardSpec = None) -> range | list:
+        """属于本分片的记录下标：hash 模式按下标哈希分配，range 模式把记录按顺序等分成 num_shards 段"""
+        if shard is None:
+            return range(self.count)
+        if shard.mode == 'range':
+            return range(self.count * shard.index // shard.num_shards,
+                         self.count * (shard.index + 1) // shard.num_shards)
+        return [i for i in range(self.count) if shard.owns(i)]
+
+    def iter_records(self, shard: ShardSpec = None):
+        """
+        逐条读取属于本分片的记录
+        Returns:
+            (下标, PackedRecord) 的迭代器
+        """
+        for index in self.indices(shard):
+            yield index, self.record(index)
+
+    def rhyme_codes(self, rhyme_system: str) -> tuple:
+        """
+        预先计算的平仄和韵部
+        Returns:
+            ({汉字: 平仄代码}, {汉字: 韵部列表})，打包时未计算该韵书时返回 None
+        """
+        if rhyme_system not in self.rhyme_systems:
+            return None
+        chars = [chr(code) for code in self._section('chars')]
+        pingze = self._section(f'pingze_{rhyme_system}')
+        yun_offsets = self._section(f'yun_{rhyme_system}_offsets')
+        yun = self._section(f'yun_{rhyme_system}')
+        return ({char: str(pingze[i]) for i, char in enumerate(chars)},
+                {char: list(yun[yun_offsets[i]:yun_offsets[i + 1]]) for i, char in enumerate(chars)})
+
+    def install_rhyme_codes(self) -> list:
+        """
+        在打包文件关闭之前，把打包时计算的平仄和韵部用于评分查表（关闭时恢复原来的查表）
+        Returns:
+            用上的韵书；打包后韵表有改动（指纹不同）时不使用，返回空列表，评分时仍逐字查韵表
+        """
+        if not self.rhyme_systems:
+            return []
+        if self.rhyme_fingerprint != rhyme_table_fingerprint():
+            print(f"警告：{self.file_path} 打包后韵表有改动，不使用其中预先计算的平仄和韵部", file=sys.stderr)
+            return []
+        for name in self.rhyme_systems:
+            self._rhyme_tables.enter_context(precomputed_codes(RHYME_SYSTEM_IDS[name], *self.rhyme_codes(name)))
+        return list(self.rhyme_systems)
+
+    def close(self):
+        self._rhyme_tables.close()
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_pack_records(file_path: str, shard: ShardSpec = None):
+    """
+    打开打包文件，用预先计算的平仄和韵部查表，逐条读取属于本分片的记录（读完后关闭文件并恢复原来的查表）
+    Returns:
+        (下标, PackedRecord) 的迭代器
+    """
+    with PoemPack(file_path) as pack:
+        pack.install_rhyme_codes()
+        yield from pack.iter_records(shard)
@@ -15,24 +15,57 @@ python poetry_quality_extractor.py split2_1000.jsonl split2_1000_filtered.json \
   --is-jsonl
 """
 
-import json
+import heapq
 import os
 import sys
 import argparse
+import itertools
 from collections import defaultdict
-
-# 添加项目路径
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
-from poetry_scorer_jiujiu import PoetryScorer, extract_chinese
+from enum import Enum
+
+if __package__ in (None, ''):
+    # 直接以脚本方式运行时，用项目根目录替换脚本所在目录，保证只经由 poetry_scorer 包导入（避免韵表被重复加载）
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import (CompressOptions, add_compression_arguments, compression_from_args,
+                                         strip_compression_suffix)
+from poetry_scorer.json_array_reader import is_json_array, iter_json_array
+from poetry_scorer.jsonl_reader import iter_projected_records
+from poetry_scorer.parquet_io import PARQUET_EXTENSIONS, is_parquet, iter_parquet_records, write_parquet
+from poetry_scorer.poem_form import form_of_length, tokenize
+from poetry_scorer.poem_pack import PackedRecord, is_poem_pack, iter_pack_records
+from poetry_scorer.poetry_scorer_jiujiu import PoetryScorer
+from poetry_scorer.score_stats import ScoreStats
+from poetry_scorer.score_store import ScoreStore
+from poetry_scorer.sharding import ShardSpec, add_shard_arguments, check_shards, shard_from_args
+
+
+class PoemForm(Enum):
+    """指令中明确要求的诗体，值为对应的类别键；UNSPECIFIED 表示需按诗句长度判断"""
+    FIVE_QUATRAIN = 'five_quatrain'
+    SEVEN_QUATRAIN = 'seven_quatrain'
+    EIGHT_FIVE = 'eight_five'
+    EIGHT_SEVEN = 'eight_seven'
+    UNSPECIFIED = None
 
 
 class PoetryQualityExtractor:
     """优质诗词提取器"""
 
+    # 诗句和格律字段的可选名称，兼容多种常见命名方式（用户指定的字段名优先）
+    POEM_FIELD_CANDIDATES = ("prediction", "text", "content", "poem", "poetry")
+    INSTRUCT_FIELD_CANDIDATES = ("instruct", "prompt", "type", "poem_type", "format")
+    # 指令解析缓存的最大条目数，指令通常只有少数几种取值
+    INSTRUCT_CACHE_SIZE = 4096
+    # 按总字数判断出的 (句长, 句数) -> 类别
+    LENGTH_CATEGORIES = {(5, 4): 'five_quatrain', (7, 4): 'seven_quatrain', (5, 8): 'eight_five', (7, 8): 'eight_seven'}
+
     def __init__(self, rhyme_system='pingshui'):
         self.scorer = PoetryScorer()
         self.rhyme_system = rhyme_system
+        # 指令字符串 -> (诗体, 评分器的指令解析结果)
+        self._instruct_cache = {}
         # 四个类别：五言绝句、七言绝句、五言律诗、七言律诗
         self.categories = {
             'five_quatrain': {'name': '五言绝句', 'poem_type': '绝句', 'sentence_length': 5},
@@ -79,147 +112,464 @@ class PoetryQualityExtractor:
             'original_instruct': instruct
         }
 
+    def parse_instruct_form(self, instruct: str) -> tuple:
+        """
+        把指令解析为诗体枚举，同时给出评分器所需的指令解析结果，每种指令只解析一次。
+        Args:
+            instruct: 指令字符串
+        Returns:
+            (PoemForm, 评分器 parse_instruct 的结果)，调用方不应修改返回的字典
+        """
+        parsed = self._instruct_cache.get(instruct)
+        if parsed is None:
+            instruct_info = self.parse_instruct(instruct)
+            form = PoemForm.UNSPECIFIED
+            for key, value in self.categories.items():
+                if (instruct_info['poem_type'] == value['poem_type'] and
+                        instruct_info['sentence_length'] == value['sentence_length']):
+                    form = PoemForm(key)
+                    break
+            parsed = (form, self.scorer.parse_instruct(instruct))
+            if len(self._instruct_cache) < self.INSTRUCT_CACHE_SIZE:
+                self._instruct_cache[instruct] = parsed
+        return parsed
+
+    def resolve_schema(self, sample: list, poem_field: str, instruct_field: str,
+                       strict: bool = False) -> tuple:
+        """
+        根据数据集开头的若干条记录确定整个数据集使用的诗句字段和格律字段。
+        每类字段按候选顺序取第一个在样本中出现过的名称。
+        Args:
+            sample: 数据集开头的记录
+            poem_field: 用户指定的诗句字段名
+            instruct_field: 用户指定的格律字段名
+            strict: 为 True 时要求样本中每条记录都含有用户指定的字段，否则抛出 ValueError
+        Returns:
+            (诗句字段名, 格律字段名)
+        """
+        resolved = []
+        for name, field, candidates in (('诗句', poem_field, self.POEM_FIELD_CANDIDATES),
+                                        ('格律', instruct_field, self.INSTRUCT_FIELD_CANDIDATES)):
+            if strict:
+                for i, item in enumerate(sample):
+                    if field not in item:
+                        raise ValueError(f"第 {i + 1} 条记录缺少{name}字段 '{field}'")
+                resolved.append(field)
+                continue
+
+            candidates = [field] + [c for c in candidates if c != field]
+            actual = next((c for c in candidates if any(c in item for item in sample)), None)
+            if actual is None:
+                raise ValueError(f"在前 {len(sample)} 条记录中未找到{name}字段（尝试的字段: {candidates}）")
+            if actual != field:
+                print(f"警告: 未找到{name}字段 '{field}'，改用 '{actual}'")
+            resolved.append(actual)
+        return tuple(resolved)
+
     def process_dataset(self, input_file: str, poem_field: str, instruct_field: str,
                         output_file: str, max_per_category: dict, keep_fields: list,
-                        is_jsonl: bool = False) -> dict:
-        """处理数据集并提取优质数据"""
+                        is_jsonl: bool = False, streaming: bool = False,
+                        stop_when_perfect: bool = False, schema_sample: int = 100,
+                        strict_schema: bool = False, item_scores_in_stats: bool = False,
+                        shard: ShardSpec = None, compression: CompressOptions = None,
+                        store: ScoreStore = None, id_field: str = 'id') -> dict:
+        """
+        处理数据集并提取优质数据。
+        每个类别只用一个大小为 max_per_category 的最小堆保留当前最高分的记录，同分时先出现的记录优先，
+        与“全部评分后稳定排序再截断”的结果完全一致；保留的记录只含 keep_fields 中的字段。
+        streaming 为 True 时逐条读取输入，不再先把整个数据集读入内存（JSON 数组也逐个元素解析）；
+        不指定 is_jsonl 时按首个非空白字节区分 JSON 数组和 JSONL。
+        类别配额已满时按 格式 -> 平水韵平仄 -> 押韵 分阶段估计总分上界，上界不超过堆中最低分
+        （同分时新记录不会入选）的记录不再继续评分，保留结果不变；
+        stop_when_perfect 为 True 时所有类别的配额都被满分记录占满后停止读取（之后的记录不可能入选）。
+        诗句和格律字段由开头 schema_sample 条记录一次确定（见 resolve_schema），缺少字段的记录跳过并计数；
+        strict_schema 为 True 时遇到缺少字段的记录直接报错。
+        统计报告默认只含各类别的均值和分布，item_scores_in_stats 为 True 时额外保留每条记录的分数。
+        指定 shard 时只处理属于该分片的记录，并另存各类别保留的记录和计数（见 merge_shards）。
+        输入可以是 .gz/.zst/.xz 压缩文件、Parquet 文件（按扩展名或文件头识别，只读取需要的列）
+        或 poem_pack 打包文件（按文件头识别，mmap 读取，使用打包时清理好的诗句，只含 id、诗句、指令和打包时保留的字段）；
+        输出文件名以 .gz/.zst/.xz 结尾时按 compression 的设置压缩，以 .parquet 结尾时写成 Parquet。
+        指定 store 时每条归类成功的记录都完整评分（不剪枝，计算三种韵书的押韵分），连同 id_field 字段的值写入评分数据库，
+        之后可用 query_store 换配额、分数门槛或韵书重新筛选，不必重新评分。
+        """
         try:
-            # 读取输入文件
-            if is_jsonl:
-                dataset = self._read_jsonl_file(input_file)
+            if store is not None and stop_when_perfect:
+                raise ValueError("写入评分数据库时需要评分全部记录，不能同时提前停止")
+            # 读取输入文件，记录的序号在整个输入中全局有序；
+            # JSON、JSONL 和 Parquet 只解码可能用到的字段：诗句、格律字段的候选名称和需要保留的字段
+            fields = {poem_field, instruct_field, *self.POEM_FIELD_CANDIDATES,
+                      *self.INSTRUCT_FIELD_CANDIDATES, *keep_fields}
+            if store is not None:
+                fields.add(id_field)
+            if is_poem_pack(input_file):
+                dataset = iter_pack_records(input_file, shard)
+            elif is_parquet(input_file):
+                dataset = iter_parquet_records(input_file, fields, shard)
+            elif is_jsonl or not is_json_array(input_file):
+                dataset = self._iter_jsonl_file(input_file, shard, fields)
             else:
-                dataset = self._read_json_file(input_file)
+                dataset = self._iter_json_file(input_file, shard, fields)
 
-            print(f"成功读取 {len(dataset)} 条数据")
+            if not streaming:
+                dataset = list(dataset)
+                print(f"成功读取 {len(dataset)} 条数据")
+                head = dataset[:schema_sample]
+            else:
+                head = list(itertools.islice(dataset, schema_sample))
+                dataset = itertools.chain(head, dataset)
 
-            # 分类数据
-            categorized_data = defaultdict(list)
-            total_scored = 0
+            sample = [item for _, item in head]
+            poem_field, instruct_field = self.resolve_schema(sample, poem_field, instruct_field, strict_schema)
+            print(f"诗句字段: {poem_field}，格律字段: {instruct_field}")
 
-            for item in dataset:
-                # 诗句和格律字段的可选名称列表
-                # 兼容多种常见命名方式
-                poem_field_candidates = [poem_field, "prediction", "text", "content", "poem", "poetry"]
-                instruct_field_candidates = [instruct_field, "instruct", "prompt", "type", "poem_type", "format"]
-
-                # 查找实际存在的字段
-                actual_poem_field = None
-                for field in poem_field_candidates:
-                    if field in item:
-                        actual_poem_field = field
-                        break
-
-                actual_instruct_field = None
-                for field in instruct_field_candidates:
-                    if field in item:
-                        actual_instruct_field = field
-                        break
-
-                if not actual_poem_field:
-                    print(f"警告: 在记录中未找到诗句字段（尝试的字段: {poem_field_candidates}）")
+            # 分类数据：每个类别一个 (总分, -序号, 记录) 的最小堆
+            category_heaps = defaultdict(list)
+            category_counts = defaultdict(int)
+            total_scored = 0
+            # 过滤阶段被跳过的记录数
+            skipped = {'missing_poem_field': 0, 'missing_instruct_field': 0, 'uncategorized': 0}
+            # 评分阶段被上界剪枝的记录数
+            pruned = {'format': 0, 'pingze': 0}
+            stopped_early = False
+            if store is not None:
+                store.begin_run(input_file, shard)
+
+            for seq, item in dataset:
+                poem = item.get(poem_field)
+                instruct = item.get(instruct_field)
+                if poem is None or instruct is None:
+                    missing_field = poem_field if poem is None else instruct_field
+                    if strict_schema:
+                        raise ValueError(f"记录缺少字段 '{missing_field}'（序号 {seq}）")
+                    skipped['missing_poem_field' if poem is None else 'missing_instruct_field'] += 1
                     continue
 
-                if not actual_instruct_field:
-                    print(f"警告: 在记录中未找到格律字段（尝试的字段: {instruct_field_candidates}）")
+                # 过滤阶段：解析指令、清理诗句并确定类别，无法归类的记录不再评分
+                form, instruct_info = self.parse_instruct_form(instruct)
+                packed = type(item) is PackedRecord
+                processed = item.hanzi if packed else tokenize(poem).hanzi
+                category = self._determine_category(processed, form)
+                if category is None:
+                    skipped['uncategorized'] += 1
                     continue
 
-                poem = item[actual_poem_field]
-                instruct = item[actual_instruct_field]
-
-                # 评分
-                score_result = self.scorer.score_poem(poem, instruct, self.rhyme_system)
-
-                # 解析指令以确定类别
-                instruct_info = self.parse_instruct(instruct)
+                category_counts[category] += 1
+                total_scored += 1
+                if total_scored % 100 == 0:
+                    print(f"已处理 {total_scored} 条数据...")
 
-                # 确定类别
-                category = self._determine_category(poem, instruct_info)
-                if category is None:
+                # 评分阶段：只校验选中的韵书（平仄分所需的平水韵除外），配额已满时按堆中最低分剪枝；
+                # 写入评分数据库时校验全部韵书且不剪枝
+                max_count = max_per_category.get(category)
+                min_total = self._heap_floor(category_heaps[category], max_count) if store is None else None
+                score_result = self.scorer.score_poem(poem, instruct, self.rhyme_system,
+                                                      all_rhyme_systems=store is not None, processed=processed,
+                                                      processed_comma=item.hanzi_comma if packed else None,
+                                                      instruct_info=instruct_info, min_total=min_total)
+                if 'pruned' in score_result:
+                    pruned[score_result['pruned']] += 1
                     continue
 
-                # 添加评分信息
+                # 添加评分信息，原始记录只保留需要输出的字段
                 scored_item = {
-                    'original_data': item,
+                    'original_data': {field: item[field] for field in keep_fields if field in item},
+                    'poem': poem,
                     'scores': score_result,
                     'total_score': (score_result['format_score'] +
                                     score_result['pingze_score'] +
                                     score_result['rhyme_score']) / 3,
                     'category': category,
-                    'poem_length': len(extract_chinese(poem)),
+                    'poem_length': len(processed),
                     'determined_category': self.categories[category]['name']
                 }
 
-                categorized_data[category].append(scored_item)
-                total_scored += 1
+                self._push_top_k(category_heaps[category], max_count,
+                                 (scored_item['total_score'], -seq, scored_item))
+                if store is not None:
+                    store.add(seq, item.get(id_field), category, poem, len(processed), score_result,
+                              scored_item['original_data'])
 
-                if total_scored % 100 == 0:
-                    print(f"已处理 {total_scored} 条数据...")
-
-            print(f"完成评分，共处理 {total_scored} 条数据")
-
-            # 按类别统计
-            for category, items in categorized_data.items():
-                print(f"{self.categories[category]['name']}: {len(items)} 条")
-
-                # 按分数排序（降序）
-                items.sort(key=lambda x: x['total_score'], reverse=True)
-
-                # 限制数量
-                max_count = max_per_category.get(category, float('inf'))
-                filtered_items = items[:max_count]
-                categorized_data[category] = filtered_items
-
-                print(f"  筛选后保留 {len(filtered_items)} 条")
-                if filtered_items:
-                    avg_score = sum(item['total_score'] for item in filtered_items) / len(filtered_items)
-                    print(f"  平均分: {avg_score:.2f}")
-
-                # 显示最高分的几首
-                print(f"  前三名:")
-                for i, item in enumerate(filtered_items[:3]):
-                    print(f"    {i + 1}. 总分: {item['total_score']:.2f} - "
-                          f"格式:{item['scores']['format_score']:.1f} "
-                          f"平仄:{item['scores']['pingze_score']:.1f} "
-                          f"押韵:{item['scores']['rhyme_score']:.1f}")
-                    # 查找实际的诗句字段名
-                    poem_content = ""
-                    for field in ['text', 'content', 'poem', 'poetry', 'prediction']:
-                        if field in item['original_data']:
-                            poem_content = item['original_data'][field]
-                            break
-                    print(f"       诗句: {poem_content[:30]}...")
-
-            # 生成筛选后的数据集
-            filtered_dataset = self._create_filtered_dataset(categorized_data, keep_fields)
-
-            # 根据输出文件的扩展名决定文件格式
-            if output_file.endswith('.jsonl'):
-                self._save_jsonl_file(filtered_dataset, output_file)
-                print("输出格式: JSONL")
-            else:
-                self._save_json_file(filtered_dataset, output_file)
-                print("输出格式: JSON")
-
-            # 生成统计报告
-            stats = self._generate_statistics(categorized_data, total_scored)
+                if stop_when_perfect and self._quotas_perfect(category_heaps, max_per_category):
+                    stopped_early = True
+                    print("所有类别的配额均已被满分记录占满，提前停止读取")
+                    break
 
-            # 保存统计报告
-            stats_file = os.path.splitext(output_file)[0] + '_statistics.json'
-            with open(stats_file, 'w', encoding='utf-8') as f:
-                json.dump(stats, f, ensure_ascii=False, indent=2)
+            if store is not None:
+                store.finish_run(total_scored, skipped, category_counts, keep_fields)
+                print(f"评分结果已写入数据库: {store.db_path}")
 
-            print(f"\n筛选结果已保存到: {output_file}")
-            print(f"统计报告已保存到: {stats_file}")
+            if shard is not None:
+                self._save_shard_state(output_file, shard, max_per_category, keep_fields, category_heaps,
+                                       category_counts, total_scored, skipped, pruned, stopped_early)
 
-            return stats
+            return self._finish_extraction(category_heaps, category_counts, total_scored, skipped, pruned,
+                                           stopped_early, output_file, keep_fields, item_scores_in_stats, shard,
+                                           compression)
 
         except Exception as e:
             print(f"处理数据集时出错: {e}")
             return {'error': str(e)}
 
-    def _determine_category(self, poem: str, instruct_info: dict) -> str:
-        """确定诗词的类别"""
-        processed = extract_chinese(poem)
+    def merge_shards(self, shard_files: list, output_file: str, item_scores_in_stats: bool = False,
+                     compression: CompressOptions = None) -> dict:
+        """
+        合并各分片 process_dataset 另存的状态文件，输出与单机运行相同的筛选结果。
+        统计报告中的处理和跳过条数为各分片之和；剪枝计数依赖各分片的堆，与单机运行不同。
+        合并沿用分片运行时的韵书设置。
+        Args:
+            shard_files: 各分片的状态文件（输出文件名 + '_shard.json'）
+            output_file: 合并后的输出文件路径
+            item_scores_in_stats: 统计报告中是否保留每条记录的分数
+            compression: 输出文件的压缩设置
+        Returns:
+            统计报告
+        """
+        states = []
+        for path in shard_files:
+            states.append(json_codec.load_file(path))
+        if not states:
+            raise ValueError("没有需要合并的分片")
+
+        missing = check_shards([state['shard'] for state in states])
+        if missing:
+            print(f"警告: 缺少分片 {missing}，合并结果不完整")
+        for key in ('rhyme_system', 'max_per_category', 'keep_fields'):
+            if any(state[key] != states[0][key] for state in states):
+                raise ValueError(f"各分片的 {key} 设置不一致")
+
+        self.rhyme_system = states[0]['rhyme_system']
+        max_per_category = states[0]['max_per_category']
+        category_heaps = defaultdict(list)
+        category_counts = defaultdict(int)
+        skipped = {'missing_poem_field': 0, 'missing_instruct_field': 0, 'uncategorized': 0}
+        pruned = {'format': 0, 'pingze': 0}
+        total_scored = 0
+        for state in states:
+            total_scored += state['total_processed']
+            for key in skipped:
+                skipped[key] += state['skipped'][key]
+            for key in pruned:
+                pruned[key] += state['pruned'][key]
+            for category, count in state['category_counts'].items():
+                category_counts[category] += count
+            for category, entries in state['items'].items():
+                for entry in entries:
+                    item = entry['item']
+                    self._push_top_k(category_heaps[category], max_per_category.get(category),
+                                     (item['total_score'], -entry['seq'], item))
+
+        stopped_early = any(state['stopped_early'] for state in states)
+        return self._finish_extraction(category_heaps, category_counts, total_scored, skipped, pruned,
+                                       stopped_early, output_file, states[0]['keep_fields'], item_scores_in_stats,
+                                       compression=compression)
+
+    def query_store(self, store: ScoreStore, output_file: str, max_per_category: dict, min_scores: dict = None,
+                    sources: list = None, item_scores_in_stats: bool = False,
+                    compression: CompressOptions = None) -> dict:
+        """
+        从评分数据库中按 self.rhyme_system 的总分选出各类别的前若干名并输出，不重新评分。
+        不设分数下限时，结果与用相同的韵书和配额运行 extract 完全相同（统计报告中的剪枝计数为 0）。
+        Args:
+            store: 评分数据库
+            output_file: 输出文件路径
+            max_per_category: 各类别最多保留的数量，None 表示不限
+            min_scores: 分数下限 {'format'/'pingze'/'rhyme'/'total': 下限}
+            sources: 只使用这些输入文件的评分结果，None 表示数据库中的全部
+            item_scores_in_stats: 统计报告中是否保留每条记录的分数
+            compression: 输出文件的压缩设置
+        Returns:
+            统计报告
+        """
+        summary = store.run_summary(sources)
+        if not summary['runs']:
+            raise ValueError("数据库中没有已完成的评分结果")
+        print(f"使用 {len(summary['runs'])} 次运行的评分结果: "
+              f"{', '.join(sorted({run['input_file'] for run in summary['runs']}))}")
+
+        category_heaps = {}
+        for category in self.categories:
+            if not summary['category_counts'].get(category):
+                continue
+            max_count = max_per_category.get(category)
+            rows = store.top_k(category, self.rhyme_system, None if max_count is None else max(max_count, 0),
+                               min_scores, sources)
+            # 数据库已按总分降序、同分先出现者优先排好，用名次代替序号
+            category_heaps[category] = [(row['total_score'], -rank, self._stored_item(row, category))
+                                        for rank, row in enumerate(rows)]
+
+        skipped = {'missing_poem_field': 0, 'missing_instruct_field': 0, 'uncategorized': 0}
+        skipped.update(summary['skipped'])
+        return self._finish_extraction(category_heaps, summary['category_counts'], summary['total_processed'],
+                                       skipped, {'format': 0, 'pingze': 0}, False, output_file,
+                                       summary['keep_fields'], item_scores_in_stats, compression=compression)
+
+    def _stored_item(self, row: dict, category: str) -> dict:
+        """由数据库中的一行恢复与 process_dataset 相同结构的评分记录"""
+        scores = {field: row[field] for field in ('format_score', 'pingze_score', 'rhyme_score_pingshui',
+                                                  'rhyme_score_xin', 'rhyme_score_tong', 'rhyme_score')}
+        scores['selected_rhyme_system'] = self.rhyme_system
+        return {
+            'original_data': row['original_data'],
+            'poem': row['poem'],
+            'scores': scores,
+            'total_score': row['total_score'],
+            'category': category,
+            'poem_length': row['poem_length'],
+            'determined_category': self.categories[category]['name']
+        }
+
+    def _save_shard_state(self, output_file: str, shard: ShardSpec, max_per_category: dict, keep_fields: list,
+                          category_heaps: dict, category_counts: dict, total_scored: int, skipped: dict,
+                          pruned: dict, stopped_early: bool):
+        """另存分片保留的记录（含全局序号和分数）和计数，供 merge_shards 合并"""
+        state = {
+            'shard': shard._asdict(),
+            'rhyme_system': self.rhyme_system,
+            'max_per_category': max_per_category,
+            'keep_fields': keep_fields,
+            'total_processed': total_scored,
+            'skipped': skipped,
+            'pruned': pruned,
+            'stopped_early': stopped_early,
+            'category_counts': category_counts,
+            'items': {category: [{'seq': -entry[1], 'item': entry[2]} for entry in heap]
+                      for category, heap in category_heaps.items()}
+        }
+        state_file = os.path.splitext(strip_compression_suffix(output_file))[0] + '_shard.json'
+        json_codec.dump_file(state, state_file, indent=False)
+        print(f"分片状态已保存到: {state_file}")
+
+    def _finish_extraction(self, category_heaps: dict, category_counts: dict, total_scored: int, skipped: dict,
+                           pruned: dict, stopped_early: bool, output_file: str, keep_fields: list,
+                           item_scores_in_stats: bool, shard: ShardSpec = None,
+                           compression: CompressOptions = None) -> dict:
+        """由各类别的堆生成筛选结果和统计报告并保存"""
+        print(f"完成评分，共处理 {total_scored} 条数据")
+        print(f"跳过: 缺少诗句字段 {skipped['missing_poem_field']} 条，"
+              f"缺少格律字段 {skipped['missing_instruct_field']} 条，"
+              f"无法归类 {skipped['uncategorized']} 条")
+        print(f"剪枝: 格式阶段 {pruned['format']} 条，平仄阶段 {pruned['pingze']} 条")
+
+        # 按类别统计（按类别定义的顺序，与读取顺序和分片方式无关）
+        categorized_data = {}
+        for category in self.categories:
+            if category not in category_heaps:
+                continue
+            heap = category_heaps[category]
+            print(f"{self.categories[category]['name']}: {category_counts[category]} 条")
+
+            # 堆中只剩保留的记录，按分数降序、同分按出现顺序排列
+            filtered_items = [entry[2] for entry in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+            categorized_data[category] = filtered_items
+
+            print(f"  筛选后保留 {len(filtered_items)} 条")
+            if filtered_items:
+                avg_score = sum(item['total_score'] for item in filtered_items) / len(filtered_items)
+                print(f"  平均分: {avg_score:.2f}")
+
+            # 显示最高分的几首
+            print(f"  前三名:")
+            for i, item in enumerate(filtered_items[:3]):
+                print(f"    {i + 1}. 总分: {item['total_score']:.2f} - "
+                      f"格式:{item['scores']['format_score']:.1f} "
+                      f"平仄:{item['scores']['pingze_score']:.1f} "
+                      f"押韵:{item['scores']['rhyme_score']:.1f}")
+                print(f"       诗句: {item['poem'][:30]}...")
+
+        # 生成筛选后的数据集
+        filtered_dataset = self._create_filtered_dataset(categorized_data, keep_fields)
+
+        # 根据输出文件的扩展名（去掉压缩扩展名后）决定文件格式
+        if output_file.lower().endswith(PARQUET_EXTENSIONS):
+            write_parquet(filtered_dataset, output_file, options=compression)
+            print("输出格式: Parquet")
+        elif strip_compression_suffix(output_file).endswith('.jsonl'):
+            paths = self._save_jsonl_file(filtered_dataset, output_file, compression)
+            print("输出格式: JSONL")
+            if len(paths) > 1 or paths[0] != output_file:
+                print(f"分卷输出 {len(paths)} 个文件: {paths[0]} ... {paths[-1]}")
+        else:
+            self._save_json_file(filtered_dataset, output_file, compression)
+            print("输出格式: JSON")
+
+        # 生成统计报告
+        stats = self._generate_statistics(categorized_data, total_scored, skipped,
+                                          pruned, stopped_early, item_scores_in_stats)
+        if shard is not None:
+            stats['shard'] = shard._asdict()
+
+        # 保存统计报告
+        stats_file = os.path.splitext(strip_compression_suffix(output_file))[0] + '_statistics.json'
+        json_codec.dump_file(stats, stats_file)
+
+        print(f"\n筛选结果已保存到: {output_file}")
+        print(f"统计报告已保存到: {stats_file}")
+
+        return stats
+
+    @staticmethod
+    def _push_top_k(heap: list, max_count: int | None, entry: tuple):
+        """
+        把一条评分记录放入类别的最小堆，堆中最多保留 max_count 条。
+        Args:
+            heap: 类别的最小堆，堆顶为当前保留记录中分数最低（同分时最晚出现）的一条
+            max_count: 最多保留的数量，None 表示不限
+            entry: (总分, -序号, 评分记录)
+        """
+        if max_count is None:
+            heapq.heappush(heap, entry)
+        elif len(heap) < max_count:
+            heapq.heappush(heap, entry)
+        elif max_count > 0 and entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    @staticmethod
+    def _heap_floor(heap: list, max_count: int | None) -> float | None:
+        """
+        返回新记录要进入类别堆必须超过的总分，配额未满（或不限）时返回 None。
+        新记录的序号比堆中所有记录都大，同分时不会入选，所以总分上界不超过该值即可剪枝。
+        """
+        if max_count is None or len(heap) < max_count:
+            return None
+        if max_count <= 0:
+            return float('inf')
+        return heap[0][0]
+
+    @staticmethod
+    def _quotas_perfect(category_heaps: dict, max_per_category: dict) -> bool:
+        """所有类别的配额是否都已被满分（100 分）记录占满"""
+        for category, max_count in max_per_category.items():
+            if max_count is None:
+                return False
+            heap = category_heaps.get(category, [])
+            if max_count > 0 and (len(heap) < max_count or heap[0][0] < 100.0):
+                return False
+        return True
+
+    def score_record(self, poem: str, instruct: str, min_total: float = None) -> tuple:
+        """
+        对一首诗归类并评分（与 process_dataset 中的过滤和评分阶段相同），供逐条处理的流水线使用
+        Args:
+            poem: 诗句
+            instruct: 指令
+            min_total: 总分上界不超过它时停止评分（见 PoetryScorer.score_poem）
+        Returns:
+            (类别, 评分结果, 总分)；无法归类时为 (None, None, None)，被剪枝时总分为 None
+        """
+        form, instruct_info = self.parse_instruct_form(instruct)
+        processed = tokenize(poem).hanzi
+        category = self._determine_category(processed, form)
+        if category is None:
+            return None, None, None
+        score_result = self.scorer.score_poem(poem, instruct, self.rhyme_system, all_rhyme_systems=False,
+                                              processed=processed, instruct_info=instruct_info, min_total=min_total)
+        if 'pruned' in score_result:
+            return category, score_result, None
+        total = (score_result['format_score'] + score_result['pingze_score'] + score_result['rhyme_score']) / 3
+        return category, score_result, total
+
+    def _determine_category(self, processed: str, form: PoemForm) -> str:
+        """确定诗词的类别（processed 为 tokenize 得到的汉字串，即 extract_chinese 的结果；form 为指令解析出的诗体）"""
         poem_len = len(processed)
 
         # 预处理：如果长度为0，返回None
@@ -227,48 +577,29 @@ class PoetryQualityExtractor:
             return None
 
         # 如果通过指令信息能明确确定类别
-        for key, value in self.categories.items():
-            if (instruct_info['poem_type'] == value['poem_type'] and
-                    instruct_info['sentence_length'] == value['sentence_length']):
-                return key
-
-        # 根据实际内容自动判断
-        if poem_len == 20:  # 5字×4句 = 绝句
-            return 'five_quatrain'
-        elif poem_len == 28:  # 7字×4句 = 绝句
-            return 'seven_quatrain'
-        elif poem_len == 40:  # 5字×8句 = 律诗
-            return 'eight_five'
-        elif poem_len == 56:  # 7字×8句 = 律诗
-            return 'eight_seven'
-
-        # 不符合标准格式
-        return None
+        if form is not PoemForm.UNSPECIFIED:
+            return form.value
+
+        # 根据实际内容自动判断：按总字数（与评分器的格式分相同的规则）只接受 4 句的绝句和 8 句的律诗
+        return self.LENGTH_CATEGORIES.get(form_of_length(poem_len))
 
     def _read_json_file(self, file_path: str) -> list:
         """读取JSON文件"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if not isinstance(data, list):
-            raise ValueError("输入文件应包含一个对象列表")
-
-        return data
+        return [item for _, item in self._iter_json_file(file_path)]
 
     def _read_jsonl_file(self, file_path: str) -> list:
         """读取JSONL文件"""
-        data = []
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    try:
-                        item = json.loads(line)
-                        data.append(item)
-                    except json.JSONDecodeError:
-                        continue
-
-        return data
+        return [item for _, item in self._iter_jsonl_file(file_path)]
+
+    @staticmethod
+    def _iter_json_file(file_path: str, shard: ShardSpec = None, fields=None):
+        """逐个解析JSON数组中属于本分片的 (序号, 记录)，跳过不是对象的元素；fields 不为 None 时只保留其中的字段"""
+        return iter_json_array(file_path, fields, shard)
+
+    @staticmethod
+    def _iter_jsonl_file(file_path: str, shard: ShardSpec = None, fields=None):
+        """逐行读取JSONL文件中属于本分片的 (序号, 记录)，跳过空行和无效行；fields 不为 None 时只保留其中的字段"""
+        return iter_projected_records(file_path, fields, shard)
 
     def _create_filtered_dataset(self, categorized_data: dict, keep_fields: list) -> list:
         """创建筛选后的数据集，不包含评分信息"""
@@ -280,77 +611,79 @@ class PoetryQualityExtractor:
         for category in category_order:
             items = categorized_data.get(category, [])
 
-            for item in items:
-                # 创建新记录
-                new_item = {}
-
-                # 添加保留字段（诗句、格律字段和用户指定的其他字段）
-                for field in keep_fields:
-                    if field in item['original_data']:
-                        new_item[field] = item['original_data'][field]
-
-                filtered_dataset.append(new_item)
+            # 原始记录在评分时已只保留 keep_fields 中的字段
+            filtered_dataset.extend(item['original_data'] for item in items)
 
         return filtered_dataset
 
-    def _save_json_file(self, data: list, file_path: str):
+    def _save_json_file(self, data: list, file_path: str, compression: CompressOptions = None):
         """保存为JSON文件"""
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        json_codec.dump_file(data, file_path, options=compression)
 
-    def _save_jsonl_file(self, data: list, file_path: str):
-        """保存为JSONL文件"""
-        with open(file_path, 'w', encoding='utf-8') as f:
+    def _save_jsonl_file(self, data: list, file_path: str, compression: CompressOptions = None) -> list:
+        """保存为JSONL文件，返回写出的文件列表（分卷时为各卷）"""
+        with json_codec.JsonlWriter(file_path, options=compression) as writer:
             for item in data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
-
-    def _generate_statistics(self, categorized_data: dict, total_scored: int) -> dict:
-        """生成统计报告"""
+                writer.write(item)
+        return writer.paths
+
+    def _generate_statistics(self, categorized_data: dict, total_scored: int, skipped: dict,
+                             pruned: dict, stopped_early: bool, item_scores: bool = False) -> dict:
+        """
+        生成统计报告：每个类别一次遍历累计各项分数的均值和分布，
+        item_scores 为 True 时额外保留每条记录的分数列表
+        """
         stats = {
             'total_processed': total_scored,
+            'skipped': skipped,
+            'pruning': {
+                'pruned_after_format': pruned['format'],
+                'pruned_after_pingze': pruned['pingze'],
+                'fully_scored': total_scored - pruned['format'] - pruned['pingze'],
+                'format_prune_rate': round(pruned['format'] / total_scored, 4) if total_scored else 0,
+                'pingze_prune_rate': round(pruned['pingze'] / total_scored, 4) if total_scored else 0,
+                'stopped_early': stopped_early
+            },
             'categories': {},
             'extraction_settings': self.categories,
             'rhyme_system': self.rhyme_system
         }
 
+        accumulator = ScoreStats()
         for category, items in categorized_data.items():
             category_name = self.categories[category]['name']
-            category_stats = {
-                'count': len(items),
-                'scores': {
-                    'total': [],
-                    'format': [],
-                    'pingze': [],
-                    'rhyme': []
-                }
-            }
+            category_stats = {'count': len(items)}
+            if item_scores:
+                category_stats['scores'] = {'total': [], 'format': [], 'pingze': [], 'rhyme': []}
 
             for item in items:
-                category_stats['scores']['total'].append(round(item['total_score'], 2))
-                category_stats['scores']['format'].append(round(item['scores']['format_score'], 2))
-                category_stats['scores']['pingze'].append(round(item['scores']['pingze_score'], 2))
-                category_stats['scores']['rhyme'].append(round(item['scores']['rhyme_score'], 2))
+                scores = {
+                    'total': item['total_score'],
+                    'format': item['scores']['format_score'],
+                    'pingze': item['scores']['pingze_score'],
+                    'rhyme': item['scores']['rhyme_score']
+                }
+                accumulator.add(category_name, scores)
+                if item_scores:
+                    for metric, value in scores.items():
+                        category_stats['scores'][metric].append(round(value, 2))
 
             # 计算均值
             category_stats['average_scores'] = {
-                'total': round(sum(category_stats['scores']['total']) / len(category_stats['scores']['total']), 2) if
-                category_stats['scores']['total'] else 0,
-                'format': round(sum(category_stats['scores']['format']) / len(category_stats['scores']['format']), 2) if
-                category_stats['scores']['format'] else 0,
-                'pingze': round(sum(category_stats['scores']['pingze']) / len(category_stats['scores']['pingze']), 2) if
-                category_stats['scores']['pingze'] else 0,
-                'rhyme': round(sum(category_stats['scores']['rhyme']) / len(category_stats['scores']['rhyme']), 2) if
-                category_stats['scores']['rhyme'] else 0
+                metric: round(accumulator.get(category_name, metric).mean, 2)
+                for metric in ('total', 'format', 'pingze', 'rhyme')
             }
+            category_stats['distribution'] = accumulator.summary(category_name)
 
             stats['categories'][category_name] = category_stats
 
+        # 累加器的完整状态，分片运行的统计报告可据此直接合并
+        stats['accumulator'] = accumulator.to_dict()
         return stats
 
-
 def main():
     parser = argparse.ArgumentParser(description='优质诗词数据提取工具')
-    parser.add_argument('input_file', help='输入JSON/JSONL文件路径')
+    parser.add_argument('input_file', help='输入JSON/JSONL/Parquet文件路径')
     parser.add_argument('output_file', help='输出文件路径')
 
     # 字段配置
@@ -371,12 +704,26 @@ def main():
                         help='七言律诗最大输出数量 (默认: 50)')
 
     # 其他选项
-    parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式')
+    parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式（可省略，按首个非空白字节自动识别）')
+    parser.add_argument('--streaming', action='store_true', help='逐条读取输入，不预先把整个数据集读入内存')
+    parser.add_argument('--schema-sample', type=int, default=100,
+                        help='用开头多少条记录确定诗句和格律字段 (默认: 100)')
+    parser.add_argument('--strict-schema', action='store_true',
+                        help='要求每条记录都含有 --poem-field 和 --instruct-field 指定的字段，缺少时立即报错')
+    parser.add_argument('--stats-item-scores', action='store_true',
+                        help='统计报告中保留每条入选记录的分数列表（默认只输出均值和分布）')
+    add_shard_arguments(parser)
+    add_compression_arguments(parser)
+    parser.add_argument('--stop-when-perfect', action='store_true',
+                        help='所有类别的配额都被满分记录占满后提前停止（保留结果不变，但计数不再覆盖全部数据）')
     parser.add_argument('--rhyme-system', default='pingshui',
                         choices=['pingshui', 'xin', 'tong'],
                         help='韵书系统选择: pingshui(平水韵), xin(中华新韵), tong(中华通韵) (默认: pingshui)')
+    parser.add_argument('--store', help='把全部归类成功的记录的完整评分写入该 SQLite 数据库，之后用 run.py query 重新筛选')
+    parser.add_argument('--id-field', default='id', help='写入数据库的记录 id 字段名 (默认: id)')
 
     args = parser.parse_args()
+    shard = shard_from_args(parser, args)
 
     # 设置每类最大数量
     max_per_category = {
@@ -395,6 +742,7 @@ def main():
 
     # 创建提取器并处理数据
     extractor = PoetryQualityExtractor(args.rhyme_system)
+    store = ScoreStore(args.store) if args.store else None
     extractor.process_dataset(
         args.input_file,
         args.poem_field,
@@ -402,8 +750,19 @@ def main():
         args.output_file,
         max_per_category,
         args.keep_fields,
-        args.is_jsonl
+        args.is_jsonl,
+        args.streaming,
+        args.stop_when_perfect,
+        args.schema_sample,
+        args.strict_schema,
+        args.stats_item_scores,
+        shard,
+        compression_from_args(args),
+        store,
+        args.id_field
     )
+    if store is not None:
+        store.close()
 
     print("\n数据提取完成!")
 
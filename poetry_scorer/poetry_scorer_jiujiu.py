@@ -7,34 +7,26 @@
 新特性：支持自定义字段名和JSONL文件格式，支持选择韵书体系，支持生成详细得分和综合得分文件
 """
 
-import json
-import re
 import sys
 import os
 import argparse
 
-# 添加项目路径
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+if __package__ in (None, ''):
+    # 直接以脚本方式运行时，用项目根目录替换脚本所在目录，保证只经由 poetry_scorer 包导入（避免韵表被重复加载）
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-from shi.shi_rhythm import ShiRhythm
-from rhythm.pingshui_rhythm import rhythm_name, rhythm_name_trad, rhythm_correspond
-import rhythm.new_rhythm as nw
-
-
-def extract_chinese(text: str, comma_remain=False) -> str:
-    """删除输入文本中的非汉字部分以及括号内的部分"""
-    # 首先删除括号及其中的内容
-    text = re.sub(r'[(（].*?[)）]', '', text)
-    hanzi_range = (r'\u2642\u2E80-\u2EFF\u2F00-\u2FDF\u4e00-\u9fff\u3400-\u4dbf\u3007\uF900-\uFAFF'
-                   r'\U00020000-\U0002A6DF'
-                   r'\U0002F800-\U0002FA1F')
-    if comma_remain:
-        punctuation = r',\.\?!:，。？！、：'
-        pattern = re.compile(f'[{hanzi_range}{punctuation}]')
-    else:
-        pattern = re.compile(f'[{hanzi_range}]')
-    filtered_text = ''.join(pattern.findall(text)).replace('\n', '')
-    return filtered_text
+from poetry_scorer import json_codec
+from poetry_scorer.compressed_io import (CompressOptions, add_compression_arguments, compression_from_args,
+                                         strip_compression_suffix)
+from poetry_scorer.json_array_reader import is_json_array, iter_json_array
+from poetry_scorer.jsonl_reader import iter_projected_records
+from poetry_scorer.parquet_io import (PARQUET_EXTENSIONS, is_parquet, iter_parquet_records, read_parquet_records,
+                                      write_parquet)
+from poetry_scorer.poem_form import extract_chinese, form_of_length
+from poetry_scorer.poem_pack import PackedRecord, is_poem_pack, iter_pack_records
+from poetry_scorer.score_stats import ScoreStats
+from poetry_scorer.sharding import ShardSpec, add_shard_arguments, check_shards, shard_from_args
+from poetry_scorer.shi.shi_rhythm import ShiRhythm
 
 
 class PoetryScorer:
@@ -47,6 +39,8 @@ class PoetryScorer:
             'xin': {'id': 2, 'name': '中华新韵', 'field': 'rhyme_score_xin'},
             'tong': {'id': 3, 'name': '中华通韵', 'field': 'rhyme_score_tong'}
         }
+        # 格律校验器不保存单首诗的状态，三种韵书、多个线程共用同一个实例
+        self.shi_rhythm = ShiRhythm()
 
     def parse_instruct(self, instruct: str) -> dict:
         """解析instruct中的格律要求"""
@@ -68,27 +62,25 @@ class PoetryScorer:
 
         return result
 
-    def check_format(self, poem: str, instruct: str) -> float:
-        """格式评分"""
-        instruct_info = self.parse_instruct(instruct)
+    def check_format(self, poem: str, instruct: str, processed: str = None, instruct_info: dict = None) -> float:
+        """格式评分，可传入已清理的诗句和已解析的指令以免重复处理"""
+        if instruct_info is None:
+            instruct_info = self.parse_instruct(instruct)
         score = 0.0
 
         # 计算实际句长和诗体 - 清理文本后再计算
-        processed_poem = extract_chinese(poem)
+        processed_poem = extract_chinese(poem) if processed is None else processed
         poem_len = len(processed_poem)
 
         # 如果处理后长度为0（无中文字符），直接返回0分
         if poem_len == 0:
             return 0.0
 
-        if poem_len % 5 == 0:
-            actual_sentence_length = 5
-            total_lines = poem_len // 5
-        elif poem_len % 7 == 0:
-            actual_sentence_length = 7
-            total_lines = poem_len // 7
-        else:
+        # 按总字数判断句长和句数（能被 5 整除按五言，否则能被 7 整除按七言）
+        by_length = form_of_length(poem_len)
+        if by_length is None:
             return 0.0
+        actual_sentence_length, total_lines = by_length
 
         if total_lines == 4:
             actual_poem_type = '绝句'
@@ -288,8 +280,26 @@ class PoetryScorer:
         score = (rhyme_info['actual_correct'] / required_count) * 100
         return min(score, 100.0)
 
-    def score_poem(self, poem: str, instruct: str, rhyme_system: str = 'pingshui') -> dict:
-        """对一首诗进行全面评分"""
+    def pingze_upper_bound(self, processed: str, processed_comma: str) -> float:
+        """不做格律校验估计平仄分（由平水韵得出）的上界，不低于 calculate_pingze_score 的结果"""
+        correct_count, total_count = self.shi_rhythm.pingze_marks_bound(1, processed, processed_comma)
+        if total_count == 0:
+            return 0.0
+        # 与 calculate_pingze_score 相同的计算方式，计数相同时结果逐位相同
+        return (correct_count / total_count) * 100
+
+    def score_poem(self, poem: str, instruct: str, rhyme_system: str = 'pingshui',
+                   all_rhyme_systems: bool = True, processed: str = None,
+                   min_total: float = None, instruct_info: dict = None, processed_comma: str = None) -> dict:
+        """
+        对一首诗进行全面评分。
+        all_rhyme_systems 为 False 时只校验平水韵（平仄分由平水韵得出）和选中的韵书，
+        未校验韵书的押韵分字段不出现在结果中；processed 为已清理的诗句、processed_comma 为保留句读的清理结果、
+        instruct_info 为已解析的指令，传入时不再重复处理。
+        min_total 不为 None 时按 格式 -> 平仄分上界（pingze_upper_bound，不做校验）-> 平水韵平仄 -> 选中韵书押韵
+        的顺序估计总分上界，上界不超过 min_total 就停止校验，结果中以 'pruned' 记录停止的阶段（'format' 或 'pingze'），
+        此时结果不完整、不含 'rhyme_score'。
+        """
         # 默认使用平水韵，同时计算所有韵书的分数（保留完整性）
         results = {
             'poem': poem,
@@ -302,24 +312,45 @@ class PoetryScorer:
             'selected_rhyme_system': rhyme_system
         }
 
-        # 格式评分
-        results['format_score'] = self.check_format(poem, instruct)
-
-        # 解析诗体信息用于押韵评分
-        instruct_info = self.parse_instruct(instruct)
+        # 解析诗体信息用于格式和押韵评分
+        if instruct_info is None:
+            instruct_info = self.parse_instruct(instruct)
 
         # 预处理诗句
-        processed = extract_chinese(poem)
-        processed_comma = extract_chinese(poem, comma_remain=True)
+        if processed is None:
+            processed = extract_chinese(poem)
+        if processed_comma is None:
+            processed_comma = extract_chinese(poem, comma_remain=True)
+
+        # 格式评分
+        results['format_score'] = self.check_format(poem, instruct, processed, instruct_info)
+        if min_total is not None and (results['format_score'] + 100.0 + 100.0) / 3 <= min_total:
+            results['pruned'] = 'format'
+            return results
+        # 校验之前先按平仄分的上界估计，押韵分按满分估计
+        if min_total is not None and \
+                (results['format_score'] + self.pingze_upper_bound(processed, processed_comma) + 100.0) / 3 <= min_total:
+            results['pruned'] = 'pingze'
+            return results
+        selected = self.rhyme_systems.get(rhyme_system, self.rhyme_systems['pingshui'])
 
         # 对三种韵书体系分别进行评分
         yun_shu_list = [1, 2, 3]  # 平水韵、中华新韵、中华通韵
+        if not all_rhyme_systems:
+            yun_shu_list = sorted({1, selected['id']})
+            for info in self.rhyme_systems.values():
+                if info['id'] not in yun_shu_list:
+                    del results[info['field']]
 
         for yun_shu in yun_shu_list:
+            # 平水韵之后平仄分已确定，选中韵书尚未校验时押韵分按满分估计上界
+            if min_total is not None and yun_shu != 1:
+                rhyme_bound = results[selected['field']] if yun_shu > selected['id'] else 100.0
+                if (results['format_score'] + results['pingze_score'] + rhyme_bound) / 3 <= min_total:
+                    results['pruned'] = 'pingze'
+                    return results
             try:
-                # 创建校验器并运行
-                shi_rhythm = ShiRhythm(yun_shu, processed, processed_comma, False)
-                result = shi_rhythm.main_shi()
+                result = self.shi_rhythm.main_shi(yun_shu, processed, processed_comma)
 
                 # 如果是错误码，设为0分
                 if isinstance(result, int):
@@ -367,114 +398,201 @@ class PoetryScorer:
     def process_file(self, input_file: str, detailed_output: str, summary_output: str,
                      poem_field: str = 'prediction', instruct_field: str = 'instruct',
                      is_jsonl: bool = False, rhyme_system: str = 'pingshui',
-                     save_detailed: bool = False, save_summary: bool = True):
-        """处理JSON或JSONL文件并输出评分结果"""
+                     save_detailed: bool = False, save_summary: bool = True, shard: ShardSpec = None,
+                     compression: CompressOptions = None):
+        """
+        处理JSON或JSONL文件并输出评分结果。
+        JSON 数组逐个元素流式解析，不整体读入内存；不指定 is_jsonl 时按首个非空白字节区分 JSON 数组和 JSONL。
+        输入可以是 .gz/.zst/.xz 压缩文件（流式解压）、Parquet 文件（只读取诗句和指令两列）
+        或 poem_pack 打包文件（mmap 读取，不解析 JSON，诗句已清理，打包时计算了平仄和韵部的韵书直接查表）；
+        输出文件名以这些扩展名结尾时按 compression 的设置压缩，详细得分文件以 .parquet 结尾时写成 Parquet（分数列为 float32）。
+        指定 shard 时只评分属于该分片的记录，每条结果带 '_seq'（输入中的全局序号），
+        综合得分文件记录分片设置，各分片的输出可用 merge_shard_results 合并。
+        """
         try:
-            # 判断文件格式
-            if is_jsonl:
-                results = self._process_jsonl_file(input_file, poem_field, instruct_field, rhyme_system)
+            # 判断文件格式：打包文件和 Parquet 按扩展名或文件头识别，
+            # 其余首个非空白字节为 '[' 时按 JSON 数组读取，否则按 JSONL 读取（指定 is_jsonl 时不再判断）
+            if is_poem_pack(input_file):
+                results = self._process_pack_file(input_file, poem_field, instruct_field, rhyme_system, shard)
+            elif is_parquet(input_file):
+                results = self._process_parquet_file(input_file, poem_field, instruct_field, rhyme_system, shard)
+            elif is_jsonl or not is_json_array(input_file):
+                results = self._process_jsonl_file(input_file, poem_field, instruct_field, rhyme_system, shard)
             else:
-                results = self._process_json_file(input_file, poem_field, instruct_field, rhyme_system)
+                results = self._process_json_file(input_file, poem_field, instruct_field, rhyme_system, shard)
 
             # 保存结果
-            self._save_results(results, detailed_output, summary_output, save_detailed, save_summary, rhyme_system)
+            self._save_results(results, detailed_output, summary_output, save_detailed, save_summary, rhyme_system,
+                               shard, compression)
         except Exception as e:
             print(f"Error processing file: {e}")
 
-    def _process_json_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str) -> list:
-        """处理标准JSON文件"""
-        try:
-            with open(input_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except Exception as e:
-            print(f"Error reading input file: {e}")
-            return []
-
-        if not isinstance(data, list):
-            print("Input file should contain a list of objects")
-            return []
-
-        results = []
-        total = len(data)
-
-        for i, item in enumerate(data):
-            print(f"Processing {i + 1}/{total}...")
-
-            if poem_field not in item or instruct_field not in item:
-                print(f"Skipping item {i + 1}: missing required fields '{poem_field}' or '{instruct_field}'")
-                continue
-
-            poem = item[poem_field]
-            instruct = item[instruct_field]
-
-            result = self.score_poem(poem, instruct, rhyme_system)
-            results.append(result)
-
-        return results
-
-    def _process_jsonl_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str) -> list:
-        """处理JSONL文件（每行一个JSON对象）"""
+    def _process_json_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str,
+                           shard: ShardSpec = None) -> list:
+        """处理标准JSON文件（对象数组），逐个解析数组元素，只保留诗句和指令两个字段"""
+        invalid_items = []
+        records = iter_json_array(input_file, (poem_field, instruct_field), shard,
+                                  on_invalid=lambda seq, item: invalid_items.append(seq))
+        return self._score_records(records, poem_field, instruct_field, rhyme_system, shard, invalid_items)
+
+    def _process_jsonl_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str,
+                            shard: ShardSpec = None) -> list:
+        """处理JSONL文件（每行一个JSON对象），只解码出诗句和指令两个字段"""
+        invalid_lines = []
+        records = iter_projected_records(input_file, (poem_field, instruct_field), shard,
+                                         on_invalid=lambda seq, line: invalid_lines.append(seq))
+        return self._score_records(records, poem_field, instruct_field, rhyme_system, shard, invalid_lines)
+
+    def _process_parquet_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str,
+                              shard: ShardSpec = None) -> list:
+        """处理Parquet文件，只读取诗句和指令两列"""
+        records = iter_parquet_records(input_file, (poem_field, instruct_field), shard)
+        return self._score_records(records, poem_field, instruct_field, rhyme_system, shard)
+
+    def _process_pack_file(self, input_file: str, poem_field: str, instruct_field: str, rhyme_system: str,
+                           shard: ShardSpec = None) -> list:
+        """处理 poem_pack 打包文件，使用打包时清理好的诗句"""
+        records = iter_pack_records(input_file, shard)
+        return self._score_records(records, poem_field, instruct_field, rhyme_system, shard)
+
+    def _score_records(self, records, poem_field: str, instruct_field: str, rhyme_system: str,
+                       shard: ShardSpec = None, invalid_lines: list = None) -> list:
+        """
+        逐条评分 (序号, 记录) 的迭代器；invalid_lines 为读取时跳过的无效行序号（边读边追加），
+        记录为 PackedRecord 时直接使用其中清理好的诗句
+        """
         results = []
         line_count = 0
         processed_count = 0
+        invalid_lines = invalid_lines if invalid_lines is not None else []
 
         try:
-            with open(input_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    line_count += 1
-                    try:
-                        item = json.loads(line)
+            for seq, item in records:
+                line_count += 1
 
-                        if poem_field not in item or instruct_field not in item:
-                            print(
-                                f"Skipping line {line_count}: missing required fields '{poem_field}' or '{instruct_field}'")
-                            continue
-
-                        poem = item[poem_field]
-                        instruct = item[instruct_field]
+                if poem_field not in item or instruct_field not in item:
+                    print(
+                        f"Skipping line {line_count}: missing required fields '{poem_field}' or '{instruct_field}'")
+                    continue
 
-                        print(f"Processing line {line_count}...")
+                poem = item[poem_field]
+                instruct = item[instruct_field]
 
-                        result = self.score_poem(poem, instruct, rhyme_system)
-                        results.append(result)
-                        processed_count += 1
+                print(f"Processing line {line_count}...")
 
-                    except json.JSONDecodeError:
-                        print(f"Skipping line {line_count}: invalid JSON")
-                        continue
+                if type(item) is PackedRecord:
+                    result = self.score_poem(poem, instruct, rhyme_system, processed=item.hanzi,
+                                             processed_comma=item.hanzi_comma)
+                else:
+                    result = self.score_poem(poem, instruct, rhyme_system)
+                if shard is not None:
+                    result['_seq'] = seq
+                results.append(result)
+                processed_count += 1
         except Exception as e:
             print(f"Error reading input file: {e}")
 
+        if invalid_lines:
+            print(f"Skipped {len(invalid_lines)} invalid JSON lines")
+        line_count += len(invalid_lines)
         print(f"Processed {processed_count} out of {line_count} lines")
 
         return results
 
     def _save_results(self, results: list, detailed_output: str, summary_output: str,
-                      save_detailed: bool, save_summary: bool, rhyme_system: str):
+                      save_detailed: bool, save_summary: bool, rhyme_system: str, shard: ShardSpec = None,
+                      compression: CompressOptions = None):
         """保存结果到文件"""
         # 保存详细得分文件
         if save_detailed and detailed_output:
             try:
-                with open(detailed_output, 'w', encoding='utf-8') as f:
-                    json.dump(results, f, ensure_ascii=False, indent=2)
+                self._save_detailed_results(results, detailed_output, compression)
                 print(f"Detailed results saved to {detailed_output}")
             except Exception as e:
                 print(f"Error writing detailed output file: {e}")
 
+        # 一次遍历累计统计，综合得分文件和统计输出共用
+        stats = self.collect_statistics(results, rhyme_system)
+
         # 保存综合得分文件
         if save_summary and summary_output:
-            self._save_summary_results(results, summary_output, rhyme_system)
+            self._save_summary_results(stats, summary_output, rhyme_system, shard, compression)
 
         # 打印统计信息
-        self.print_statistics(results, rhyme_system)
+        self.print_statistics(stats, rhyme_system)
+
+    @staticmethod
+    def _save_detailed_results(results: list, detailed_output: str, compression: CompressOptions = None):
+        """保存详细得分文件：.parquet 写成 Parquet（各项分数为 float32 列），其余写成 JSON"""
+        if detailed_output.lower().endswith(PARQUET_EXTENSIONS):
+            score_columns = [key for key in (results[0] if results else {}) if '_score' in key]
+            write_parquet(results, detailed_output, score_columns, compression)
+        else:
+            json_codec.dump_file(results, detailed_output, options=compression)
+
+    def merge_shard_results(self, detailed_files: list, summary_files: list, detailed_output: str,
+                            summary_output: str, rhyme_system: str = 'pingshui', compression: CompressOptions = None):
+        """
+        合并各分片的评分输出，得到与单机运行相同的详细得分和综合得分文件。
+        有详细得分文件时按 '_seq' 恢复输入顺序，并由合并后的结果重新统计；
+        只有综合得分文件时合并其中的统计累加器（均值可能在浮点末位与单机运行不同）。
+        详细得分文件也可以是 Parquet，其中的分数为 float32，重新统计的结果与 JSON 输入略有差异。
+        """
+        stats = ScoreStats()
+        shards = []
+        for path in summary_files:
+            summary = json_codec.load_file(path)
+            if 'shard' not in summary:
+                raise ValueError(f"{path} is not a summary file of a sharded run")
+            shards.append(summary['shard'])
+            stats.merge(ScoreStats.from_dict(summary['accumulator']))
+        if shards:
+            missing = check_shards(shards)
+            if missing:
+                print(f"Warning: missing shards {missing}, merged results are incomplete")
+
+        if detailed_files:
+            results = []
+            for path in detailed_files:
+                results.extend(read_parquet_records(path) if is_parquet(path) else json_codec.load_file(path))
+            results.sort(key=lambda r: r['_seq'])
+            for r in results:
+                del r['_seq']
+            stats = self.collect_statistics(results, rhyme_system)
+
+            if detailed_output:
+                self._save_detailed_results(results, detailed_output, compression)
+                print(f"Detailed results saved to {detailed_output}")
 
-    def _save_summary_results(self, results: list, summary_output: str, rhyme_system: str):
-        """生成并保存综合得分文件"""
-        if not results:
+        if summary_output:
+            self._save_summary_results(stats, summary_output, rhyme_system, compression=compression)
+        self.print_statistics(stats, rhyme_system)
+
+    def collect_statistics(self, results: list, rhyme_system: str) -> ScoreStats:
+        """
+        一次遍历评分结果，累计各项分数的统计
+        Args:
+            results: score_poem 的结果列表
+            rhyme_system: 押韵分所用的韵书
+        Returns:
+            分组 'all' 下含 format_score/pingze_score/rhyme_score/total_score 四项指标的累加器
+        """
+        stats = ScoreStats()
+        rhyme_field = f"rhyme_score_{rhyme_system}"
+        for r in results:
+            stats.add('all', {
+                'format_score': r['format_score'],
+                'pingze_score': r['pingze_score'],
+                'rhyme_score': r[rhyme_field],
+                'total_score': (r['format_score'] + r['pingze_score'] + r[rhyme_field]) / 3
+            })
+        return stats
+
+    def _save_summary_results(self, stats: ScoreStats, summary_output: str, rhyme_system: str,
+                              shard: ShardSpec = None, compression: CompressOptions = None):
+        """生成并保存综合得分文件（分片运行时即使没有结果也要保存，合并时需要其中的分片设置）"""
+        n = stats.get('all', 'format_score').count
+        if not n and shard is None:
             print("No results to generate summary")
             return
 
@@ -483,10 +601,9 @@ class PoetryScorer:
             'pingshui']
 
         # 计算各指标的平均分
-        n = len(results)
-        avg_format = sum(r['format_score'] for r in results) / n
-        avg_pingze = sum(r['pingze_score'] for r in results) / n
-        avg_rhyme = sum(r[f"rhyme_score_{rhyme_system}"] for r in results) / n
+        avg_format = stats.get('all', 'format_score').mean
+        avg_pingze = stats.get('all', 'pingze_score').mean
+        avg_rhyme = stats.get('all', 'rhyme_score').mean
 
         # 计算总分（三个指标各占1/3权重）
         total_score = (avg_format + avg_pingze + avg_rhyme) / 3
@@ -508,36 +625,40 @@ class PoetryScorer:
                 "format_score": 0.333,
                 "pingze_score": 0.333,
                 "rhyme_score": 0.333
-            }
+            },
+            "score_distribution": stats.summary('all'),
+            # 累加器的完整状态，分片运行的综合得分文件可据此直接合并
+            "accumulator": stats.to_dict()
         }
+        if shard is not None:
+            summary["shard"] = shard._asdict()
 
         # 保存综合得分文件
         try:
-            with open(summary_output, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, ensure_ascii=False, indent=2)
+            json_codec.dump_file(summary, summary_output, options=compression)
             print(f"Summary results saved to {summary_output}")
         except Exception as e:
             print(f"Error writing summary output file: {e}")
 
-    def print_statistics(self, results: list, rhyme_system: str):
-        """打印统计信息"""
-        if not results:
+    def print_statistics(self, stats: ScoreStats, rhyme_system: str):
+        """打印统计信息（stats 为 collect_statistics 的结果）"""
+        n = stats.get('all', 'format_score').count
+        if not n:
             print("No results to analyze")
             return
 
-        n = len(results)
-
         # 获取选中的韵书信息
         system_info = self.rhyme_systems[rhyme_system] if rhyme_system in self.rhyme_systems else self.rhyme_systems[
             'pingshui']
 
         # 计算各维度平均分
-        avg_format = sum(r['format_score'] for r in results) / n
-        avg_pingze = sum(r['pingze_score'] for r in results) / n
-        avg_rhyme = sum(r[f"rhyme_score_{rhyme_system}"] for r in results) / n
+        avg_format = stats.get('all', 'format_score').mean
+        avg_pingze = stats.get('all', 'pingze_score').mean
+        avg_rhyme = stats.get('all', 'rhyme_score').mean
 
         # 计算总分
         total_score = (avg_format + avg_pingze + avg_rhyme) / 3
+        total_stats = stats.get('all', 'total_score')
 
         print("\n=== 评分统计 ===")
         print(f"样本数量: {n}")
@@ -545,11 +666,13 @@ class PoetryScorer:
         print(f"平仄分平均: {avg_pingze:.2f}")
         print(f"押韵分({system_info['name']})平均: {avg_rhyme:.2f}")
         print(f"总分平均: {total_score:.2f} (三指标各占1/3权重)")
+        print(f"总分分布: 标准差 {total_stats.std:.2f}，P25 {total_stats.quantile(0.25):.2f}，"
+              f"P50 {total_stats.quantile(0.5):.2f}，P90 {total_stats.quantile(0.9):.2f}")
 
 
 def main():
     parser = argparse.ArgumentParser(description='诗词格律评分工具（支持拗救加分）')
-    parser.add_argument('input_file', help='输入JSON/JSONL文件路径')
+    parser.add_argument('input_file', help='输入JSON/JSONL/Parquet文件路径')
     parser.add_argument('--detailed-output', help='详细得分输出文件路径')
     parser.add_argument('--summary-output', help='综合得分输出文件路径')
 
@@ -562,12 +685,15 @@ def main():
     # 其他参数
     parser.add_argument('--poem-field', default='prediction', help='诗句字段名 (默认: prediction)')
     parser.add_argument('--instruct-field', default='instruct', help='指令字段名 (默认: instruct)')
-    parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式')
+    parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式（可省略，按首个非空白字节自动识别）')
     parser.add_argument('--rhyme-system', default='pingshui',
                         choices=['pingshui', 'xin', 'tong'],
                         help='韵书系统选择: pingshui(平水韵), xin(中华新韵), tong(中华通韵) (默认: pingshui)')
+    add_shard_arguments(parser)
+    add_compression_arguments(parser)
 
     args = parser.parse_args()
+    shard = shard_from_args(parser, args)
 
     # 设置默认输出文件名
     save_detailed = args.save_detailed.lower() == "true"
@@ -575,12 +701,12 @@ def main():
 
     if not args.detailed_output and save_detailed:
         # 如果没有指定详细输出文件但需要保存，使用默认名称
-        base_name = os.path.splitext(os.path.basename(args.input_file))[0]
+        base_name = os.path.splitext(os.path.basename(strip_compression_suffix(args.input_file)))[0]
         args.detailed_output = f"{base_name}_detailed.json"
 
     if not args.summary_output and save_summary:
         # 如果没有指定综合输出文件但需要保存，使用默认名称
-        base_name = os.path.splitext(os.path.basename(args.input_file))[0]
+        base_name = os.path.splitext(os.path.basename(strip_compression_suffix(args.input_file)))[0]
         args.summary_output = f"{base_name}_summary.json"
 
     scorer = PoetryScorer()
@@ -593,7 +719,9 @@ def main():
         args.is_jsonl,
         args.rhyme_system,
         save_detailed,
-        save_summary
+        save_summary,
+        shard,
+        compression_from_args(args)
     )
 
 
@@ -1,8 +1,11 @@
 """新韵模块，支持新韵和通韵。"""
 
 import math
-from common.num_to_cn import num_to_cn
-from hanzi.hanzi_pinyin_class import pinyin_dict
+from array import array
+from bisect import bisect_left
+
+from poetry_scorer.common.num_to_cn import num_to_cn
+from poetry_scorer.hanzi.hanzi_pinyin_class import pinyin_groups
 
 xin_yun = {1: ['a', 'ia', 'ua'], 2: ['o', 'e', 'uo'], 3: ['ie', 'ue', 've'], 4: ['ai', 'uai'],
            5: ['ei', 'uei', 'ui'], 6: ['ao', 'iao'], 7: ['ou', 'iu', 'iou'], 8: ['an', 'ian', 'uan', 'van'],
@@ -20,15 +23,135 @@ xin_hanzi_trad = ['麻', '波', '皆', '開', '微', '豪', '尤', '寒', '文',
 tong_hanzi_trad = ['啊', '喔', '鵝', '衣', '烏', '迂', '哀', '欸', '熬', '歐', '安', '恩', '昂', '英', '雍', '兒']
 
 
+def _pack_pinyin_table(groups: list[tuple[str, str]]) -> tuple[list[str], array, array, array, array]:
+    """
+    将分组的拼音表压缩为数组结构，避免为每个读音保存一个小列表。
+    Args:
+        groups: 读音串与汉字串组成的分组列表
+    Returns:
+        返回五个值：
+            韵母表，下标即韵母编号
+            升序排列的汉字码位数组
+            基本平面码位到汉字序号的直查表（序号加一，0 表示无此字）
+            每个汉字读音的起始偏移数组（末尾多一项，为读音总数）
+            读音编码数组，编码为 韵母编号 * 2 + 声调（0平 1仄）
+    """
+    finals = []
+    final_ids = {}
+    entries = []
+    for readings, hanzis in groups:
+        codes = []
+        for reading in readings.split():
+            final, tone = reading[:-1], int(reading[-1])
+            if final not in final_ids:
+                final_ids[final] = len(finals)
+                finals.append(final)
+            codes.append(final_ids[final] << 1 | tone)
+        codes = bytes(codes)
+        for hanzi in hanzis:
+            if hanzi != '\n':
+                entries.append((ord(hanzi), codes))
+    entries.sort()
+    codepoints = array('I')
+    bmp_rows = array('H', bytes(2 * 0x10000))
+    offsets = array('I', [0])
+    codes = array('B')
+    for row, (codepoint, hanzi_codes) in enumerate(entries):
+        codepoints.append(codepoint)
+        if codepoint < 0x10000:
+            bmp_rows[codepoint] = row + 1
+        codes.frombytes(hanzi_codes)
+        offsets.append(len(codes))
+    return finals, codepoints, bmp_rows, offsets, codes
+
+
+_finals, _codepoints, _bmp_rows, _offsets, _codes = _pack_pinyin_table(pinyin_groups)
+_no_codes = array('B')
+
+
+def _rhyme_code_table(rhyme_dict: dict) -> list[int]:
+    """
+    将韵母韵部对照字典展开为按读音编码索引的韵部表。
+    Args:
+        rhyme_dict: 使用的新韵或通韵韵母韵部对照字典
+    Returns:
+        读音编码对应的韵部，平为正、仄为负，无对应韵部为 0
+    """
+    table = []
+    for final in _finals:
+        category = next((cat for cat, rhymes in rhyme_dict.items() if final in rhymes), 0)
+        table.extend((category, -category))
+    return table
+
+
+_xin_table = _rhyme_code_table(xin_yun)
+_tong_table = _rhyme_code_table(tong_yun)
+
+
+def _hanzi_codes(hanzi: str) -> array:
+    """
+    给定一个汉字，返回其去重后的读音编码。
+    Args:
+        hanzi: 给定的汉字
+    Returns:
+        读音编码数组，查不到时为空
+    """
+    if len(hanzi) != 1:
+        return _no_codes
+    codepoint = ord(hanzi)
+    if codepoint < 0x10000:
+        pos = _bmp_rows[codepoint] - 1
+        if pos < 0:
+            return _no_codes
+    else:
+        pos = bisect_left(_codepoints, codepoint)
+        if pos == len(_codepoints) or _codepoints[pos] != codepoint:
+            return _no_codes
+    return _codes[_offsets[pos]:_offsets[pos + 1]]
+
+
 def get_new_yun(hanzi: str) -> list:
     """
     给定一个汉字，返回其所有韵母和声调的列表。
     Args:
         hanzi: 给定的汉字
     Returns:
-        该汉字所有读音的韵母和声调的列表
+        该汉字所有读音（已去重）的韵母和声调的列表
+    """
+    return [(_finals[code >> 1], code & 1) for code in _hanzi_codes(hanzi)]
+
+
+def hanzi_new_yun(hanzi: str, rhyme_dict: dict) -> list:
+    """
+    直接由压缩读音编码得到汉字的新韵或通韵韵部，结果与 convert_yun(get_new_yun(hanzi), rhyme_dict) 相同。
+    Args:
+        hanzi: 给定的汉字
+        rhyme_dict: 使用的新韵或通韵韵母韵部对照字典
+    Returns:
+        韵部的列表
+    """
+    if rhyme_dict is xin_yun:
+        table = _xin_table
+    elif rhyme_dict is tong_yun:
+        table = _tong_table
+    else:
+        return convert_yun(get_new_yun(hanzi), rhyme_dict)
+    converted_list = [table[code] for code in _hanzi_codes(hanzi) if table[code]]
+    return converted_list if converted_list else [107]
+
+
+def hanzi_new_ping_ze(hanzi: str) -> str:
+    """
+    直接由压缩读音编码得到汉字的新韵通韵平仄，结果与 new_ping_ze(get_new_yun(hanzi)) 相同。
+    Args:
+        hanzi: 给定的汉字
+    Returns:
+        平仄结果 0多音 1平 2仄 3生僻字
     """
-    return pinyin_dict.get(hanzi, [])
+    tones = {code & 1 for code in _hanzi_codes(hanzi)}
+    if not tones:
+        return '3'
+    return '0' if len(tones) == 2 else '1' if 0 in tones else '2'
 
 
 def convert_yun(yun_list: list, rhyme_dict: dict) -> list:
@@ -83,7 +206,7 @@ def show_yun(hanzi: str | list, yun_rule: dict, yun_hanzi: list) -> str:
         汉字或列表对应的新韵、通韵韵部
     """
     if type(hanzi) is str:
-        hanzi_yun_list = convert_yun(get_new_yun(hanzi), yun_rule)
+        hanzi_yun_list = hanzi_new_yun(hanzi, yun_rule)
     else:
         hanzi_yun_list = hanzi
     if not hanzi_yun_list or hanzi_yun_list == [107]:
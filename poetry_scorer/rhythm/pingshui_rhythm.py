@@ -1,7 +1,7 @@
 """平水韵相关模块"""
 
-from common.num_to_cn import num_to_cn  # 自用数字转换汉字代码
-import hanzi.hanzi_class as hanzi_class # 平水韵表
+from poetry_scorer.common.num_to_cn import num_to_cn  # 自用数字转换汉字代码
+import poetry_scorer.hanzi.hanzi_class as hanzi_class # 平水韵表
 
 rhythm_name = [
     '东冬江支微鱼虞齐佳灰真文元寒删先萧肴豪歌麻阳庚青蒸尤侵覃盐咸',
@@ -9,11 +9,20 @@ import sys
 import os
 import argparse
 
-# 添加当前目录到Python路径
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+if __package__ in (None, ''):
+    # 直接以脚本方式运行时，用项目根目录替换脚本所在目录，保证只经由 poetry_scorer 包导入（避免韵表被重复加载）
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-from poetry_scorer_jiujiu import PoetryScorer
-from poetry_quality_extractor import PoetryQualityExtractor
+from poetry_scorer.compressed_io import add_compression_arguments, compression_from_args, strip_compression_suffix
+from poetry_scorer.jsonl_index import JsonlIndex
+from poetry_scorer.json_array_reader import is_json_array, iter_json_array
+from poetry_scorer.jsonl_reader import iter_projected_records
+from poetry_scorer.parquet_io import is_parquet, iter_parquet_records
+from poetry_scorer.poem_pack import PACK_EXTENSION, RHYME_SYSTEM_IDS, write_pack
+from poetry_scorer.poetry_scorer_jiujiu import PoetryScorer
+from poetry_scorer.poetry_quality_extractor import PoetryQualityExtractor
+from poetry_scorer.score_store import ScoreStore
+from poetry_scorer.sharding import add_shard_arguments, shard_from_args
 
 
 def main():
@@ -24,7 +33,7 @@ def main():
 
     # 评分命令
     score_parser = subparsers.add_parser('score', help='对诗词进行格律评分')
-    score_parser.add_argument('input_file', help='输入JSON/JSONL文件路径')
+    score_parser.add_argument('input_file', help='输入JSON/JSONL/Parquet/打包文件路径')
     score_parser.add_argument('--detailed-output', help='详细得分输出文件路径')
     score_parser.add_argument('--summary-output', help='综合得分输出文件路径')
     score_parser.add_argument('--save-detailed', default="false", choices=['true', 'false'],
@@ -33,13 +42,15 @@ def main():
                               help='是否保存综合得分文件 (默认: true)')
     score_parser.add_argument('--poem-field', default='prediction', help='诗句字段名 (默认: prediction)')
     score_parser.add_argument('--instruct-field', default='instruct', help='指令字段名 (默认: instruct)')
-    score_parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式')
+    score_parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式（可省略，按首个非空白字节自动识别）')
     score_parser.add_argument('--rhyme-system', default='pingshui', choices=['pingshui', 'xin', 'tong'],
                               help='韵书系统选择 (默认: pingshui)')
+    add_shard_arguments(score_parser)
+    add_compression_arguments(score_parser)
 
     # 提取命令
     extract_parser = subparsers.add_parser('extract', help='提取优质诗词数据')
-    extract_parser.add_argument('input_file', help='输入JSON/JSONL文件路径')
+    extract_parser.add_argument('input_file', help='输入JSON/JSONL/Parquet/打包文件路径')
     extract_parser.add_argument('output_file', help='输出文件路径')
     extract_parser.add_argument('--poem-field', default='content', help='诗句字段名 (默认: content)')
     extract_parser.add_argument('--instruct-field', default='instruct', help='指令字段名 (默认: instruct)')
@@ -49,14 +60,84 @@ def main():
     extract_parser.add_argument('--max-seven-quatrain', type=int, default=1000, help='七言绝句最大输出数量 (默认: 1000)')
     extract_parser.add_argument('--max-five-regulated', type=int, default=1000, help='五言律诗最大输出数量 (默认: 1000)')
     extract_parser.add_argument('--max-seven-regulated', type=int, default=1000, help='七言律诗最大输出数量 (默认: 1000)')
-    extract_parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式')
+    extract_parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式（可省略，按首个非空白字节自动识别）')
+    extract_parser.add_argument('--streaming', action='store_true', help='逐条读取输入，不预先把整个数据集读入内存')
+    extract_parser.add_argument('--schema-sample', type=int, default=100,
+                                help='用开头多少条记录确定诗句和格律字段 (默认: 100)')
+    extract_parser.add_argument('--strict-schema', action='store_true',
+                                help='要求每条记录都含有 --poem-field 和 --instruct-field 指定的字段，缺少时立即报错')
+    extract_parser.add_argument('--stats-item-scores', action='store_true',
+                                help='统计报告中保留每条入选记录的分数列表（默认只输出均值和分布）')
+    extract_parser.add_argument('--stop-when-perfect', action='store_true',
+                                help='所有类别的配额都被满分记录占满后提前停止（保留结果不变，但计数不再覆盖全部数据）')
     extract_parser.add_argument('--rhyme-system', default='pingshui', choices=['pingshui', 'xin', 'tong'],
                                 help='韵书系统选择 (默认: pingshui)')
+    extract_parser.add_argument('--store', help='把全部归类成功的记录的完整评分写入该 SQLite 数据库，之后用 query 重新筛选')
+    extract_parser.add_argument('--id-field', default='id', help='写入数据库的记录 id 字段名 (默认: id)')
+    add_shard_arguments(extract_parser)
+    add_compression_arguments(extract_parser)
+
+    # 查询命令
+    query_parser = subparsers.add_parser('query', help='从评分数据库中按配额和分数门槛重新筛选，不重新评分')
+    query_parser.add_argument('store', help='extract --store 写入的 SQLite 数据库')
+    query_parser.add_argument('output_file', help='输出文件路径')
+    query_parser.add_argument('--rhyme-system', default='pingshui', choices=['pingshui', 'xin', 'tong'],
+                              help='按哪种韵书的押韵分和总分筛选 (默认: pingshui)')
+    query_parser.add_argument('--max-five-quatrain', type=int, default=1000, help='五言绝句最大输出数量 (默认: 1000)')
+    query_parser.add_argument('--max-seven-quatrain', type=int, default=1000, help='七言绝句最大输出数量 (默认: 1000)')
+    query_parser.add_argument('--max-five-regulated', type=int, default=1000, help='五言律诗最大输出数量 (默认: 1000)')
+    query_parser.add_argument('--max-seven-regulated', type=int, default=1000, help='七言律诗最大输出数量 (默认: 1000)')
+    query_parser.add_argument('--min-total', type=float, help='总分下限')
+    query_parser.add_argument('--min-format', type=float, help='格式分下限')
+    query_parser.add_argument('--min-pingze', type=float, help='平仄分下限')
+    query_parser.add_argument('--min-rhyme', type=float, help='押韵分下限')
+    query_parser.add_argument('--source', nargs='+', help='只使用这些输入文件的评分结果 (默认: 数据库中的全部)')
+    query_parser.add_argument('--stats-item-scores', action='store_true',
+                              help='统计报告中保留每条入选记录的分数列表')
+    add_compression_arguments(query_parser)
+
+    # 合并命令
+    merge_parser = subparsers.add_parser('merge', help='合并分片运行的结果')
+    merge_subparsers = merge_parser.add_subparsers(dest='merge_command', help='要合并的结果类型')
+    merge_score_parser = merge_subparsers.add_parser('score', help='合并分片的评分结果')
+    merge_score_parser.add_argument('--detailed', nargs='+', default=[], help='各分片的详细得分文件')
+    merge_score_parser.add_argument('--summaries', nargs='+', default=[], help='各分片的综合得分文件')
+    merge_score_parser.add_argument('--detailed-output', help='合并后的详细得分输出文件路径')
+    merge_score_parser.add_argument('--summary-output', help='合并后的综合得分输出文件路径')
+    merge_score_parser.add_argument('--rhyme-system', default='pingshui', choices=['pingshui', 'xin', 'tong'],
+                                    help='分片评分时使用的韵书系统 (默认: pingshui)')
+    add_compression_arguments(merge_score_parser)
+    merge_extract_parser = merge_subparsers.add_parser('extract', help='合并分片的提取结果')
+    merge_extract_parser.add_argument('shard_files', nargs='+', help='各分片的状态文件（输出文件名_shard.json）')
+    merge_extract_parser.add_argument('--output', required=True, help='合并后的输出文件路径')
+    merge_extract_parser.add_argument('--stats-item-scores', action='store_true',
+                                      help='统计报告中保留每条入选记录的分数列表')
+    add_compression_arguments(merge_extract_parser)
+
+    # 索引命令
+    index_parser = subparsers.add_parser('index', help='为JSONL文件建立行偏移索引')
+    index_parser.add_argument('input_file', help='输入JSONL文件路径')
+    index_parser.add_argument('--index-file', help='索引文件路径 (默认: 输入文件名 + .idx)')
+    index_parser.add_argument('--chunks', type=int, default=0, help='同时输出把文件切成N段（字节数相近）的记录区间')
+
+    # 打包命令
+    pack_parser = subparsers.add_parser('pack', help='把语料转换为二进制打包文件，评分和提取时 mmap 读取，不再解析 JSON')
+    pack_parser.add_argument('input_file', help='输入JSON/JSONL/Parquet文件路径（JSONL 可以是压缩文件）')
+    pack_parser.add_argument('output_file', nargs='?', help=f'输出文件路径 (默认: 输入文件名的扩展名换成 {PACK_EXTENSION})')
+    pack_parser.add_argument('--poem-field', default='content', help='诗句字段名 (默认: content)')
+    pack_parser.add_argument('--instruct-field', default='instruct', help='指令字段名 (默认: instruct)')
+    pack_parser.add_argument('--id-field', default='id', help='id 字段名，记录中没有时以输入中的序号作为 id (默认: id)')
+    pack_parser.add_argument('--keep-fields', nargs='*', default=['title', 'dynasty', 'author'],
+                             help='原样保留的其他字段，提取时可输出 (默认: title dynasty author)')
+    pack_parser.add_argument('--is-jsonl', action='store_true', help='输入文件为JSONL格式（可省略，按首个非空白字节自动识别）')
+    pack_parser.add_argument('--rhyme-codes', nargs='*', default=[], choices=list(RHYME_SYSTEM_IDS),
+                             help='预先计算这些韵书下每个汉字的平仄和韵部，评分时直接查表 (默认: 不计算)')
 
     # 测试命令
     test_parser = subparsers.add_parser('test', help='运行测试')
 
     args = parser.parse_args()
+    shard = shard_from_args(parser, args) if args.command in ('score', 'extract') else None
 
     # 处理命令
     if args.command == 'score':
@@ -69,11 +150,11 @@ def main():
         summary_output = args.summary_output or ""
 
         if not detailed_output and save_detailed:
-            base_name = os.path.splitext(os.path.basename(args.input_file))[0]
+            base_name = os.path.splitext(os.path.basename(strip_compression_suffix(args.input_file)))[0]
             detailed_output = f"{base_name}_detailed.json"
 
         if not summary_output and save_summary:
-            base_name = os.path.splitext(os.path.basename(args.input_file))[0]
+            base_name = os.path.splitext(os.path.basename(strip_compression_suffix(args.input_file)))[0]
             summary_output = f"{base_name}_summary.json"
 
         scorer = PoetryScorer()
@@ -86,7 +167,9 @@ def main():
             args.is_jsonl,
             args.rhyme_system,
             save_detailed,
-            save_summary
+            save_summary,
+            shard,
+            compression_from_args(args)
         )
 
     elif args.command == 'extract':
@@ -100,6 +183,7 @@ def main():
         }
 
         extractor = PoetryQualityExtractor(args.rhyme_system)
+        store = ScoreStore(args.store) if args.store else None
         extractor.process_dataset(
             args.input_file,
             args.poem_field,
@@ -107,16 +191,86 @@ def main():
             args.output_file,
             max_per_category,
             args.keep_fields,
-            args.is_jsonl
+            args.is_jsonl,
+            args.streaming,
+            args.stop_when_perfect,
+            args.schema_sample,
+            args.strict_schema,
+            args.stats_item_scores,
+            shard,
+            compression_from_args(args),
+            store,
+            args.id_field
         )
+        if store is not None:
+            store.close()
+
+    elif args.command == 'query':
+        print("从评分数据库筛选优质诗词...")
+
+        max_per_category = {
+            'five_quatrain': args.max_five_quatrain,
+            'seven_quatrain': args.max_seven_quatrain,
+            'eight_five': args.max_five_regulated,
+            'eight_seven': args.max_seven_regulated
+        }
+        min_scores = {'total': args.min_total, 'format': args.min_format, 'pingze': args.min_pingze,
+                      'rhyme': args.min_rhyme}
+
+        if not os.path.exists(args.store):
+            query_parser.error(f"数据库不存在: {args.store}")
+        with ScoreStore(args.store) as store:
+            try:
+                PoetryQualityExtractor(args.rhyme_system).query_store(store, args.output_file, max_per_category,
+                                                                      min_scores, args.source, args.stats_item_scores,
+                                                                      compression_from_args(args))
+            except ValueError as e:
+                query_parser.error(str(e))
+
+    elif args.command == 'merge':
+        if args.merge_command == 'score':
+            if not args.detailed and not args.summaries:
+                merge_parser.error("至少需要指定 --detailed 或 --summaries")
+            print("合并分片评分结果...")
+            PoetryScorer().merge_shard_results(args.detailed, args.summaries, args.detailed_output or "",
+                                               args.summary_output or "", args.rhyme_system,
+                                               compression_from_args(args))
+        elif args.merge_command == 'extract':
+            print("合并分片提取结果...")
+            PoetryQualityExtractor().merge_shards(args.shard_files, args.output, args.stats_item_scores,
+                                                  compression_from_args(args))
+        else:
+            merge_parser.print_help()
+
+    elif args.command == 'index':
+        index = JsonlIndex.load_or_build(args.input_file, args.index_file)
+        print(f"索引文件: {args.index_file or JsonlIndex.index_path(args.input_file)}")
+        print(f"记录数: {len(index)}")
+        if args.chunks > 0:
+            for i, (start, stop) in enumerate(index.chunks(args.chunks)):
+                print(f"  第 {i} 段: 记录 [{start}, {stop})，字节 [{index.offsets[start]}, {index.offsets[stop]})")
+
+    elif args.command == 'pack':
+        fields = (args.poem_field, args.instruct_field, args.id_field, *args.keep_fields)
+        if is_parquet(args.input_file):
+            records = iter_parquet_records(args.input_file, fields)
+        elif args.is_jsonl or not is_json_array(args.input_file):
+            records = iter_projected_records(args.input_file, fields)
+        else:
+            records = iter_json_array(args.input_file, fields)
+        output_file = args.output_file or os.path.splitext(strip_compression_suffix(args.input_file))[0] + PACK_EXTENSION
+        print("正在打包...")
+        stats = write_pack(records, output_file, args.poem_field, args.instruct_field, args.id_field,
+                           args.keep_fields, args.rhyme_codes)
+        print(f"已保存至 {output_file}：共 {stats['records']} 条记录，指令 {stats['instructs']} 种，汉字 {stats['chars']} 个")
+        if stats['missing_poem'] or stats['missing_instruct']:
+            print(f"缺少诗句 {stats['missing_poem']} 条，缺少指令 {stats['missing_instruct']} 条（评分时跳过）")
 
     elif args.command == 'test':
         print("运行测试...")
 
-        # 直接运行测试脚本
-        import subprocess
-        result = subprocess.run([sys.executable, 'test_scorer.py'])
-        sys.exit(result.returncode)
+        from poetry_scorer.test_scorer import run_tests
+        sys.exit(run_tests())
 
     else:
         parser.print_help()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式抽样
+每条记录由 (随机种子, 序号或原始行) 的稳定哈希得到一个抽样键，蓄水池只保留键最小的 k 条（bottom-k 抽样，等价于均匀随机抽样）。
+内存只与抽样数有关；结果只取决于种子和记录的标识，与读取顺序无关，
+因此按字节范围切块、在多个进程中分别抽样后合并，与单进程抽样的结果完全相同。
+用原始行计算抽样键时，结果也与行在文件中的位置、文件是否压缩无关，poemsplit.py 和 split.py 对同一行的抽样键相同。
+按键的顺序依次切出 train/val/test 等多份，一遍读取即可得到互不重叠的多份抽样
+"""
+
+import hashlib
+import heapq
+import os
+
+from poetry_scorer.compressed_io import strip_compression_suffix
+
+
+def sample_key(seed: int, ident) -> int:
+    """
+    记录在给定种子下的抽样键（64 位整数）
+    Args:
+        seed: 随机种子
+        ident: 记录的标识，序号（整数）或原始行（字节串）
+    """
+    data = b'%d:%d' % (seed, ident) if isinstance(ident, int) else b'%d:' % seed + ident
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class Reservoir:
+    """保留抽样键最小的 size 条记录的蓄水池，可与同一种子的其他蓄水池合并"""
+
+    def __init__(self, size: int, seed: int = 0):
+        """
+        Args:
+            size: 最多保留的记录数
+            seed: 随机种子
+        """
+        self.size = size
+        self.seed = seed
+        # 见过的记录数
+        self.seen = 0
+        # 大顶堆：(-抽样键, -序号, 记录)，堆顶为当前保留的记录中键最大的一条
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def offer(self, seq: int, item, ident: bytes = None) -> bool:
+        """
+        提交一条记录
+        Args:
+            seq: 记录的序号，在整个输入中唯一（抽样键相同时按序号取舍）
+            item: 记录
+            ident: 计算抽样键用的原始行，None 表示用序号；内容相同的行抽样键相同
+        Returns:
+            是否（暂时）保留了这条记录
+        """
+        self.seen += 1
+        return self._push(sample_key(self.seed, seq if ident is None else ident), seq, item)
+
+    def _push(self, key: int, seq: int, item) -> bool:
+        entry = (-key, -seq, item)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+            return True
+        if self.size and entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def merge(self, other: 'Reservoir'):
+        """并入另一个蓄水池（须为同一种子，且两者见过的记录不重叠）"""
+        if other.seed != self.seed:
+            raise ValueError(f"蓄水池的随机种子不同: {self.seed} != {other.seed}")
+        self.seen += other.seen
+        for neg_key, neg_seq, item in other._heap:
+            self._push(-neg_key, -neg_seq, item)
+
+    def entries(self) -> list:
+        """按抽样键从小到大（即随机顺序）返回 (抽样键, 记录) 列表"""
+        return [(-neg_key, item) for neg_key, _, item in sorted(self._heap, reverse=True)]
+
+
+def parse_splits(items: list) -> list:
+    """
+    解析 name=N 形式的抽样份额
+    Returns:
+        [(名称, 条数), ...]，保持给定的顺序
+    """
+    splits = []
+    for item in items:
+        name, sep, count = item.partition('=')
+        if not sep or not name or not count.isdigit():
+            raise ValueError(f"抽样份额格式应为 名称=条数: {item}")
+        if name in dict(splits):
+            raise ValueError(f"抽样份额重复: {name}")
+        splits.append((name, int(count)))
+    return splits
+
+
+def assign_splits(entries: list, splits: list) -> dict:
+    """
+    按抽样键的顺序把记录依次切成多份
+    Args:
+        entries: 按抽样键排好序的 (抽样键, 记录) 列表
+        splits: [(名称, 条数), ...]，记录不足时排在后面的份额少分或分不到
+    Returns:
+        名称 -> (抽样键, 记录) 列表
+    """
+    result = {}
+    start = 0
+    for name, count in splits:
+        result[name] = entries[start:start + count]
+        start += count
+    return result
+
+
+def split_output_path(file_path: str, name: str) -> str:
+    """多份抽样中名为 name 的一份的输出路径：out.jsonl.gz -> out_train.jsonl.gz"""
+    base = strip_compression_suffix(file_path)
+    stem, ext = os.path.splitext(base)
+    return f"{stem}_{name}{ext}{file_path[len(base):]}"
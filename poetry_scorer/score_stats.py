@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分统计累加器
+一次遍历累计每个分组、每项指标的计数、和、平方和、最值、固定分箱直方图和分位数草图；
+累加器可以序列化为 JSON，并与其他累加器合并，并行或分片运行的统计无需重读结果即可汇总
+"""
+
+import math
+
+
+class MetricStats:
+    """单项指标（0~100 分）的流式统计"""
+
+    # 固定分箱直方图：[0, 5), [5, 10), ..., [95, 100]
+    BIN_WIDTH = 5.0
+    NUM_BINS = 20
+    # 分位数草图：分数按 0.01 取整后计数，分位数误差不超过 0.005，合并时对应计数相加即可
+    SKETCH_SCALE = 100
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = [0] * self.NUM_BINS
+        self.sketch = {}
+
+    def add(self, value: float):
+        """累计一个分数"""
+        self.count += 1
+        self.sum += value
+        self.sum_sq += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.histogram[min(max(int(value // self.BIN_WIDTH), 0), self.NUM_BINS - 1)] += 1
+        key = round(value * self.SKETCH_SCALE)
+        self.sketch[key] = self.sketch.get(key, 0) + 1
+
+    def merge(self, other: 'MetricStats'):
+        """把另一份统计合并进来"""
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        for key, count in other.sketch.items():
+            self.sketch[key] = self.sketch.get(key, 0) + count
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        """总体标准差"""
+        if not self.count:
+            return 0.0
+        return math.sqrt(max(self.sum_sq / self.count - self.mean ** 2, 0.0))
+
+    def quantile(self, q: float) -> float:
+        """
+        由草图估计分位数（最近秩法）
+        Args:
+            q: 0~1 之间的分位点
+        Returns:
+            估计的分位数，没有数据时返回 0
+        """
+        if not self.count:
+            return 0.0
+        rank = min(max(math.ceil(q * self.count), 1), self.count)
+        seen = 0
+        for key in sorted(self.sketch):
+            seen += self.sketch[key]
+            if seen >= rank:
+                return key / self.SKETCH_SCALE
+        return self.max
+
+    def summary(self) -> dict:
+        """便于阅读的汇总：均值、标准差、最值和常用分位数"""
+        return {
+            'count': self.count,
+            'mean': round(self.mean, 2),
+            'std': round(self.std, 2),
+            'min': round(self.min, 2) if self.min is not None else None,
+            'max': round(self.max, 2) if self.max is not None else None,
+            'p25': self.quantile(0.25),
+            'p50': self.quantile(0.5),
+            'p75': self.quantile(0.75),
+            'p90': self.quantile(0.9)
+        }
+
+    def to_dict(self) -> dict:
+        """序列化为可写入 JSON 的字典"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'sum_sq': self.sum_sq,
+            'min': self.min,
+            'max': self.max,
+            'histogram': list(self.histogram),
+            'sketch': {f"{key / self.SKETCH_SCALE:.2f}": self.sketch[key] for key in sorted(self.sketch)}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MetricStats':
+        """从 to_dict 的结果恢复"""
+        stats = cls()
+        stats.count = data['count']
+        stats.sum = data['sum']
+        stats.sum_sq = data['sum_sq']
+        stats.min = data['min']
+        stats.max = data['max']
+        stats.histogram = list(data['histogram'])
+        stats.sketch = {round(float(value) * cls.SKETCH_SCALE): count for value, count in data['sketch'].items()}
+        return stats
+
+
+class ScoreStats:
+    """按分组（如诗体类别）累计多项指标的统计"""
+
+    def __init__(self):
+        # 分组 -> 指标名 -> MetricStats
+        self.groups = {}
+
+    def add(self, group: str, scores: dict):
+        """
+        累计一条记录的各项分数
+        Args:
+            group: 分组名
+            scores: 指标名 -> 分数
+        """
+        metrics = self.groups.setdefault(group, {})
+        for metric, value in scores.items():
+            stats = metrics.get(metric)
+            if stats is None:
+                stats = metrics[metric] = MetricStats()
+            stats.add(value)
+
+    def get(self, group: str, metric: str) -> MetricStats:
+        """取某个分组某项指标的统计，不存在时返回空统计"""
+        return self.groups.get(group, {}).get(metric) or MetricStats()
+
+    def merge(self, other: 'ScoreStats') -> 'ScoreStats':
+        """把另一个累加器合并进来，返回自身"""
+        for group, metrics in other.groups.items():
+            own = self.groups.setdefault(group, {})
+            for metric, stats in metrics.items():
+                own.setdefault(metric, MetricStats()).merge(stats)
+        return self
+
+    def summary(self, group: str) -> dict:
+        """某个分组各项指标的汇总"""
+        return {metric: stats.summary() for metric, stats in self.groups.get(group, {}).items()}
+
+    def to_dict(self) -> dict:
+        """序列化为可写入 JSON 的字典"""
+        return {group: {metric: stats.to_dict() for metric, stats in metrics.items()}
+                for group, metrics in self.groups.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ScoreStats':
+        """从 to_dict 的结果恢复"""
+        accumulator = cls()
+        accumulator.groups = {group: {metric: MetricStats.from_dict(stats) for metric, stats in metrics.items()}
+                              for group, metrics in data.items()}
+        return accumulator
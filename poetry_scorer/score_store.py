@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分结果的 SQLite 存储
+extract 指定 --store 时，每条归类成功的记录都完整评分（三种韵书的押韵分都计算，不剪枝），
+连同序号、id、类别、格式分、平仄分、各韵书的押韵分和总分以及需要保留的字段写入数据库；
+每种韵书的总分各有一个 (类别, 总分) 索引，之后换配额、分数门槛或韵书时，用 query 从数据库直接选出各类别的前 k 名，
+不必重新评分。
+
+同一输入文件再次写入时替换原有结果，未完成的运行写入的记录不会被选出；
+分片运行时各分片的结果和计数分别记录（按分片序号替换），可以写入同一个数据库。
+选出的记录按总分降序，同分时按输入文件首次写入的先后、再按记录序号排列，与 extract 的“同分先出现者优先”一致
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from poetry_scorer import json_codec
+from poetry_scorer.sharding import ShardSpec
+
+RHYME_SYSTEMS = ('pingshui', 'xin', 'tong')
+# 可以设置下限的分数：query 参数名 -> 列名（押韵分和总分的列随韵书变化）
+SCORE_COLUMNS = {'format': 'format_score', 'pingze': 'pingze_score', 'rhyme': 'rhyme_{}', 'total': 'total_{}'}
+# 每攒够多少条记录写入一次
+INSERT_BATCH_SIZE = 10000
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sources (
+    source_id INTEGER PRIMARY KEY,
+    input_file TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS runs (
+    source_id INTEGER NOT NULL,
+    shard_index INTEGER NOT NULL,
+    num_shards INTEGER NOT NULL,
+    shard_mode TEXT NOT NULL,
+    total_processed INTEGER NOT NULL,
+    skipped TEXT NOT NULL,
+    category_counts TEXT NOT NULL,
+    keep_fields TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    PRIMARY KEY (source_id, shard_index)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    source_id INTEGER NOT NULL,
+    shard_index INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    record_id TEXT,
+    category TEXT NOT NULL,
+    poem TEXT NOT NULL,
+    poem_length INTEGER NOT NULL,
+    format_score REAL NOT NULL,
+    pingze_score REAL NOT NULL,
+    {', '.join(f'rhyme_{name} REAL NOT NULL' for name in RHYME_SYSTEMS)},
+    {', '.join(f'total_{name} REAL NOT NULL' for name in RHYME_SYSTEMS)},
+    original_data TEXT NOT NULL,
+    PRIMARY KEY (source_id, seq)
+);
+{''.join(f'CREATE INDEX IF NOT EXISTS scores_total_{name} ON scores (category, total_{name} DESC, source_id, seq);'
+         for name in RHYME_SYSTEMS)}
+"""
+
+
+class ScoreStore:
+    """评分结果数据库"""
+
+    def __init__(self, db_path: str, timeout: float = 60.0):
+        """
+        Args:
+            db_path: 数据库文件路径，不存在时创建
+            timeout: 其他进程（如另一个分片）正在写入时最多等待的秒数
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=timeout)
+        # WAL 模式下读写互不阻塞，多个分片可以轮流写入
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self._run = None
+        self._rows = []
+
+    def begin_run(self, input_file: str, shard: ShardSpec = None):
+        """
+        开始写入一个输入文件（或其一个分片）的评分结果，删除该文件（分片）原有的结果
+        Args:
+            input_file: 输入文件路径（按绝对路径区分不同的输入）
+            shard: 分片设置，None 表示整个文件
+        """
+        input_file = os.path.abspath(input_file)
+        shard = shard or ShardSpec(0, 1)
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO sources (input_file) VALUES (?)', (input_file,))
+            source_id = self.conn.execute('SELECT source_id FROM sources WHERE input_file = ?',
+                                          (input_file,)).fetchone()[0]
+            # 分片方式变化时，之前各分片的结果都已过时
+            stale = self.conn.execute(
+                'SELECT 1 FROM runs WHERE source_id = ? AND (num_shards != ? OR shard_mode != ?)',
+                (source_id, shard.num_shards, shard.mode)).fetchone()
+            if shard.num_shards == 1 or stale:
+                self.conn.execute('DELETE FROM scores WHERE source_id = ?', (source_id,))
+                self.conn.execute('DELETE FROM runs WHERE source_id = ?', (source_id,))
+            else:
+                self.conn.execute('DELETE FROM scores WHERE source_id = ? AND shard_index = ?',
+                                  (source_id, shard.index))
+                self.conn.execute('DELETE FROM runs WHERE source_id = ? AND shard_index = ?',
+                                  (source_id, shard.index))
+        self._run = (source_id, shard)
+
+    def add(self, seq: int, record_id, category: str, poem: str, poem_length: int, scores: dict,
+            original_data: dict):
+        """
+        写入一条完整评分的记录（攒够 INSERT_BATCH_SIZE 条再写入）
+        Args:
+            seq: 记录在输入中的全局序号
+            record_id: 记录的 id，没有时为 None
+            category: 类别
+            poem: 诗句
+            poem_length: 清理后的汉字数
+            scores: score_poem(all_rhyme_systems=True) 的结果
+            original_data: 需要保留的字段
+        """
+        source_id, shard = self._run
+        format_score, pingze_score = scores['format_score'], scores['pingze_score']
+        rhymes = [scores[f'rhyme_score_{name}'] for name in RHYME_SYSTEMS]
+        # 与 extract 相同的计算顺序，保证总分逐位相同
+        totals = [(format_score + pingze_score + rhyme) / 3 for rhyme in rhymes]
+        self._rows.append((source_id, shard.index, seq, None if record_id is None else str(record_id), category,
+                           poem, poem_length, format_score, pingze_score, *rhymes, *totals,
+                           json_codec.dumps(original_data).decode('utf-8')))
+        if len(self._rows) >= INSERT_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        placeholders = ', '.join('?' * len(self._rows[0]))
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO scores VALUES ({placeholders})', self._rows)
+        self._rows = []
+
+    def finish_run(self, total_processed: int, skipped: dict, category_counts: dict, keep_fields: list):
+        """写入剩余的记录和本次运行的计数"""
+        self._flush()
+        source_id, shard = self._run
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (source_id, shard.index, shard.num_shards, shard.mode, total_processed,
+                               json_codec.dumps(skipped).decode('utf-8'),
+                               json_codec.dumps(dict(category_counts)).decode('utf-8'),
+                               json_codec.dumps(keep_fields).decode('utf-8'),
+                               datetime.now().isoformat(timespec='seconds')))
+        self._run = None
+
+    def _source_ids(self, sources=None) -> list:
+        """输入文件路径对应的 source_id，None 表示全部"""
+        if sources is None:
+            return [row[0] for row in self.conn.execute('SELECT source_id FROM sources ORDER BY source_id')]
+        source_ids = []
+        for input_file in sources:
+            row = self.conn.execute('SELECT source_id FROM sources WHERE input_file = ?',
+                                    (os.path.abspath(input_file),)).fetchone()
+            if row is None:
+                raise ValueError(f"数据库中没有输入文件 {input_file} 的评分结果")
+            source_ids.append(row[0])
+        return source_ids
+
+    def run_summary(self, sources=None) -> dict:
+        """
+        各次运行的计数之和
+        Args:
+            sources: 输入文件路径列表，None 表示全部
+        Returns:
+            {'total_processed', 'skipped', 'category_counts', 'keep_fields', 'runs'}
+        """
+        summary = {'total_processed': 0, 'skipped': {}, 'category_counts': {}, 'keep_fields': [], 'runs': []}
+        source_ids = self._source_ids(sources)
+        query = (f'SELECT input_file, shard_index, num_shards, total_processed, skipped, category_counts, keep_fields '
+                 f'FROM runs JOIN sources USING (source_id) WHERE source_id IN ({", ".join("?" * len(source_ids))}) '
+                 f'ORDER BY source_id, shard_index')
+        for input_file, shard_index, num_shards, total, skipped, counts, keep_fields in self.conn.execute(query,
+                                                                                                         source_ids):
+            summary['total_processed'] += total
+            for key, value in json_codec.loads(skipped).items():
+                summary['skipped'][key] = summary['skipped'].get(key, 0) + value
+            for key, value in json_codec.loads(counts).items():
+                summary['category_counts'][key] = summary['category_counts'].get(key, 0) + value
+            for field in json_codec.loads(keep_fields):
+                if field not in summary['keep_fields']:
+                    summary['keep_fields'].append(field)
+            summary['runs'].append({'input_file': input_file, 'shard_index': shard_index, 'num_shards': num_shards})
+        return summary
+
+    def top_k(self, category: str, rhyme_system: str, limit: int = None, min_scores: dict = None,
+              sources=None):
+        """
+        按总分降序选出一个类别的记录（走 (类别, 总分) 索引）
+        Args:
+            category: 类别
+            rhyme_system: 韵书，决定押韵分和总分使用的列
+            limit: 最多选出的条数，None 表示不限
+            min_scores: 分数下限 {'format'/'pingze'/'rhyme'/'total': 下限}，值为 None 的忽略
+            sources: 输入文件路径列表，None 表示全部
+        Returns:
+            记录字典的迭代器：seq、record_id、input_file、poem、poem_length、format_score、pingze_score、
+            各韵书的押韵分、rhyme_score、total_score、original_data
+        """
+        if rhyme_system not in RHYME_SYSTEMS:
+            raise ValueError(f"未知的韵书: {rhyme_system}（可选: {list(RHYME_SYSTEMS)}）")
+        total_column = f'total_{rhyme_system}'
+        # 只选已完成的运行写入的记录
+        conditions = ['category = ?', '(source_id, shard_index) IN (SELECT source_id, shard_index FROM runs)']
+        params = [category]
+        for name, minimum in (min_scores or {}).items():
+            if minimum is not None:
+                conditions.append(f'{SCORE_COLUMNS[name].format(rhyme_system)} >= ?')
+                params.append(minimum)
+        if sources is not None:
+            source_ids = self._source_ids(sources)
+            conditions.append(f'source_id IN ({", ".join("?" * len(source_ids))})')
+            params.extend(source_ids)
+        params.append(-1 if limit is None else limit)
+
+        cursor = self.conn.execute(
+            f'SELECT seq, record_id, input_file, poem, poem_length, format_score, pingze_score, '
+            f'{", ".join(f"rhyme_{name}" for name in RHYME_SYSTEMS)}, {total_column}, original_data '
+            f'FROM scores INDEXED BY scores_{total_column} JOIN sources USING (source_id) '
+            f'WHERE {" AND ".join(conditions)} ORDER BY {total_column} DESC, source_id, seq LIMIT ?', params)
+        for seq, record_id, input_file, poem, poem_length, format_score, pingze_score, *rest in cursor:
+            rhymes = dict(zip(RHYME_SYSTEMS, rest[:len(RHYME_SYSTEMS)]))
+            total_score, original_data = rest[len(RHYME_SYSTEMS):]
+            row = {'seq': seq, 'record_id': record_id, 'input_file': input_file, 'poem': poem,
+                   'poem_length': poem_length, 'format_score': format_score, 'pingze_score': pingze_score}
+            row.update((f'rhyme_score_{name}', value) for name, value in rhymes.items())
+            row['rhyme_score'] = rhymes[rhyme_system]
+            row['total_score'] = total_score
+            row['original_data'] = json_codec.loads(original_data)
+            yield row
+
+    def close(self):
+        """关闭数据库，未完成的运行中尚未写入的记录丢弃（已写入的不会被 top_k 选出）"""
+        self._rows = []
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据分片
+把一个输入文件确定性地分给多台机器处理：
+hash 模式按记录序号的稳定哈希分配，JSON 和 JSONL 输入都适用，每个分片仍需读完整个文件；
+range 模式把 JSONL 文件按字节等分，每个分片只读自己的字节范围（行归属于其首字节所在的范围），不支持压缩文件；
+每个分片只需一次 seek 并读到行尾就能对齐到行首，不需要行偏移索引，JsonlIndex.chunks 给出的划分与此相同。
+每条记录带一个全局有序的序号（hash 模式为非空行/数组下标，range 模式为行首字节偏移），
+合并各分片结果时据此恢复单机运行的顺序
+"""
+
+import hashlib
+import io
+import os
+from typing import NamedTuple
+
+from poetry_scorer.compressed_io import detect_compression, open_input
+
+
+class ShardSpec(NamedTuple):
+    """分片设置"""
+    index: int
+    num_shards: int
+    mode: str = 'hash'
+
+    def owns(self, seq: int) -> bool:
+        """hash 模式下序号为 seq 的记录是否属于本分片"""
+        digest = hashlib.blake2b(str(seq).encode('ascii'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.num_shards == self.index
+
+
+def iter_jsonl_lines(file_path: str, shard: ShardSpec = None, as_bytes: bool = False):
+    """
+    逐行读取JSONL文件中属于本分片的非空行（压缩文件流式解压）
+    Args:
+        file_path: JSONL文件路径
+        shard: 分片设置，None 表示读取全部
+        as_bytes: 为 True 时返回未解码的字节行
+    Returns:
+        (序号, 去掉首尾空白的行) 的迭代器
+    """
+    if shard is not None and shard.mode == 'range':
+        yield from _iter_byte_range(file_path, shard, as_bytes)
+        return
+
+    f = open_input(file_path)
+    if not as_bytes:
+        f = io.TextIOWrapper(f, encoding='utf-8')
+    with f:
+        seq = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if shard is None or shard.owns(seq):
+                yield seq, line
+            seq += 1
+
+
+def _iter_byte_range(file_path: str, shard: ShardSpec, as_bytes: bool = False):
+    """读取第 shard.index 个字节范围内开始的行，序号为行首的字节偏移"""
+    if detect_compression(file_path) is not None:
+        raise ValueError("按字节范围分片不支持压缩文件，请改用 hash 模式")
+    size = os.path.getsize(file_path)
+    start = size * shard.index // shard.num_shards
+    end = size * (shard.index + 1) // shard.num_shards
+
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            # 从前一个字节开始读到行尾：若 start 恰为行首，读到的只是上一行的换行符
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            raw = f.readline()
+            if not raw:
+                break
+            line = raw.strip() if as_bytes else raw.decode('utf-8').strip()
+            if line:
+                yield offset, line
+            offset += len(raw)
+
+
+def select_records(records, shard: ShardSpec = None):
+    """
+    从已解析的记录序列中选出属于本分片的记录（JSON 数组输入只支持 hash 模式）
+    Returns:
+        (序号, 记录) 的迭代器
+    """
+    if shard is not None and shard.mode == 'range':
+        raise ValueError("按字节范围分片只支持JSONL输入")
+    for seq, item in enumerate(records):
+        if shard is None or shard.owns(seq):
+            yield seq, item
+
+
+def check_shards(shards: list) -> list:
+    """
+    检查待合并的分片是否来自同一次划分且没有重复，返回缺失的分片序号
+    Args:
+        shards: 各分片结果中记录的分片设置（字典形式）
+    Returns:
+        缺失的分片序号列表
+    """
+    specs = {(shard['num_shards'], shard['mode']) for shard in shards}
+    if len(specs) != 1:
+        raise ValueError(f"分片设置不一致: {sorted(specs)}")
+    indices = [shard['index'] for shard in shards]
+    if len(set(indices)) != len(indices):
+        raise ValueError(f"分片重复: {sorted(indices)}")
+    num_shards = shards[0]['num_shards']
+    return [i for i in range(num_shards) if i not in set(indices)]
+
+
+def add_shard_arguments(parser):
+    """给命令行解析器加上分片参数"""
+    parser.add_argument('--num-shards', type=int, default=1, help='分片总数 (默认: 1，不分片)')
+    parser.add_argument('--shard-index', type=int, default=0, help='本次处理的分片序号，从0开始 (默认: 0)')
+    parser.add_argument('--shard-mode', default='hash', choices=['hash', 'range'],
+                        help='分片方式: hash(按记录序号哈希) 或 range(按JSONL文件字节范围) (默认: hash)')
+
+
+def shard_from_args(parser, args) -> ShardSpec:
+    """由命令行参数得到分片设置，不分片时返回 None"""
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"分片参数无效: --num-shards {args.num_shards} --shard-index {args.shard_index}")
+    if args.num_shards == 1:
+        return None
+    return ShardSpec(args.shard_index, args.num_shards, args.shard_mode)
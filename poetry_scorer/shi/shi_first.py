@@ -1,5 +1,5 @@
 """判断诗歌首句格式的模块，由于相对比较复杂，需要考虑多音字、拗救以及诗歌中可能的错误，单独设置。"""
-from common.common import hanzi_to_pingze
+from poetry_scorer.common.common import hanzi_to_pingze
 
 
 class ShiFirst:
@@ -2,32 +2,58 @@
 import re
 import math
 from collections import defaultdict
+from types import MappingProxyType
+from typing import NamedTuple
 
-from rhythm.pingshui_rhythm import rhythm_name, rhythm_name_trad, rhythm_correspond  # 平水韵模块
-import rhythm.new_rhythm as nw
-from common.common import hanzi_rhythm, hanzi_to_pingze, hanzi_to_yun, result_check
-from common.num_to_cn import num_to_cn
-from shi.shi_first import ShiFirst  # 判断首句格式
+from poetry_scorer.rhythm.pingshui_rhythm import rhythm_name, rhythm_name_trad, rhythm_correspond  # 平水韵模块
+import poetry_scorer.rhythm.new_rhythm as nw
+from poetry_scorer.common.common import hanzi_rhythm, hanzi_to_pingze, hanzi_to_yun, result_check
+from poetry_scorer.common.num_to_cn import num_to_cn
+from poetry_scorer.shi.shi_first import ShiFirst  # 判断首句格式
+
+
+class ShiContext(NamedTuple):
+    """单次校验的上下文：所用韵书、诗句等每首诗各不相同的状态，只在一次 main_shi 调用内传递。"""
+    yun_shu: int
+    poem: str
+    poem_comma: str
+    is_trad: bool = False
 
 
 class ShiRhythm:
-    def __init__(self, yun_shu, poem, poem_comma, is_trad):
-        self.lyu_ju_rule_dict = {
-            1: ['11221', '21121', '11121'],  # 平起押韵
-            2: ['01122', '11212'],  # 平起不押韵
-            3: ['02211'],  # 仄起押韵
-            4: ['02012', '02022'],  # 仄起不押韵（含拗句）
-            5: ['0211221', '0221121', '0211121'],  # 仄起押韵
-            6: ['0201122', '0211212'],  # 仄起不押韵
-            7: ['0102211'],  # 平起押韵
-            8: ['0102012', '0102022']  # 平起不押韵（含拗句）
-        }  # 一定要将拗句放在后检验
-
-        self.sh = ['〇', '●', '◎', '�']
-        self.yun_shu = yun_shu
-        self.poem = poem
-        self.poem_comma = poem_comma
-        self.is_trad = is_trad
+    """
+    诗歌格律校验器。
+    校验器本身不保存任何与具体诗歌相关的状态，规则表均为只读的类属性，
+    每次调用的状态都放在 ShiContext 中，因此一个实例可以在多个线程间共享、重入调用。
+    """
+    # 平韵律句规则，一定要将拗句放在后检验
+    LYU_JU_RULES = MappingProxyType({
+        1: ('11221', '21121', '11121'),  # 平起押韵
+        2: ('01122', '11212'),  # 平起不押韵
+        3: ('02211',),  # 仄起押韵
+        4: ('02012', '02022'),  # 仄起不押韵（含拗句）
+        5: ('0211221', '0221121', '0211121'),  # 仄起押韵
+        6: ('0201122', '0211212'),  # 仄起不押韵
+        7: ('0102211',),  # 平起押韵
+        8: ('0102012', '0102022')  # 平起不押韵（含拗句）
+    })
+    # 仄韵律句规则：仄韵无孤平，也无“中仄中仄仄”拗句，因为没法对句救
+    LYU_JU_RULES_ZE = MappingProxyType({
+        **LYU_JU_RULES,
+        1: ('11221', '21121', '11121', '21221'),
+        4: ('02012',),
+        8: ('0102012',)
+    })
+
+    # 拗句及其拗句代码：1 平平仄平仄（本句自救），2 中仄中仄仄（对句相救）
+    AO_JU_FLAGS = MappingProxyType({'11212': 1, '0211212': 1, '02022': 2, '0102022': 2})
+
+    sh = ('〇', '●', '◎', '�')
+
+    def __init__(self):
+        # pingze_marks_bound 用的缓存：(韵书, 繁简, 汉字) -> 平仄代码，以及一句平仄代码的标记结果，都与具体诗歌无关
+        self._pingze_codes = {}
+        self._line_marks_cache = {}
 
     @staticmethod
     def _infer_sen_len(poem: str, has_comma: bool) -> int:
@@ -36,12 +62,12 @@ class ShiRhythm:
             return 5 if len(poem) % 5 == 0 else 7
         return 5 if len(poem) % 5 == 0 else 7
 
-    def _infer_poem_type(self, total_lines: int) -> str:
+    def _infer_poem_type(self, ctx: ShiContext, total_lines: int) -> str:
         """总行数 -> 诗体中文名"""
         if total_lines == 4:
-            return '絕句' if self.is_trad else '绝句'
+            return '絕句' if ctx.is_trad else '绝句'
         if total_lines == 8:
-            return '律詩' if self.is_trad else '律诗'
+            return '律詩' if ctx.is_trad else '律诗'
         return '排律'
 
     @staticmethod
@@ -72,22 +98,23 @@ class ShiRhythm:
         most_num = [num for num, count in freq.items() if count == max_count]
         return most_num if lis else most_num[0]
 
-    def _first_hard(self, first_hanzi: str, other_hanzis: str) -> list | bool:
+    def _first_hard(self, ctx: ShiContext, first_hanzi: str, other_hanzis: str) -> list | bool:
         """
             分析首句是否为韵字。
             Args:
+                ctx: 本次校验的上下文
                 first_hanzi: 第一句末汉字
                 other_hanzis: 其余所有韵脚汉字
             Returns:
                 返回共同韵部的列表，如果没有共同韵部，返回 False。
             """
-        if self.yun_shu == 1:
-            first_list = hanzi_rhythm(first_hanzi, self.is_trad)  # 平水
-            other_list = [hanzi_rhythm(other_hanzi, self.is_trad) for other_hanzi in other_hanzis]
+        if ctx.yun_shu == 1:
+            first_list = hanzi_rhythm(first_hanzi, ctx.is_trad)  # 平水
+            other_list = [hanzi_rhythm(other_hanzi, ctx.is_trad) for other_hanzi in other_hanzis]
         else:  # 新韵通韵
-            yun_shu = nw.xin_yun if self.yun_shu == 2 else nw.tong_yun
-            first_list = nw.convert_yun(nw.get_new_yun(first_hanzi), yun_shu)
-            other_list = [nw.convert_yun(nw.get_new_yun(other_hanzi), yun_shu) for other_hanzi in other_hanzis]
+            yun_shu = nw.xin_yun if ctx.yun_shu == 2 else nw.tong_yun
+            first_list = nw.hanzi_new_yun(first_hanzi, yun_shu)
+            other_list = [nw.hanzi_new_yun(other_hanzi, yun_shu) for other_hanzi in other_hanzis]
         all_unknown = True
         for _ in other_list:
             if _ != [107]:
@@ -96,18 +123,19 @@ class ShiRhythm:
         if all_unknown:
             return first_list
         duplicates = set(first_list) & set(self._most_frequent_rhythm(other_list, lis=True))
-        if self.yun_shu == 1 and not duplicates:  # 使用平水韵时首句检测词林，首句可能押邻韵
-            first_ci = hanzi_rhythm(first_hanzi, self.is_trad, ci_lin=True)
-            second_ci = hanzi_rhythm(other_hanzis[0],self.is_trad, ci_lin=True)
+        if ctx.yun_shu == 1 and not duplicates:  # 使用平水韵时首句检测词林，首句可能押邻韵
+            first_ci = hanzi_rhythm(first_hanzi, ctx.is_trad, ci_lin=True)
+            second_ci = hanzi_rhythm(other_hanzis[0],ctx.is_trad, ci_lin=True)
             duplicates = set(first_ci) & set(second_ci)
         if duplicates:
             return list(duplicates)
         return False
 
-    def _poetry_yun_jiao(self, set_num: int = None) -> tuple[str, list | bool, str, str]:
+    def _poetry_yun_jiao(self, ctx: ShiContext, set_num: int = None) -> tuple[str, list | bool, str, str]:
         """
             提取一首诗中所有的韵字。
             Args:
+                ctx: 本次校验的上下文
                 set_num: 对于70字倍数的排律，需要指定其一句的字数。
             Returns:
                 返回四个值：
@@ -116,35 +144,36 @@ class ShiRhythm:
                     第一句末汉字
                     第二句末汉字
             """
-        poem_length = len(self.poem)
+        poem_length = len(ctx.poem)
         indices = []
         if poem_length % 10 == 0 and set_num != 7:
             indices = list(range(10, poem_length + 1, 10))
         elif poem_length % 14 == 0:
             indices = list(range(14, poem_length + 1, 14))
-        extracted = [self.poem[hanzi_yun_jiao - 1] for hanzi_yun_jiao in indices]
+        extracted = [ctx.poem[hanzi_yun_jiao - 1] for hanzi_yun_jiao in indices]
         other_hanzis = ''
         pos = poem_length
         if poem_length % 5 == 0 and set_num != 7:
-            first_hanzi = self.poem[4]
+            first_hanzi = ctx.poem[4]
             while pos > 8:
-                other_hanzis += self.poem[pos - 1]
+                other_hanzis += ctx.poem[pos - 1]
                 pos -= 10
         else:
-            first_hanzi = self.poem[6]
+            first_hanzi = ctx.poem[6]
             while pos > 12:
-                other_hanzis += self.poem[pos - 1]
+                other_hanzis += ctx.poem[pos - 1]
                 pos -= 14  # 或许可以简化这段代码
-        first_yayun = self._first_hard(first_hanzi, other_hanzis)
+        first_yayun = self._first_hard(ctx, first_hanzi, other_hanzis)
         if first_yayun:
             extracted.insert(0, first_hanzi)
         return ''.join(extracted), first_yayun, first_hanzi, other_hanzis
 
-    def _lyu_ju(self, sentence: str, rule: int, poem_pingze: int,
+    def _lyu_ju(self, ctx: ShiContext, sentence: str, rule: int, poem_pingze: int,
                 input_flag: int = 0) -> tuple[list[bool], int, str, str]:
         """
             判断一个句子是不是律句，包括拗句。
             Args:
+                ctx: 本次校验的上下文
                 sentence: 诗的单个句子
                 rule: 句子匹配的对应规则代码
                 input_flag: 拗句标记代码
@@ -156,21 +185,37 @@ class ShiRhythm:
                     展示的拗句提示词
             """
         hint_word = ''
-        if poem_pingze == -1:
-            self.lyu_ju_rule_dict[1] = ['11221', '21121', '11121', '21221']  # 仄韵无孤平
-            self.lyu_ju_rule_dict[4] = ['02012']
-            self.lyu_ju_rule_dict[8] = ['0102012']  # 仄韵无“中仄中仄仄”拗句，因为没法对句救
-        else:
-            self.lyu_ju_rule_dict[1] = ['11221', '21121', '11121']
-            self.lyu_ju_rule_dict[4] = ['02012', '02022']
-            self.lyu_ju_rule_dict[8] = ['0102012', '0102022']
+        rule_dict = self.LYU_JU_RULES_ZE if poem_pingze == -1 else self.LYU_JU_RULES
         if input_flag == 2:
-            patterns = self.lyu_ju_rule_dict[rule][-2:]
+            patterns = rule_dict[rule][-2:]
         else:
-            patterns = self.lyu_ju_rule_dict[rule]
+            patterns = rule_dict[rule]
 
-        sentence_pattern = ''.join(hanzi_to_pingze(char, self.yun_shu, self.is_trad) for char in sentence)
+        sentence_pattern = ''.join(hanzi_to_pingze(char, ctx.yun_shu, ctx.is_trad) for char in sentence)
+
+        matched_rule, match_list = self._best_lyu_ju(sentence_pattern, patterns)
+        change_to_hanzi_rule = {'0': '中', '1': '平', '2': '仄'}
+        hanzi_rule = ''.join(change_to_hanzi_rule[char] for char in matched_rule)
+        hint_word += f'{hanzi_rule}'
+
+        ao_word = ''
+        input_flag = self.AO_JU_FLAGS.get(matched_rule, 0)
+        if input_flag == 2:  # 拗救需提示
+            ao_word += '“中仄中仄仄”拗句，為對句相救。' if ctx.is_trad else "“中仄中仄仄”拗句。为对句相救。"
+        elif input_flag == 1:
+            ao_word += "“平平仄平仄”拗句，為本句自救。" if ctx.is_trad else "“平平仄平仄”拗句，为本句自救。"
+        return match_list, input_flag, hint_word, ao_word
 
+    @staticmethod
+    def _best_lyu_ju(sentence_pattern: str, patterns: tuple) -> tuple[str, list[bool]]:
+        """
+            在候选句式中找出与句子平仄最匹配的一个。
+            Args:
+                sentence_pattern: 句子各字的平仄代码
+                patterns: 候选句式，不匹配字数相同时取靠前的
+            Returns:
+                匹配的句式，以及表示该字平仄正确与否的布尔列表
+            """
         best_match = None
         best_match_score = float('inf')
         for pattern in patterns:
@@ -191,27 +236,13 @@ class ShiRhythm:
             if match_score < best_match_score:
                 best_match_score = match_score
                 best_match = (pattern, match_list)
+        return best_match
 
-        matched_rule, match_list = best_match
-        change_to_hanzi_rule = {'0': '中', '1': '平', '2': '仄'}
-        hanzi_rule = ''.join(change_to_hanzi_rule[char] for char in matched_rule)
-        hint_word += f'{hanzi_rule}'
-
-        ao_word = ''
-        if matched_rule in ['02022', '0102022']:  # 拗救需提示
-            input_flag = 2
-            ao_word += '“中仄中仄仄”拗句，為對句相救。' if self.is_trad else "“中仄中仄仄”拗句。为对句相救。"
-        elif matched_rule in ['0211212', '11212']:
-            input_flag = 1
-            ao_word += "“平平仄平仄”拗句，為本句自救。" if self.is_trad else "“平平仄平仄”拗句，为本句自救。"
-        else:
-            input_flag = 0
-        return match_list, input_flag, hint_word, ao_word
-
-    def _check_real_first(self, first: list | bool, second: int, first_sen: str, sen_type: int) -> tuple[int, int]:
+    def _check_real_first(self, ctx: ShiContext, first: list | bool, second: int, first_sen: str, sen_type: int) -> tuple[int, int]:
         """
             检测可能出现的特殊情况：首句不押韵但是第一句末字平仄与第二句末字同，此时修整第一句格式，判断为押韵但是此处用韵有误。
             Args:
+                ctx: 本次校验的上下文
                 first: 第一个判断标准。即两字共同的韵列表，若无则为 False
                 second: 第二个判断标准，如果为 1，则两字均为平，如果为 -1，则两字均为仄，如果为 0，则表示平仄不同
                 first_sen: 诗的第一句内容
@@ -221,8 +252,8 @@ class ShiRhythm:
                     修正后的 sen_type
                     修正后的 second
             """
-        last1 = hanzi_to_pingze(first_sen[-1], self.yun_shu, self.is_trad)
-        last3 = hanzi_to_pingze(first_sen[-3], self.yun_shu, self.is_trad)
+        last1 = hanzi_to_pingze(first_sen[-1], ctx.yun_shu, ctx.is_trad)
+        last3 = hanzi_to_pingze(first_sen[-3], ctx.yun_shu, ctx.is_trad)
         if last1 not in ['0', '3']:
             return sen_type, second
         change_dict = {1: 2, 3: 4, 4: 3, 2: 1, 5: 6, 6: 5, 7: 8, 8: 7}
@@ -272,10 +303,11 @@ class ShiRhythm:
                     first_sen_type = ze_turn_rule[first_sen_type]
         return sen_list
 
-    def _yun_jiao_show(self, zi: str, poem_rhythm_num: int, is_first_sentence: bool) -> str:
+    def _yun_jiao_show(self, ctx: ShiContext, zi: str, poem_rhythm_num: int, is_first_sentence: bool) -> str:
         """
             展示韵脚。
             Args:
+                ctx: 本次校验的上下文
                 zi: 韵脚汉字
                 poem_rhythm_num: 诗所押的韵的数字表示
                 is_first_sentence: 是否为首句
@@ -284,30 +316,30 @@ class ShiRhythm:
             """
         yun_jiao_content = ''
         zi_list = []
-        yun = '韻' if self.is_trad else '韵'
-        lin = '鄰' if self.is_trad else '邻'
-        if self.yun_shu == 1:
-            zi_rhythm = hanzi_rhythm(zi, self.is_trad)
+        yun = '韻' if ctx.is_trad else '韵'
+        lin = '鄰' if ctx.is_trad else '邻'
+        if ctx.yun_shu == 1:
+            zi_rhythm = hanzi_rhythm(zi, ctx.is_trad)
             zi_rhythm.sort()
-            using_name = rhythm_name_trad if self.is_trad else rhythm_name
+            using_name = rhythm_name_trad if ctx.is_trad else rhythm_name
             for _ in zi_rhythm:
                 zi_list.append(''.join(using_name)[_ - 1])
         else:
-            if self.yun_shu == 2:
-                zi_rhythm = nw.convert_yun(nw.get_new_yun(zi), nw.xin_yun)
+            if ctx.yun_shu == 2:
+                zi_rhythm = nw.hanzi_new_yun(zi, nw.xin_yun)
             else:
-                zi_rhythm = nw.convert_yun(nw.get_new_yun(zi), nw.tong_yun)
+                zi_rhythm = nw.hanzi_new_yun(zi, nw.tong_yun)
             if zi_rhythm != [107]:
-                if self.yun_shu == 2:
-                    using_xin = nw.xin_hanzi_trad if self.is_trad else nw.xin_hanzi
+                if ctx.yun_shu == 2:
+                    using_xin = nw.xin_hanzi_trad if ctx.is_trad else nw.xin_hanzi
                     for _ in zi_rhythm:
                         zi_list.append(''.join(using_xin)[int(math.fabs(_)) - 1])
                 else:
-                    using_tong = nw.tong_hanzi_trad if self.is_trad else nw.tong_hanzi
+                    using_tong = nw.tong_hanzi_trad if ctx.is_trad else nw.tong_hanzi
                     for _ in zi_rhythm:
                         zi_list.append(''.join(using_tong)[int(math.fabs(_)) - 1])
         if_ya_yun = True if poem_rhythm_num in zi_rhythm else False
-        if not if_ya_yun and is_first_sentence and poem_rhythm_num <= 30 and self.yun_shu == 1:  # 首句用邻韵
+        if not if_ya_yun and is_first_sentence and poem_rhythm_num <= 30 and ctx.yun_shu == 1:  # 首句用邻韵
             all_ci = rhythm_correspond[poem_rhythm_num]
             if isinstance(all_ci, int):
                 all_ci = {all_ci}
@@ -333,10 +365,11 @@ class ShiRhythm:
             yun_jiao_content = f'不知{yun}部'  # 生僻字处理模块
         return yun_jiao_content
 
-    def _sentence_show(self, show_sentence: str, sen_ge_lyu: list[bool]) -> str:
+    def _sentence_show(self, ctx: ShiContext, show_sentence: str, sen_ge_lyu: list[bool]) -> str:
         """
             展示律句的平仄情况。
             Args:
+                ctx: 本次校验的上下文
                 show_sentence: 展示的句子
                 sen_ge_lyu: 表示该字平仄正确与否的列表
             Returns:
@@ -345,7 +378,7 @@ class ShiRhythm:
         sp_zi = []
         ge_lju_show = ''
         for char in show_sentence:
-            ping_ze = hanzi_to_pingze(char, self.yun_shu, self.is_trad)
+            ping_ze = hanzi_to_pingze(char, ctx.yun_shu, ctx.is_trad)
             sp_zi.append('duo') if ping_ze == '0' else sp_zi.append('no') if ping_ze != '3' else sp_zi.append('pi')
 
         for i, is_valid in enumerate(sen_ge_lyu):
@@ -355,20 +388,21 @@ class ShiRhythm:
                 ge_lju_show += self.sh[1] if sp_zi[i] != 'pi' else self.sh[3]
         return ge_lju_show
 
-    def _special_two_pingze(self, hanzi1: str, hanzi2: str, poem_pingze: int) -> int:
+    def _special_two_pingze(self, ctx: ShiContext, hanzi1: str, hanzi2: str, poem_pingze: int) -> int:
         """
             根据第一句末字与第二句末字，诗的平仄得到第二个判断标准。
             Args:
+                ctx: 本次校验的上下文
                 hanzi1: 第一句末汉字
                 hanzi2: 第二句末汉字
                 poem_pingze: 全诗的押韵平仄，1平 -1仄
             Returns:
                 第二个判断标准（两者平仄是否相同）
             """
-        ping_ze1 = hanzi_to_pingze(hanzi1, self.yun_shu, self.is_trad)
+        ping_ze1 = hanzi_to_pingze(hanzi1, ctx.yun_shu, ctx.is_trad)
         if ping_ze1 == '3':
             ping_ze1 = '0'
-        ping_ze2 = hanzi_to_pingze(hanzi2, self.yun_shu, self.is_trad)
+        ping_ze2 = hanzi_to_pingze(hanzi2, ctx.yun_shu, ctx.is_trad)
         if ping_ze2 == '3':
             ping_ze2 = '0'
         if ping_ze1 + ping_ze2 in ['12', '21']:
@@ -381,28 +415,32 @@ class ShiRhythm:
             return 1 if poem_pingze == 1 else -1
         return 0
 
-    def _is_all_duo_yin(self, yun_jiao_content: str) -> bool:
+    def _is_all_duo_yin(self, ctx: ShiContext, yun_jiao_content: str) -> bool:
         """
             判断韵脚字是不是全部是多音字。
             Args:
+                ctx: 本次校验的上下文
                 yun_jiao_content: 韵脚汉字的字符串
             Returns:
                 是否全部为多音字
             """
         for i in yun_jiao_content:
-            ping_ze = hanzi_to_pingze(i, self.yun_shu, self.is_trad)
+            ping_ze = hanzi_to_pingze(i, ctx.yun_shu, ctx.is_trad)
             if ping_ze != '0':
                 return False
         return True
 
-    def _check_sentence_lengths(self):
+    @staticmethod
+    def _check_sentence_lengths(ctx: ShiContext) -> int:
         """
             将文本按照标点符号分割，计算所有片段的长度如果所有片段长度一致，返回该长度；否则返回 None
+            Args:
+                ctx: 本次校验的上下文
             Returns:
                 所有片段长度一致时返回该长度，否则返回 None
             """
         punctuation_pattern = r'[.!?;:,，。？！；：、]'
-        segments = re.split(punctuation_pattern, self.poem_comma)
+        segments = re.split(punctuation_pattern, ctx.poem_comma)
         non_empty_segments = [segment.strip() for segment in segments if segment.strip()]
         return len(non_empty_segments[0])
 
@@ -413,19 +451,19 @@ class ShiRhythm:
         inter = set(f_rhythm) & {this_rhythm}
         return next(iter(inter)) if inter else f_rhythm[0]
 
-    def _build_report(self, maybe_len, main_rhythm, f_rhythm,
+    def _build_report(self, ctx: ShiContext, maybe_len, main_rhythm, f_rhythm,
                       f_hanzi, s_hanzi, pingze):
         """为单平仄方向生成完整报告"""
-        sen_len = maybe_len or self._infer_sen_len(self.poem, self.poem_comma != self.poem)
-        total_lines = len(self.poem) // sen_len
-        poem_type = self._infer_poem_type(total_lines)
+        sen_len = maybe_len or self._infer_sen_len(ctx.poem, ctx.poem_comma != ctx.poem)
+        total_lines = len(ctx.poem) // sen_len
+        poem_type = self._infer_poem_type(ctx, total_lines)
 
         report = f'{num_to_cn(sen_len)}言{poem_type}\n'
 
-        s_rhythm = self._special_two_pingze(f_hanzi, s_hanzi, pingze)
-        first_checker = ShiFirst(self.poem, self.yun_shu, s_rhythm, pingze, sen_len, self.is_trad)
-        first_type, s_rhythm = self._check_real_first(f_rhythm, s_rhythm,
-                                                      self.poem[:sen_len],
+        s_rhythm = self._special_two_pingze(ctx, f_hanzi, s_hanzi, pingze)
+        first_checker = ShiFirst(ctx.poem, ctx.yun_shu, s_rhythm, pingze, sen_len, ctx.is_trad)
+        first_type, s_rhythm = self._check_real_first(ctx, f_rhythm, s_rhythm,
+                                                      ctx.poem[:sen_len],
                                                       first_checker.main_first())
         rule_list = self._which_sentence(first_type, total_lines, s_rhythm, pingze)
 
@@ -436,18 +474,18 @@ class ShiRhythm:
 
         hint_buf = sen_buf = ge_buf = ao_buf = ''
         sen_mode = 0  # 默认设置为正常句式
-        lian = "聯" if self.is_trad else '联'
+        lian = "聯" if ctx.is_trad else '联'
         for idx, rule in enumerate(rule_list):
-            sentence = self.poem[sen_len * idx: sen_len * (idx + 1)]
-            ge_lju, sen_mode, hint, ao = self._lyu_ju(sentence, rule, pingze, sen_mode)
+            sentence = ctx.poem[sen_len * idx: sen_len * (idx + 1)]
+            ge_lju, sen_mode, hint, ao = self._lyu_ju(ctx, sentence, rule, pingze, sen_mode)
             hint_buf += hint + '\u3000'
             sen_buf += sentence + '\u3000'
             ao_buf += (f'\n本{lian}{"上" if idx % 2 == 0 else "下"}句' + ao) if ao else ''
-            ge_buf += self._sentence_show(sentence, ge_lju) + '\u3000'
+            ge_buf += self._sentence_show(ctx, sentence, ge_lju) + '\u3000'
 
             # 逢押韵句
             if idx + 1 in yun_positions:
-                yun_info = self._yun_jiao_show(sentence[-1], main_rhythm, idx == 0)
+                yun_info = self._yun_jiao_show(ctx, sentence[-1], main_rhythm, idx == 0)
                 ge_buf = self._mark_yun(ge_buf, yun_info)
                 report += f'\n{hint_buf}\n{sen_buf}{yun_info}\n{ge_buf}{ao_buf}\n'
                 hint_buf = sen_buf = ge_buf = ao_buf = ''
@@ -471,26 +509,127 @@ class ShiRhythm:
             best = result_check(best, r)
         return best
 
-    def main_shi(self) -> str | int:
+    def _line_marks(self, codes: str, rule: int, poem_pingze: int, input_flag: int) -> tuple[str, int]:
+        """
+            与 _lyu_ju、_sentence_show 相同的判断，只用平仄代码得出一句的平仄标记。
+            Returns:
+                返回两个值：
+                    各字的标记，'o' 为〇或◎，'x' 为●，'-' 为不计入平仄分的生僻字
+                    拗句代码
+            """
+        key = (codes, rule, poem_pingze, input_flag == 2)
+        cached = self._line_marks_cache.get(key)
+        if cached is not None:
+            return cached
+        rule_dict = self.LYU_JU_RULES_ZE if poem_pingze == -1 else self.LYU_JU_RULES
+        patterns = rule_dict[rule][-2:] if input_flag == 2 else rule_dict[rule]
+        matched_rule, match_list = self._best_lyu_ju(codes, patterns)
+        marks = ''.join('-' if s_char == '3' else 'o' if is_valid else 'x'
+                        for s_char, is_valid in zip(codes, match_list))
+        result = self._line_marks_cache[key] = (marks, self.AO_JU_FLAGS.get(matched_rule, 0))
+        return result
+
+    def pingze_marks_bound(self, yun_shu: int, poem: str, poem_comma: str, is_trad: bool = False) -> tuple[int, int]:
+        """
+        不做完整校验，估计 main_shi 报告中平仄标记的 (正确数, 总数) 的上界，
+        其比值不低于对报告做 analyze_pingze_result_with_jiujiu 得到的比值，用于提前估计平仄分的上界。
+        报告中的平仄标记只由各字的平仄代码和首句格式、首句是否押韵、平仄韵三者决定，这里对三者的所有取值
+        按 _which_sentence、_lyu_ju 和拗救的规则逐一标记，取比值最大的一种；
+        韵脚字的标记可能被押韵标记替换，按对比值有利的一种情况计算。
+        Args:
+            yun_shu: 使用韵书的代码
+            poem: 仅含汉字的诗歌内容
+            poem_comma: 保留标点的诗歌内容
+            is_trad: 簡體 or 繁體
+        Returns:
+            (正确数, 总数)，总数为 0 时平仄分为 0
+        """
+        # '〇' 既是汉字也是平仄标记，出现在诗句中时不做估计
+        if self.sh[0] in poem:
+            return 1, 1
+        ctx = ShiContext(yun_shu, poem, poem_comma, is_trad)
+        if ctx.poem_comma != ctx.poem:
+            try:
+                candidates = [self._check_sentence_lengths(ctx)]
+            except IndexError:
+                return 0, 0
+            if candidates[0] not in (5, 7):
+                return 0, 0
+        elif len(poem) >= 70 and len(poem) % 70 == 0:
+            candidates = [5, 7]
+        else:
+            candidates = [self._infer_sen_len(poem, False)]
+
+        cache = self._pingze_codes
+        codes = []
+        for char in poem:
+            code = cache.get((yun_shu, is_trad, char))
+            if code is None:
+                code = cache[(yun_shu, is_trad, char)] = hanzi_to_pingze(char, yun_shu, is_trad)
+            codes.append(code)
+        codes = ''.join(codes)
+
+        best = (0, 0)
+        for sen_len in candidates:
+            total_lines = len(codes) // sen_len
+            lines = [codes[sen_len * idx: sen_len * (idx + 1)] for idx in range(total_lines)]
+            for first_type in range(1, 9):
+                for first_yayun in (0, 1):
+                    yun_positions = set(range(2, total_lines + 1, 2))
+                    if first_yayun:
+                        yun_positions.add(1)
+                    for pingze in (1, -1):
+                        rule_list = self._which_sentence(first_type, total_lines, first_yayun, pingze)
+                        correct = total = 0
+                        block = ''
+                        has_jiujiu = False
+                        sen_mode = 0
+                        for idx, rule in enumerate(rule_list):
+                            marks, sen_mode = self._line_marks(lines[idx], rule, pingze, sen_mode)
+                            block += marks
+                            # 本联上句为拗句时，整联的错字都按拗救算作正确
+                            if sen_mode and idx % 2 == 0:
+                                has_jiujiu = True
+                            if idx + 1 in yun_positions:
+                                wrong = block.count('x')
+                                correct += block.count('o') + (wrong if has_jiujiu else 0)
+                                total += block.count('o') + wrong
+                                # 韵脚字的标记被替换时不再计入，错字被替换对比值有利
+                                if block[-1] == 'x' and not has_jiujiu:
+                                    total -= 1
+                                block = ''
+                                has_jiujiu = False
+                        # 比较 correct / total 与 best 的比值，总数为 0 时比值为 0
+                        if total and (not best[1] or correct * best[1] > best[0] * total):
+                            best = (correct, total)
+        return best
+
+    def main_shi(self, yun_shu: int, poem: str, poem_comma: str, is_trad: bool = False) -> str | int:
         """
-        诗歌格律校验主入口
+        诗歌格律校验主入口，可在多个线程中对同一实例并发调用。
+        Args:
+            yun_shu: 使用韵书的代码，1平水韵 2中华新韵 3中华通韵
+            poem: 仅含汉字的诗歌内容
+            poem_comma: 保留标点的诗歌内容
+            is_trad: 簡體 or 繁體
         Returns:
             校验文本 或 错误码 1/2
         """
+        ctx = ShiContext(yun_shu, poem, poem_comma, is_trad)
         # 1. 快速失败：句长不合法
-        if self.poem_comma != self.poem:
-            sen_len = self._check_sentence_lengths()
+        if ctx.poem_comma != ctx.poem:
+            sen_len = self._check_sentence_lengths(ctx)
             if sen_len not in (5, 7):
                 return 1
             candidates = [sen_len]
         else:
-            candidates = [5, 7] if len(self.poem) >= 70 and len(self.poem) % 70 == 0 else [None]
+            candidates = [5, 7] if len(ctx.poem) >= 70 and len(ctx.poem) % 70 == 0 else [None]
 
         # 2. 对每种候选句长做校验
         results = []
         for maybe_len in candidates:
-            yun_jiaos, f_rhythm, f_hanzi, s_hanzi = self._poetry_yun_jiao(maybe_len)
-            rhythms = [hanzi_to_yun(y, self.yun_shu, self.is_trad) for y in yun_jiaos]
+            yun_jiaos, f_rhythm, f_hanzi, s_hanzi = self._poetry_yun_jiao(ctx, maybe_len)
+            rhythms = [hanzi_to_yun(y, ctx.yun_shu, ctx.is_trad) for y in yun_jiaos]
 
             # 2.1 未知韵部过多
             if all(r == [107] or not r for r in rhythms):
@@ -500,14 +639,14 @@ class ShiRhythm:
             f_rhythm = self._fix_f_rhythm(f_rhythm, main_rhythm)
 
             # 2.2 平仄标记
-            pingze = self._rhythm_to_pingze(main_rhythm, self.yun_shu)
-            if self._is_all_duo_yin(yun_jiaos):
+            pingze = self._rhythm_to_pingze(main_rhythm, ctx.yun_shu)
+            if self._is_all_duo_yin(ctx, yun_jiaos):
                 pingze = 0
             pingze_list = [1, -1] if pingze == 0 else [pingze]
 
             # 2.3 对每种平仄方向生成报告
             for pz in pingze_list:
-                results.append(self._build_report(maybe_len, main_rhythm, f_rhythm,
+                results.append(self._build_report(ctx, maybe_len, main_rhythm, f_rhythm,
                                                   f_hanzi, s_hanzi, pz))
 
         return self._merge_results(results).lstrip()
@@ -5,13 +5,33 @@
 """
 
 import json
+import subprocess
 import sys
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import SkipTest
 
-# 添加当前目录到Python路径
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+if __package__ in (None, ''):
+    # 直接以脚本方式运行时，用项目根目录替换脚本所在目录，保证只经由 poetry_scorer 包导入（避免韵表被重复加载）
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-from poetry_scorer_jiujiu import PoetryScorer
+from poetry_scorer import json_codec, parquet_io
+from poetry_scorer.compressed_io import CompressOptions, detect_compression, expand_inputs, open_output
+from poetry_scorer.dedup import MinHasher, deduplicate_file
+from poetry_scorer.json_array_reader import is_json_array, iter_json_array
+from poetry_scorer.jsonl_index import JsonlIndex
+from poetry_scorer.jsonl_reader import SELECTIVE_DECODE_BYTES, iter_projected_records, splice_fields
+from poetry_scorer.common.common import hanzi_to_pingze, hanzi_to_yun, precomputed_codes, rhyme_table_fingerprint
+from poetry_scorer.poem_form import Form, classify, classify_many, form_of_length, tokenize
+from poetry_scorer.poem_pack import PackedRecord, PoemPack, is_poem_pack, write_pack
+from poetry_scorer.poetry_scorer_jiujiu import PoetryScorer, extract_chinese
+from poetry_scorer.poetry_quality_extractor import PoetryQualityExtractor, PoemForm
+from poetry_scorer.sampling import Reservoir, assign_splits, parse_splits, split_output_path
+from poetry_scorer.score_stats import ScoreStats
+from poetry_scorer.score_store import ScoreStore
+from poetry_scorer.sharding import ShardSpec, iter_jsonl_lines
+from poetry_scorer.title_filter import AhoCorasick, TitleFilter
 
 
 def test_poetry_scorer():
@@ -74,10 +94,988 @@ def test_poetry_scorer():
     return True
 
 
-if __name__ == "__main__":
+def test_rhyme_tables_loaded_once():
+    """测试各入口混合导入时，韵表模块在进程内只加载一次"""
+    print("开始测试韵表加载次数...")
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(package_dir)
+    code = (
+        "import runpy, sys\n"
+        "import poetry_scorer.poetry_quality_extractor\n"
+        "import poetry_scorer.run\n"
+        f"runpy.run_path({os.path.join(package_dir, 'run.py')!r}, run_name='run_script')\n"
+        f"runpy.run_path({os.path.join(package_dir, 'poetry_scorer_jiujiu.py')!r}, run_name='jiujiu_script')\n"
+        "names = [name for name in sys.modules if name.split('.')[-1] in ('hanzi_class', 'hanzi_pinyin_class')]\n"
+        "print(sorted(names))\n"
+        "assert sorted(names) == ['poetry_scorer.hanzi.hanzi_class', 'poetry_scorer.hanzi.hanzi_pinyin_class'], names\n"
+        "assert not {'hanzi', 'rhythm', 'shi', 'common'} & set(sys.modules)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=project_root, capture_output=True, text=True)
+    print(result.stdout.strip())
+    assert result.returncode == 0, result.stderr
+
+    print("韵表只加载了一次")
+
+
+def test_shared_scorer_thread_safety():
+    """并发压力测试：多个线程共享同一个评分器（及其格律校验器），结果应与串行评分完全一致"""
+    print("开始并发压力测试...")
+
+    test_poems = [
+        ("床前明月光，疑是地上霜。举头望明月，低头思故乡。", "五言绝句"),
+        ("千山鸟飞绝，万径人踪灭。孤舟蓑笠翁，独钓寒江雪。", "五言绝句"),  # 仄韵
+        ("朝辞白帝彩云间，千里江陵一日还。两岸猿声啼不住，轻舟已过万重山。", "七言绝句"),
+        ("国破山河在，城春草木深。感时花溅泪，恨别鸟惊心。烽火连三月，家书抵万金。白头搔更短，浑欲不胜簪。", "五言律诗"),
+        ("风急天高猿啸哀，渚清沙白鸟飞回。无边落木萧萧下，不尽长江滚滚来。"
+         "万里悲秋常作客，百年多病独登台。艰难苦恨繁霜鬓，潦倒新停浊酒杯。", "七言律诗"),
+        ("一去二三里，烟村四五家。亭台六七座，八九十枝花。", "五言绝句"),
+    ]
+    rounds = 30
+
+    scorer = PoetryScorer()
+    expected = [scorer.score_poem(poem, instruct, rhyme_system) for poem, instruct in test_poems
+                for rhyme_system in ('pingshui', 'xin', 'tong')]
+    jobs = [(poem, instruct, rhyme_system) for poem, instruct in test_poems
+            for rhyme_system in ('pingshui', 'xin', 'tong')] * rounds
+
+    # 缩短线程切换间隔，尽量让不同线程在同一次校验中途交错执行
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
     try:
-        test_poetry_scorer()
-        print("\n✅ 所有测试通过！")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda job: scorer.score_poem(*job), jobs))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert results == expected * rounds
+    print(f"{len(jobs)} 次并发评分结果与串行一致")
+
+
+def test_streaming_top_k_extraction():
+    """测试流式提取：每类只保留前 k 条，同分按出现顺序，结果与非流式一致且只含 keep_fields"""
+    print("开始测试流式 top-k 提取...")
+
+    poems = [
+        "床前明月光，疑是地上霜。举头望明月，低头思故乡。",
+        "白日依山尽，黄河入海流。欲穷千里目，更上一层楼。",
+        "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。",
+        "千山鸟飞绝，万径人踪灭。孤舟蓑笠翁，独钓寒江雪。",
+        "一去二三里，烟村四五家。亭台六七座，八九十枝花。",
+    ]
+    records = [{'id': i, 'content': poem, 'instruct': '五言绝句', 'system': 'x' * 100}
+               for i, poem in enumerate(poems * 2)]
+    keep_fields = ['id', 'content']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        outputs = []
+        for streaming in (False, True):
+            output_file = os.path.join(tmp_dir, f'output_{streaming}.jsonl')
+            PoetryQualityExtractor().process_dataset(input_file, 'content', 'instruct', output_file,
+                                                     {'five_quatrain': 4}, keep_fields, True, streaming)
+            with open(output_file, 'r', encoding='utf-8') as f:
+                outputs.append([json.loads(line) for line in f])
+
+    scorer = PoetryScorer()
+    totals = []
+    for record in records:
+        result = scorer.score_poem(record['content'], record['instruct'])
+        totals.append((result['format_score'] + result['pingze_score'] + result['rhyme_score']) / 3)
+    expected_ids = sorted(range(len(records)), key=lambda i: totals[i], reverse=True)[:4]
+
+    assert outputs[0] == outputs[1]
+    assert [item['id'] for item in outputs[1]] == expected_ids
+    assert all(set(item) == set(keep_fields) for item in outputs[1])
+    print("流式提取结果正确")
+
+
+def test_score_bound_pruning():
+    """测试分阶段上界剪枝：只剪掉总分不可能超过下限的诗，未剪枝时结果与完整评分一致"""
+    print("开始测试上界剪枝...")
+
+    scorer = PoetryScorer()
+    poems = [
+        ("床前明月光，疑是地上霜。举头望明月，低头思故乡。", "五言绝句"),
+        ("白日依山尽，黄河入海流。欲穷千里目，更上一层楼。", "五言绝句"),
+        ("一去二三里，烟村四五家。亭台六七座，八九十枝花。", "五言绝句"),
+        ("朝辞白帝彩云间，千里江陵一日还。两岸猿声啼不住，轻舟已过万重山。", "七言律诗"),
+        ("春风吹柳丝，江南飞花时。青山人不知，千家烟云低。", "五言绝句"),
+    ]
+    for rhyme_system in ('pingshui', 'xin'):
+        for poem, instruct in poems:
+            full = scorer.score_poem(poem, instruct, rhyme_system, all_rhyme_systems=False)
+            # 不做校验估计的平仄分上界不低于实际的平仄分
+            assert scorer.pingze_upper_bound(extract_chinese(poem), extract_chinese(poem, comma_remain=True)) >= \
+                full['pingze_score'], poem
+            total = (full['format_score'] + full['pingze_score'] + full['rhyme_score']) / 3
+            for min_total in (0.0, total - 0.01, total, 100.0):
+                result = scorer.score_poem(poem, instruct, rhyme_system, all_rhyme_systems=False,
+                                           min_total=min_total)
+                if 'pruned' in result:
+                    assert total <= min_total, (poem, rhyme_system, min_total)
+                else:
+                    assert result == full, (poem, rhyme_system, min_total)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for i, (poem, instruct) in enumerate(poems * 3):
+                f.write(json.dumps({'id': i, 'content': poem, 'instruct': instruct}, ensure_ascii=False) + '\n')
+        stats = PoetryQualityExtractor().process_dataset(
+            input_file, 'content', 'instruct', os.path.join(tmp_dir, 'output.jsonl'),
+            {'five_quatrain': 1, 'eight_seven': 1}, ['id'], True)
+    pruning = stats['pruning']
+    assert pruning['pruned_after_format'] + pruning['pruned_after_pingze'] > 0
+    assert (pruning['fully_scored'] + pruning['pruned_after_format'] +
+            pruning['pruned_after_pingze']) == stats['total_processed']
+
+    # 平水韵下堆中最低分不足 100 时，格式满分、平仄分上界不够的诗在校验前剪掉，结果与不剪枝时相同
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for i in (2, 4, 0):
+                f.write(json.dumps({'id': i, 'content': poems[i][0], 'instruct': poems[i][1]}, ensure_ascii=False) + '\n')
+        output_file = os.path.join(tmp_dir, 'output.json')
+        stats = PoetryQualityExtractor('pingshui').process_dataset(
+            input_file, 'content', 'instruct', output_file, {'five_quatrain': 1}, ['id'], True)
+        assert stats['pruning']['pruned_after_format'] == 0 and stats['pruning']['pruned_after_pingze'] > 0
+        assert [item['id'] for item in json_codec.load_file(output_file)] == [2]
+    print("上界剪枝结果正确")
+
+
+def test_schema_resolution():
+    """测试字段推断：按开头记录确定字段，缺少字段的记录只计数，严格模式直接报错；指令只解析一次"""
+    print("开始测试字段推断...")
+
+    extractor = PoetryQualityExtractor()
+    sample = [{'text': '床前明月光', 'prompt': '五言绝句'}, {'text': '白日依山尽', 'format': '五言绝句'}]
+    assert extractor.resolve_schema(sample, 'prediction', 'instruct') == ('text', 'prompt')
+    try:
+        extractor.resolve_schema(sample, 'text', 'instruct', strict=True)
+        raise AssertionError("严格模式应当报错")
+    except ValueError:
+        pass
+
+    form, instruct_info = extractor.parse_instruct_form('请写一首七言律诗')
+    assert form is PoemForm.EIGHT_SEVEN
+    assert instruct_info == {'sentence_length': 7, 'poem_type': '律诗'}
+    assert extractor.parse_instruct_form('请写一首七言律诗')[1] is instruct_info
+    assert extractor.parse_instruct_form('随便写一首')[0] is PoemForm.UNSPECIFIED
+
+    poem = "床前明月光，疑是地上霜。举头望明月，低头思故乡。"
+    records = [{'content': poem, 'instruct': '五言绝句'}, {'content': poem}, {'instruct': '五言绝句'}]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output_file = os.path.join(tmp_dir, 'output.jsonl')
+        stats = extractor.process_dataset(input_file, 'content', 'instruct', output_file,
+                                          {'five_quatrain': 10}, ['content'], True)
+        assert stats['total_processed'] == 1
+        assert stats['skipped']['missing_poem_field'] == 1
+        assert stats['skipped']['missing_instruct_field'] == 1
+        stats = extractor.process_dataset(input_file, 'content', 'instruct', output_file,
+                                          {'five_quatrain': 10}, ['content'], True, strict_schema=True)
+        assert 'error' in stats
+    print("字段推断结果正确")
+
+
+def test_score_stats_merge():
+    """测试统计累加器：分两半累计、序列化后合并，与一次累计的结果一致"""
+    print("开始测试统计累加器...")
+
+    values = [0.0, 33.33, 50.0, 66.67, 66.67, 75.0, 91.67, 100.0, 100.0, 100.0]
+    whole, first, second = ScoreStats(), ScoreStats(), ScoreStats()
+    for i, value in enumerate(values):
+        whole.add('五言绝句', {'total': value})
+        (first if i % 2 else second).add('五言绝句', {'total': value})
+    merged = ScoreStats.from_dict(json.loads(json.dumps(first.to_dict()))).merge(second)
+
+    assert merged.to_dict()['五言绝句']['total']['histogram'] == whole.to_dict()['五言绝句']['total']['histogram']
+    assert merged.summary('五言绝句') == whole.summary('五言绝句')
+    total = whole.get('五言绝句', 'total')
+    assert total.count == len(values) and abs(total.mean - sum(values) / len(values)) < 1e-9
+    assert total.quantile(0.5) == 66.67 and total.quantile(1.0) == 100.0 and total.min == 0.0
+    print("统计累加器结果正确")
+
+
+def test_sharded_extraction_merge():
+    """测试分片：两种分片方式都不重不漏，合并后的提取结果与单机运行一致"""
+    print("开始测试分片与合并...")
+
+    poems = [
+        "床前明月光，疑是地上霜。举头望明月，低头思故乡。",
+        "白日依山尽，黄河入海流。欲穷千里目，更上一层楼。",
+        "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。",
+        "一去二三里，烟村四五家。亭台六七座，八九十枝花。",
+        "朝辞白帝彩云间，千里江陵一日还。两岸猿声啼不住，轻舟已过万重山。",
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for i, poem in enumerate(poems * 4):
+                f.write(json.dumps({'id': i, 'content': poem, 'instruct': '绝句'}, ensure_ascii=False) + '\n')
+                if i % 7 == 0:
+                    f.write('\n')
+
+        lines = [line for _, line in iter_jsonl_lines(input_file)]
+        for mode in ('hash', 'range'):
+            shard_lines = [line for index in range(3)
+                           for _, line in iter_jsonl_lines(input_file, ShardSpec(index, 3, mode))]
+            assert sorted(shard_lines) == sorted(lines), mode
+
+        max_per_category = {'five_quatrain': 3, 'seven_quatrain': 1}
+        expected_file = os.path.join(tmp_dir, 'expected.jsonl')
+        PoetryQualityExtractor().process_dataset(input_file, 'content', 'instruct', expected_file,
+                                                 max_per_category, ['id'], True)
+        with open(expected_file, 'r', encoding='utf-8') as f:
+            expected = f.read()
+
+        for mode in ('hash', 'range'):
+            shard_files = []
+            for index in range(3):
+                output_file = os.path.join(tmp_dir, f'{mode}{index}.jsonl')
+                PoetryQualityExtractor().process_dataset(input_file, 'content', 'instruct', output_file,
+                                                         max_per_category, ['id'], True,
+                                                         shard=ShardSpec(index, 3, mode))
+                shard_files.append(os.path.join(tmp_dir, f'{mode}{index}_shard.json'))
+            merged_file = os.path.join(tmp_dir, f'{mode}_merged.jsonl')
+            stats = PoetryQualityExtractor().merge_shards(shard_files, merged_file)
+            with open(merged_file, 'r', encoding='utf-8') as f:
+                assert f.read() == expected, mode
+            assert stats['total_processed'] == len(poems) * 4
+    print("分片与合并结果正确")
+
+
+def test_jsonl_index():
+    """测试JSONL行偏移索引：随机读取、区间读取、分段，以及源文件变化后重建"""
+    print("开始测试JSONL索引...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        records = [{'id': i, 'content': '床前明月光' * (i % 5 + 1)} for i in range(50)]
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + ('\n  \n' if record['id'] % 9 == 0 else '\n'))
+            f.write(json.dumps({'id': 50}))
+
+        index = JsonlIndex.load_or_build(input_file)
+        assert len(index) == 51
+        assert [index.record(i)['id'] for i in (0, 9, 10, 49, 50)] == [0, 9, 10, 49, 50]
+        assert [json.loads(line)['id'] for _, line in index.iter_lines(8, 12)] == [8, 9, 10, 11]
+        chunks = index.chunks(4)
+        assert chunks[0][0] == 0 and chunks[-1][1] == 51
+        assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+        index.close()
+
+        # 分段与按字节范围分片的划分相同（分片的序号即行首偏移），文件开头有空行时也一样
+        padded_file = os.path.join(tmp_dir, 'padded.jsonl')
+        with open(input_file, 'rb') as src, open(padded_file, 'wb') as dst:
+            dst.write(b' \n' * 500 + src.read())
+        for path in (input_file, padded_file):
+            with JsonlIndex.build(path) as built:
+                for n in (1, 3, 7, 60):
+                    for k, (start, stop) in enumerate(built.chunks(n)):
+                        assert [seq for seq, _ in iter_jsonl_lines(path, ShardSpec(k, n, 'range'))] == \
+                            list(built.offsets[start:stop]), (path, n, k)
+
+        # 源文件未变化时直接读取保存的索引，变化后重建
+        index_file = JsonlIndex.index_path(input_file)
+        with open(index_file, 'r+b') as f:
+            f.seek(32)
+            f.write((7).to_bytes(8, 'little'))
+        assert JsonlIndex.load_or_build(input_file).offsets[0] == 7
+        with open(input_file, 'a', encoding='utf-8') as f:
+            f.write('\n' + json.dumps({'id': 51}) + '\n')
+        os.utime(input_file, ns=(0, os.stat(input_file).st_mtime_ns + 1))
+        with JsonlIndex.load_or_build(input_file) as index:
+            assert len(index) == 52 and index.offsets[0] == 0 and index.record(51)['id'] == 51
+    print("JSONL索引结果正确")
+
+
+def test_projected_reader():
+    """测试按字段投影读取JSONL，以及在原始行上改写字段"""
+    print("开始测试字段投影读取...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'system': '提示词' * 100, 'content': '床前明月光', 'id': 1}, ensure_ascii=False) + '\n')
+            f.write('not json\n\n[1, 2]\n')
+            f.write(json.dumps({'content': '白日依山尽', 'meta': {'a': '}"', 'b': [1, ']']}}, ensure_ascii=False) + '\n')
+
+        invalid = []
+        records = list(iter_projected_records(input_file, ('content', 'id'), keep_raw=True,
+                                              on_invalid=lambda seq, line: invalid.append(seq)))
+        assert [record for _, record in records] == [{'content': '床前明月光', 'id': 1}, {'content': '白日依山尽'}]
+        assert [seq for seq, _ in records] == [0, 3] and invalid == [1, 2]
+
+        # 改写后的行与对完整记录赋值后 json.dumps 的结果一致
+        updates = {'content': '白日依山尽黄河入海流', 'instruct': '五言绝句'}
+        for _, record in records:
+            full = json.loads(record.raw)
+            full.update(updates)
+            assert splice_fields(record.raw, updates).decode('utf-8') == json.dumps(full, ensure_ascii=False)
+        assert json.loads(splice_fields(b'{ }', {'id': 2})) == {'id': 2}
+
+        # 长行只解码需要的字段值，结果与整行解码后投影相同；格式有误的长行仍按无效行跳过
+        prompt = '你是一位诗人，"请"按\\要求创作。\n' * (SELECTIVE_DECODE_BYTES // 10)
+        long_records = [
+            {'system': prompt, 'content': '床前明月光', 'id': 1, 'meta': {'a': '}"', 'b': [1, ']', {'c': None}]}},
+            {'id': 2, 'history': [[prompt, prompt]], 'content': '白日\u2028依山尽', 'flag': True, 'score': -1.5e3},
+        ]
+        long_lines = [json.dumps(record, ensure_ascii=False) for record in long_records]
+        long_lines.append(json.dumps({'system': prompt, 'content': '甲', 'id': 3}, ensure_ascii=False)
+                          .replace('"甲"', '"甲", "content": "乙"'))
+        bad_lines = [long_lines[0][:-1], long_lines[0] + ' x', long_lines[0].replace('"id": 1', '"id": tru'),
+                     json.dumps([prompt, {'content': '甲'}])]
+        long_file = os.path.join(tmp_dir, 'long.jsonl')
+        with open(long_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(long_lines + bad_lines) + '\n')
+        invalid = []
+        records = [record for _, record in iter_projected_records(long_file, ('content', 'id'),
+                                                                  on_invalid=lambda seq, line: invalid.append(seq))]
+        assert all(len(line.encode('utf-8')) >= SELECTIVE_DECODE_BYTES for line in long_lines + bad_lines)
+        assert records == [{k: v for k, v in json.loads(line).items() if k in ('content', 'id')} for line in long_lines]
+        assert records[2] == {'content': '乙', 'id': 3} and invalid == [3, 4, 5, 6]
+    print("字段投影读取结果正确")
+
+
+def test_json_codec():
+    """测试各JSON后端的输出与标准库逐字节相同"""
+    print("开始测试JSON编解码...")
+
+    documents = [
+        {'content': '床前明月光\n疑是地上霜', 'score': 88.5, 'tiny': 1e-05, 'huge': 1e16, 'nan': float('nan')},
+        {'big': 2 ** 70, 'neg': -2 ** 63, 'none': None, 'keys': {1: 'a'}, 'nested': [[], {}, [1, [2]]]},
+        [{'instruct': '五言绝句', 'total_score': 100.0}, '\x7f\u2028"\\', True, 0.1]
+    ]
+    texts = ['NaN', '123456789012345678901234567890', '"\\ud800"', '{"a": 1, "a": 2}', '[1e400, -0, -0.0]']
+    backends = ['json'] + (['orjson'] if json_codec.orjson is not None else [])
+    previous = json_codec.BACKEND
+    try:
+        for backend in backends:
+            json_codec.set_backend(backend)
+            for document in documents:
+                assert json_codec.dumps(document) == json.dumps(document, ensure_ascii=False).encode('utf-8')
+                assert json_codec.dumps(document, indent=True) == \
+                    json.dumps(document, ensure_ascii=False, indent=2).encode('utf-8')
+            for text in texts:
+                assert repr(json_codec.loads(text)) == repr(json.loads(text))
+                assert repr(json_codec.loads(text.encode('utf-8'))) == repr(json.loads(text))
+    finally:
+        json_codec.set_backend(previous)
+
+    # 成块写入：缓冲区很小时也按顺序写出全部行
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = os.path.join(tmp_dir, 'output.jsonl')
+        records = [{'id': i, 'content': '白日依山尽' * i} for i in range(100)]
+        with json_codec.JsonlWriter(output_file, buffer_size=64) as writer:
+            for record in records:
+                writer.write(record)
+        with open(output_file, 'r', encoding='utf-8') as f:
+            assert f.read() == ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records)
+    print("JSON编解码结果正确")
+
+
+def test_compressed_io():
+    """测试压缩文件的识别、流式读写和分卷输出"""
+    print("开始测试压缩文件读写...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        records = [{'id': i, 'content': '床前明月光' * (i % 3 + 1)} for i in range(30)]
+        lines = [json.dumps(r, ensure_ascii=False) for r in records]
+        for name in ('input.jsonl.gz', 'input.jsonl.xz'):
+            path = os.path.join(tmp_dir, name)
+            with open_output(path, CompressOptions(level=1)) as f:
+                f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            assert [line for _, line in iter_jsonl_lines(path)] == lines
+
+        # 通配符内按文件名排序，字符串与列表等价，没有匹配时报错
+        pattern = os.path.join(tmp_dir, 'input.jsonl.*')
+        expected = [os.path.join(tmp_dir, 'input.jsonl.gz'), os.path.join(tmp_dir, 'input.jsonl.xz')]
+        assert expand_inputs(pattern) == expand_inputs([pattern]) == expected
+        try:
+            expand_inputs([pattern, os.path.join(tmp_dir, '*.parquet')])
+            raise AssertionError("没有匹配的通配符应当报错")
+        except FileNotFoundError:
+            pass
+
+        # 没有压缩扩展名时按文件头识别
+        renamed = os.path.join(tmp_dir, 'input.bin')
+        os.rename(os.path.join(tmp_dir, 'input.jsonl.gz'), renamed)
+        assert detect_compression(renamed) == 'gzip'
+        assert [line for _, line in iter_jsonl_lines(renamed, as_bytes=True)] == [l.encode('utf-8') for l in lines]
+        try:
+            list(iter_jsonl_lines(renamed, ShardSpec(0, 2, 'range')))
+            raise AssertionError("压缩文件不应支持按字节范围分片")
+        except ValueError:
+            pass
+
+        # 按未压缩的字节数分卷，每卷不超过上限，合起来与原记录相同
+        output_file = os.path.join(tmp_dir, 'output.jsonl.gz')
+        with json_codec.JsonlWriter(output_file, options=CompressOptions(max_part_bytes=200)) as writer:
+            for record in records:
+                writer.write(record)
+        assert len(writer.paths) > 1 and writer.paths[0].endswith('output-00000.jsonl.gz')
+        read_back = []
+        for path in writer.paths:
+            part = [line for _, line in iter_jsonl_lines(path)]
+            assert sum(len(line.encode('utf-8')) + 1 for line in part) <= 200
+            read_back.extend(part)
+        assert read_back == lines
+    print("压缩文件读写结果正确")
+
+
+def test_parquet_io():
+    """测试Parquet输入输出：只读取需要的列、按行组分片，评分结果的分数列为float32"""
+    print("开始测试Parquet读写...")
+    if parquet_io.pyarrow is None:
+        # SkipTest 会被 pytest 报告为 skipped，run_tests 也会单独统计
+        raise SkipTest("未安装 pyarrow（pip install .[dataset]）")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.parquet')
+        records = [{'content': '床前明月光，疑是地上霜。举头望明月，低头思故乡。', 'instruct': '五言绝句',
+                    'system': '提示词' * 10, 'id': i} for i in range(10)]
+        records[3]['instruct'] = None
+        parquet_io.write_parquet(records, input_file, batch_size=4)
+        assert parquet_io.is_parquet(input_file)
+
+        rows = list(parquet_io.iter_parquet_records(input_file, {'content', 'instruct', 'missing'}))
+        assert [seq for seq, _ in rows] == list(range(10))
+        assert set(rows[0][1]) == {'content', 'instruct'} and 'instruct' not in rows[3][1]
+        for mode in ('hash', 'range'):
+            seqs = sorted(seq for index in range(3)
+                          for seq, _ in parquet_io.iter_parquet_records(input_file, {'id'}, ShardSpec(index, 3, mode)))
+            assert seqs == list(range(10))
+
+        detailed_file = os.path.join(tmp_dir, 'detailed.parquet')
+        PoetryScorer().process_file(input_file, detailed_file, '', 'content', 'instruct', save_detailed=True,
+                                    save_summary=False)
+        table = parquet_io.pq.read_table(detailed_file)
+        assert table.num_rows == 9
+        assert str(table.schema.field('format_score').type) == 'float'
+    print("Parquet读写结果正确")
+
+
+def test_poem_form():
+    """测试诗体识别：一次切分出汉字串和各句字数，按句读或总字数判断诗体"""
+    print("开始测试诗体识别...")
+    text = '春眠不觉晓，处处闻啼鸟。\n夜来风雨声（一作：夜来风雨），花落知多少。'
+    shape = tokenize(text)
+    assert shape.hanzi == extract_chinese(text) and shape.line_lengths == (5, 5, 5, 5)
+    assert classify(text) == (Form.FIVE_QUATRAIN, 5, 4, 1.0)
+
+    # 整段不分行的律诗、缺一句的律诗、排律
+    regulated = '不耻青袍故，尤宜白发新。心朝玉皇帝，貌似紫阳人。湘浦眠销日，桃源醉度春。能文兼证道，庄叟是前身。'
+    assert classify(regulated) == (Form.FIVE_REGULATED, 5, 8, 1.0)
+    assert classify(regulated[:-6]) == (Form.FIVE_REGULATED, 5, 7, 7 / 8)
+    assert classify(regulated + regulated[:24]).form == Form.PAILV
+    # 没有标点时按总字数判断，置信度较低
+    result = classify('两个黄鹂鸣翠柳一行白鹭上青天窗含西岭千秋雪门泊东吴万里船')
+    assert result.form == Form.SEVEN_QUATRAIN and result.confidence < 1.0
+    # 四言诗和非字符串不是目标诗体
+    assert classify('殷殷其雷。蒙蒙其雨。我徒我车。涉此艰阻。').form == Form.OTHER
+    assert classify(None).form == Form.OTHER
+    assert classify_many([text, regulated, text]) == [classify(text), classify(regulated), classify(text)]
+
+    assert form_of_length(20) == (5, 4) and form_of_length(28) == (7, 4) and form_of_length(35) == (5, 7)
+    assert form_of_length(0) is None and form_of_length(29) is None
+    print("诗体识别结果正确")
+
+
+def test_title_filter():
+    """测试诗题过滤：自动机匹配与逐个子串查找一致，组诗、词牌和启发式规则的判断结果正确"""
+    print("开始测试诗题过滤...")
+
+    keywords = ['he', 'she', 'his', 'hers', 'a']
+    automaton = AhoCorasick(keywords)
+    for text in ['', 'ushers', 'hi', 'xhisx', 'shx', 'bcd', 'sha']:
+        assert automaton.search(text) == any(kw in text for kw in keywords)
+    assert AhoCorasick(['']).search('') and not AhoCorasick([]).search('abc')
+
+    title_filter = TitleFilter({'水调歌头', '短歌行'}, {'观沧海'}, {'秋兴八首'})
+    expected = {
+        '': False,
+        '杂诗七首': True,                # 组诗总标题
+        '送别（其二）': True,
+        '水调歌头·明月几时有': True,    # 词牌名
+        '观沧海': True,                  # 直接排除
+        '浣溪沙令': True,                # 词牌特征字
+        '春夜喜雨诗': False,
+        '登鹳雀楼': True,                # 长标题且不含诗题常见结尾
+        '春望': False,
+    }
+    for title, rejected in expected.items():
+        assert title_filter.rejects(title) == rejected, title
+        # 第二次取缓存的结果
+        assert title_filter.rejects(title) == rejected, title
+    # 白名单中的组诗不按组诗排除
+    assert not title_filter.is_part_of_series('秋兴八首 其一') and title_filter.is_part_of_series('咏怀五首 其一')
+    print("诗题过滤结果正确")
+
+
+def test_reservoir_sampling():
+    """测试流式抽样：分块抽样后合并与整体抽样相同，多份抽样互不重叠"""
+    print("开始测试流式抽样...")
+
+    whole = Reservoir(50, seed=7)
+    for seq in range(1000):
+        whole.offer(seq, f'record-{seq}')
+    merged = Reservoir(50, seed=7)
+    for start in range(0, 1000, 300):
+        chunk = Reservoir(50, seed=7)
+        for seq in range(start, min(start + 300, 1000)):
+            chunk.offer(seq, f'record-{seq}')
+        merged.merge(chunk)
+    assert merged.entries() == whole.entries() and merged.seen == whole.seen == 1000
+    assert [key for key, _ in whole.entries()] == sorted(key for key, _ in whole.entries())
+    assert Reservoir(50, seed=8).offer(0, 'x') and len(Reservoir(0).entries()) == 0
+
+    splits = parse_splits(['train=30', 'val=10', 'test=10'])
+    parts = assign_splits(whole.entries(), splits)
+    assert [len(parts[name]) for name, _ in splits] == [30, 10, 10]
+    assert len({item for entries in parts.values() for _, item in entries}) == 50
+    assert split_output_path('out/split.jsonl.gz', 'train') == 'out/split_train.jsonl.gz'
+    for bad in (['train'], ['train=x'], ['a=1', 'a=2']):
+        try:
+            parse_splits(bad)
+            raise AssertionError(f"应拒绝 {bad}")
+        except ValueError:
+            pass
+
+    # 按原始行计算抽样键时，抽样结果与序号无关
+    lines = [b'{"id": %d}' % i for i in range(1000)]
+    by_index, by_offset = Reservoir(50, seed=7), Reservoir(50, seed=7)
+    for seq, line in enumerate(lines):
+        by_index.offer(seq, line, line)
+        by_offset.offer(seq * 37 + 5, line, line)
+    assert by_index.entries() == by_offset.entries() and by_index.entries() != whole.entries()
+
+    # poemsplit.py 对未压缩、gzip 压缩和多进程输入抽到的诗相同，split.py 对同一行的抽样键与之相同
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    poems = ['床前明月光，疑是地上霜。举头望明月，低头思故乡。', '白日依山尽，黄河入海流。欲穷千里目，更上一层楼。',
+             '两个黄鹂鸣翠柳，一行白鹭上青天。窗含西岭千秋雪，门泊东吴万里船。']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        records = [{'id': i, 'title': '诗', 'content': poems[i % 3]} for i in range(300)]
+        with open(input_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+        with open_output(input_file + '.gz') as f, open(input_file, 'rb') as src:
+            f.write(src.read())
+        outputs = []
+        for path, workers in ((input_file, 1), (input_file + '.gz', 1), (input_file, 2)):
+            output_file = os.path.join(tmp_dir, f'output_{len(outputs)}.jsonl')
+            result = subprocess.run([sys.executable, os.path.join(project_root, 'dataset_split', 'poemsplit.py'),
+                                     path, output_file, '--samples-per-type', '20', '--workers', str(workers)],
+                                    capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+            with open(output_file, 'r', encoding='utf-8') as f:
+                outputs.append(f.read())
+        assert outputs[0] == outputs[1] == outputs[2] and len(outputs[0].splitlines()) == 40
+        # 只含五言绝句的行交给 split.py，抽到的正是 poemsplit.py 抽到的五言绝句
+        five_file = os.path.join(tmp_dir, 'five.jsonl')
+        with open(five_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records if r['id'] % 3 != 2))
+        output_file = os.path.join(tmp_dir, 'split.jsonl')
+        subprocess.run([sys.executable, os.path.join(project_root, 'dataset_split', 'split.py'),
+                        five_file, output_file, '-n', '20'], capture_output=True, check=True)
+        with open(output_file, 'r', encoding='utf-8') as f:
+            split_ids = sorted(json.loads(line)['id'] for line in f)
+        five = sorted(json.loads(line)['id'] for line in outputs[0].splitlines() if '五言绝句' in line)
+        assert len(five) == 20 and split_ids == five
+    print("流式抽样结果正确")
+
+
+def test_dedup():
+    """测试去重：完全重复和近似重复只保留最先出现的一条，并行与单进程结果相同"""
+    print("开始测试去重...")
+
+    poems = [
+        '床前明月光，疑是地上霜。举头望明月，低头思故乡。',
+        '白日依山尽，黄河入海流。欲穷千里目，更上一层楼。',
+        '床前明月光 疑是地上霜 举头望明月 低头思故乡',         # 只有标点不同
+        '春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。',
+        '白日依山尽，黄河入海流。欲穷千里目，更上一重楼。',     # 一字之差
+        '',
+    ]
+    hasher = MinHasher(num_perm=64, bands=16)
+    assert hasher.signature('床前明月光') == MinHasher(num_perm=64, bands=16).signature('床前明月光')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for i in range(20):
+                for j, poem in enumerate(poems):
+                    f.write(json.dumps({'id': i * 10 + j, 'content': poem}, ensure_ascii=False) + '\n')
+            f.write('not json\n')
+
+        outputs = []
+        for workers in (1, 3):
+            output_file = os.path.join(tmp_dir, f'output_{workers}.jsonl')
+            report_file = os.path.join(tmp_dir, f'report_{workers}.json')
+            stats = deduplicate_file(input_file, output_file, hasher=hasher, workers=workers, report_file=report_file)
+            with open(output_file, 'r', encoding='utf-8') as f:
+                outputs.append([json.loads(line)['id'] for line in f])
+            report = json_codec.load_file(report_file)
+        # 空正文的记录不参与去重
+        assert outputs[0] == outputs[1] == [0, 1, 3] + [i * 10 + 5 for i in range(20)]
+        assert stats['exact_duplicates'] == 77 and stats['near_duplicates'] == 20 and stats['invalid_lines'] == 1
+        assert len(report['clusters']) == 3 and report['clusters'][0]['kept']['content'].startswith('床前明月光')
+
+        stats = deduplicate_file(input_file, os.path.join(tmp_dir, 'exact.jsonl'), near=False)
+        assert stats['exact_duplicates'] == 96 and stats['near_duplicates'] == 0
+    print("去重结果正确")
+
+
+def test_pipeline():
+    """测试数据集流水线：各阶段依次执行，并行与单进程的输出相同"""
+    print("开始测试数据集流水线...")
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = os.path.join(project_root, 'dataset_split', 'pipeline.py')
+
+    poems = [
+        ('春晓', '春眠不觉晓，处处闻啼鸟。\n夜来风雨声，花落知多少。'),
+        ('登鹳雀楼诗', '白日依山尽，黄河入海流。欲穷千里目，更上一层楼。'),
+        ('春晓', '春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。'),        # 与第一首重复
+        ('水调歌头', '明月几时有，把酒问青天。不知天上宫阙，今夕是何年。'),    # 词
+        ('绝句', '两个黄鹂鸣翠柳，一行白鹭上青天。窗含西岭千秋雪，门泊东吴万里船。'),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for i, (title, content) in enumerate(poems * 3):
+                f.write(json.dumps({'id': i, 'title': title, 'content': content}, ensure_ascii=False) + '\n')
+
+        outputs = []
+        for workers in (1, 2):
+            output_file = os.path.join(tmp_dir, f'output_{workers}.jsonl')
+            spec = {
+                'input': input_file,
+                'workers': workers,
+                'stages': [
+                    {'classify': None},
+                    {'dedupe': {'exact_only': True}},
+                    {'score_filter': {'min_score': 60, 'score_field': 'total_score'}},
+                    {'sample': {'count': 10}},
+                    {'add_fields': {'set': {'source': 'test'}, 'expr': {'tag': "record['title'] + '·' + record['instruct']"}}},
+                    {'write': {'path': output_file, 'keep_fields': ['id', 'content', 'instruct', 'source', 'tag']}},
+                ],
+            }
+            spec_file = os.path.join(tmp_dir, f'spec_{workers}.json')
+            json_codec.dump_file(spec, spec_file)
+            result = subprocess.run([sys.executable, script, spec_file], capture_output=True, text=True)
+            assert result.returncode == 0, result.stderr
+            with open(output_file, 'r', encoding='utf-8') as f:
+                outputs.append([json.loads(line) for line in f])
+
+        assert outputs[0] == outputs[1]
+        assert sorted(record['id'] for record in outputs[0]) == [0, 1, 4]
+        record = next(record for record in outputs[0] if record['id'] == 0)
+        assert record['content'] == '春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。'
+        assert record['instruct'] == '五言绝句' and record['tag'] == '春晓·五言绝句' and record['source'] == 'test'
+
+        # 缩进的 JSON 数组与 JSONL 结果相同；数组不能切块并行；一条记录都读不到时报错，无效行计数并警告
+        array_file = os.path.join(tmp_dir, 'input.json')
+        with open(input_file, 'r', encoding='utf-8') as f:
+            json_codec.dump_file([json.loads(line) for line in f], array_file)
+        with open(array_file, 'r', encoding='utf-8') as f:
+            assert f.read().startswith('[\n ')
+        with open(input_file, 'a', encoding='utf-8') as f:
+            f.write('not json\n[1, 2]\n')
+        bad_file = os.path.join(tmp_dir, 'bad.jsonl')
+        with open(bad_file, 'w', encoding='utf-8') as f:
+            f.write('not json\n{"id": 1\n')
+
+        def run_simple(name, path, workers=1):
+            output_file = os.path.join(tmp_dir, f'output_{name}.jsonl')
+            spec_file = os.path.join(tmp_dir, f'spec_{name}.json')
+            json_codec.dump_file({'input': path, 'workers': workers,
+                                  'stages': [{'classify': None}, {'write': {'path': output_file}}]}, spec_file)
+            result = subprocess.run([sys.executable, script, spec_file], capture_output=True, text=True)
+            if result.returncode != 0:
+                return result, None
+            with open(output_file, 'r', encoding='utf-8') as f:
+                return result, [json.loads(line) for line in f]
+
+        result, from_jsonl = run_simple('jsonl', input_file)
+        assert result.returncode == 0 and '2 行无法解析或不是 JSON 对象' in result.stderr
+        result, from_array = run_simple('array', array_file)
+        assert result.returncode == 0, result.stderr
+        assert len(from_jsonl) == 12 and from_array == from_jsonl
+        result, _ = run_simple('array_parallel', array_file, workers=2)
+        assert result.returncode != 0 and '不支持 JSON 数组' in result.stderr
+        result, _ = run_simple('bad', bad_file)
+        assert result.returncode != 0 and '没有从输入中读到任何记录' in result.stderr
+    print("数据集流水线结果正确")
+
+
+def test_add_fields():
+    """测试一遍添加多个字段：固定值和表达式按顺序计算，经标准输入输出读写"""
+    print("开始测试添加字段...")
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = os.path.join(project_root, 'dataset_split', 'add_field_to_jsonl.py')
+
+    lines = [json.dumps({'title': '春晓', 'instruct': '五言绝句'}, ensure_ascii=False),
+             '',
+             json.dumps({'title': '绝句'}, ensure_ascii=False),                   # 缺少 instruct，表达式失败
+             'not json']
+    result = subprocess.run([sys.executable, script, '-', '-', '--field', 'source=test',
+                             '--field', "tag:=record['title'] + '·' + record['instruct'] + '·' + record['source']"],
+                            input='\n'.join(lines) + '\n', capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stderr
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert records == [{'title': '春晓', 'instruct': '五言绝句', 'source': 'test', 'tag': '春晓·五言绝句·test'}]
+    assert '第 3 行' in result.stderr and '第 4 行' in result.stderr
+
+    result = subprocess.run([sys.executable, script, '-', '-', '--field', 'bad'],
+                            input='', capture_output=True, text=True)
+    assert result.returncode != 0
+    print("添加字段结果正确")
+
+
+def test_poem_pack():
+    """测试二进制打包：记录与 id 原样读回，预先计算的平仄韵部与查韵表相同，评分结果与 JSONL 输入相同"""
+    print("开始测试语料打包...")
+    records = [
+        {'id': 'a1', 'content': '床前明月光，疑是地上霜。举头望明月，低头思故乡。', 'instruct': '五言绝句', 'title': '静夜思'},
+        {'content': '春眠不觉晓（注），处处闻啼鸟。夜来风雨声，花落知多少。', 'instruct': '五言绝句', 'title': ['春晓']},
+        {'id': 3, 'content': '白日依山尽，黄河入海流。'},
+        {'id': 4, 'content': None, 'instruct': '七言绝句'},
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        pack_file = os.path.join(tmp_dir, 'input.poempack')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        stats = write_pack(iter_projected_records(input_file), pack_file, 'content', 'instruct',
+                           keep_fields=['title'], rhyme_systems=['pingshui', 'xin'])
+        assert stats['records'] == 4 and stats['missing_poem'] == 1 and stats['missing_instruct'] == 1
+        assert is_poem_pack(pack_file) and not is_poem_pack(input_file)
+
+        with PoemPack(pack_file) as pack:
+            assert len(pack) == 4 and pack.instructs == ['五言绝句', '七言绝句']
+            packed = [record for _, record in pack.iter_records()]
+            assert [pack.record_id(i) for i in range(4)] == ['a1', '1', '3', '4']
+            # id 不全是整数时统一存为字符串，非字符串的诗句按缺失处理
+            assert packed[:2] == records[:2] and packed[2] == dict(records[2], id='3')
+            assert packed[3] == {'id': '4', 'instruct': '七言绝句'}
+            assert isinstance(packed[1], PackedRecord) and packed[1].hanzi == extract_chinese(records[1]['content'])
+            assert packed[1].hanzi_comma == extract_chinese(records[1]['content'], comma_remain=True)
+            assert [i for i, _ in pack.iter_records(ShardSpec(1, 2, 'range'))] == [2, 3]
+
+            pingze, yun = pack.rhyme_codes('xin')
+            assert set(pingze) == set(''.join(record.hanzi for record in packed))
+            assert all(pingze[char] == hanzi_to_pingze(char, 2, False) and yun[char] == hanzi_to_yun(char, 2, False)
+                       for char in pingze)
+            assert pack.rhyme_codes('tong') is None
+            assert pack.rhyme_fingerprint == rhyme_table_fingerprint()
+
+        # 预先计算的查表只在 with 块（打包文件打开期间）内有效，退出后恢复
+        real = hanzi_to_pingze('春', 2, False), hanzi_to_yun('春', 2, False)
+        with precomputed_codes(2, {'春': '3'}, {'春': [99]}):
+            assert hanzi_to_pingze('春', 2, False) == '3' and hanzi_to_yun('春', 2, False) == [99]
+            with precomputed_codes(2, {}, {}):
+                assert hanzi_to_pingze('春', 2, False) == real[0]
+            assert hanzi_to_pingze('春', 2, False) == '3'
+        assert (hanzi_to_pingze('春', 2, False), hanzi_to_yun('春', 2, False)) == real
+
+        # 打包后韵表有改动（指纹不同）时不使用预先计算的结果
+        stale_file = os.path.join(tmp_dir, 'stale.poempack')
+        with open(pack_file, 'rb') as f:
+            data = f.read()
+        fingerprint = rhyme_table_fingerprint().encode('ascii')
+        with open(stale_file, 'wb') as f:
+            f.write(data.replace(fingerprint, b'0' * len(fingerprint)))
+        with PoemPack(stale_file) as pack:
+            assert pack.install_rhyme_codes() == []
+        with precomputed_codes(2, {'春': '3'}, {'春': [99]}):
+            with PoemPack(pack_file) as pack:
+                assert pack.install_rhyme_codes() == ['pingshui', 'xin']
+                assert hanzi_to_pingze('春', 2, False) == real[0]
+            # 关闭打包文件后恢复打开前的查表
+            assert hanzi_to_pingze('春', 2, False) == '3'
+
+        # 打包文件的评分结果与 JSONL 输入相同（缺少诗句或指令的记录同样跳过）
+        scorer = PoetryScorer()
+        outputs = []
+        for path, is_jsonl in ((input_file, True), (pack_file, False)):
+            detailed = os.path.join(tmp_dir, f'detailed_{len(outputs)}.json')
+            scorer.process_file(path, detailed, '', 'content', 'instruct', is_jsonl, 'xin',
+                                save_detailed=True, save_summary=False)
+            outputs.append(json_codec.load_file(detailed))
+        assert len(outputs[0]) == 2 and outputs[0] == outputs[1]
+    print("语料打包结果正确")
+
+
+def test_score_store():
+    """测试评分数据库：查询结果与用相同配额和韵书运行提取相同，重新写入替换原有结果，各分片的结果可合并查询"""
+    print("开始测试评分数据库...")
+    poems = [
+        "床前明月光，疑是地上霜。举头望明月，低头思故乡。",
+        "白日依山尽，黄河入海流。欲穷千里目，更上一层楼。",
+        "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。",
+        "千山鸟飞绝，万径人踪灭。孤舟蓑笠翁，独钓寒江雪。",
+        "朝辞白帝彩云间，千里江陵一日还。两岸猿声啼不住，轻舟已过万重山。",
+        "一去二三里，烟村四五家。亭台六七座，八九十枝花。",
+    ]
+    records = [{'id': f'p{i}', 'content': poem, 'instruct': '七言绝句' if len(poem) > 30 else '五言绝句'}
+               for i, poem in enumerate(poems * 2)]
+    records.append({'content': '只有一句'})
+
+    def read_output(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.jsonl')
+        db_path = os.path.join(tmp_dir, 'scores.db')
+        with open(input_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        # 写入两次：第二次替换第一次的结果
+        for _ in range(2):
+            with ScoreStore(db_path) as store:
+                PoetryQualityExtractor().process_dataset(input_file, 'content', 'instruct',
+                                                         os.path.join(tmp_dir, 'stored.jsonl'), {},
+                                                         ['id', 'content'], True, store=store)
+        for rhyme_system, quotas in (('pingshui', {'five_quatrain': 3, 'seven_quatrain': 1}),
+                                     ('xin', {'five_quatrain': 4})):
+            extracted = os.path.join(tmp_dir, f'extract_{rhyme_system}.jsonl')
+            queried = os.path.join(tmp_dir, f'query_{rhyme_system}.jsonl')
+            PoetryQualityExtractor(rhyme_system).process_dataset(input_file, 'content', 'instruct', extracted,
+                                                                 quotas, ['id', 'content'], True)
+            with ScoreStore(db_path) as store:
+                stats = PoetryQualityExtractor(rhyme_system).query_store(store, queried, quotas)
+                assert stats['total_processed'] == 12 and stats['skipped']['missing_instruct_field'] == 1
+                rows = list(store.top_k('five_quatrain', rhyme_system, min_scores={'total': 101}))
+                assert rows == []
+            assert read_output(queried) == read_output(extracted)
+
+        # 分片分别写入同一个数据库，合并查询的结果与整体写入相同
+        sharded_db = os.path.join(tmp_dir, 'sharded.db')
+        for index in range(2):
+            with ScoreStore(sharded_db) as store:
+                PoetryQualityExtractor().process_dataset(input_file, 'content', 'instruct',
+                                                         os.path.join(tmp_dir, f'shard{index}.jsonl'), {},
+                                                         ['id', 'content'], True, shard=ShardSpec(index, 2),
+                                                         store=store)
+        outputs = []
+        for path in (db_path, sharded_db):
+            output_file = os.path.join(tmp_dir, f'merged_{len(outputs)}.jsonl')
+            with ScoreStore(path) as store:
+                PoetryQualityExtractor().query_store(store, output_file, {'five_quatrain': 5},
+                                                     sources=[input_file])
+            outputs.append(read_output(output_file))
+        assert len(outputs[0]) == 5 + 2 and outputs[0] == outputs[1]
+    print("评分数据库结果正确")
+
+
+def test_json_array_reader():
+    """测试JSON数组的流式读取：小缓冲区下逐个解析的结果与整体解析相同，按首字节区分JSON数组和JSONL，评分结果与JSONL输入相同"""
+    print("开始测试JSON数组流式读取...")
+    records = [
+        {'id': 1, 'content': '床前明月光，疑是地上霜。举头望明月，低头思故乡。', 'instruct': '五言绝句', 'meta': {'a': '}],', 'b': [1.5e10]}},
+        {'id': 2, 'content': '白日依山尽，黄河入海流。欲穷千里目，更上一层楼。', 'instruct': '五言绝句', 'note': '"\\'},
+        12345678,
+        {'id': 4, 'content': '春眠不觉晓，处处闻啼鸟。', 'instruct': '七言绝句'},
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        array_file = os.path.join(tmp_dir, 'input.json.gz')
+        jsonl_file = os.path.join(tmp_dir, 'input.jsonl')
+        with open_output(array_file, CompressOptions(level=1)) as f:
+            f.write(('\ufeff \n' + json.dumps(records, ensure_ascii=False, indent=2)).encode('utf-8'))
+        with open(jsonl_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        assert is_json_array(array_file) and not is_json_array(jsonl_file)
+
+        # 缓冲区只有几个字符时，元素和数字都会被块边界截断
+        for chunk_size in (1, 3, 7, 1 << 20):
+            invalid = []
+            items = list(iter_json_array(array_file, on_invalid=lambda seq, item: invalid.append(seq),
+                                         chunk_size=chunk_size))
+            assert items == [(i, r) for i, r in enumerate(records) if isinstance(r, dict)] and invalid == [2]
+        shard = ShardSpec(1, 2)
+        assert list(iter_json_array(array_file, ('content',), shard)) == \
+            [(i, {'content': r['content']}) for i, r in enumerate(records) if isinstance(r, dict) and shard.owns(i)]
+        for text in ('[1, 2', '[{"a": 1} {"a": 2}]', '{"a": 1}', '[1,]'):
+            bad_file = os.path.join(tmp_dir, 'bad.json')
+            with open(bad_file, 'w', encoding='utf-8') as f:
+                f.write(text)
+            try:
+                list(iter_json_array(bad_file, chunk_size=2))
+                raise AssertionError(f"格式有误的JSON数组应报错: {text}")
+            except ValueError:
+                pass
+
+        # 不指定 is_jsonl 时自动识别格式，JSON数组与JSONL的评分结果相同
+        scorer = PoetryScorer()
+        outputs = []
+        for path in (jsonl_file, array_file):
+            detailed = os.path.join(tmp_dir, f'detailed_{len(outputs)}.json')
+            scorer.process_file(path, detailed, '', 'content', 'instruct', False, 'pingshui',
+                                save_detailed=True, save_summary=False)
+            outputs.append(json_codec.load_file(detailed))
+        assert len(outputs[0]) == 3 and outputs[0] == outputs[1]
+    print("JSON数组流式读取结果正确")
+
+
+def run_tests() -> int:
+    """依次运行全部测试，返回进程退出码；抛出 SkipTest 的测试计为跳过而非通过"""
+    tests = (
+        test_poetry_scorer,
+        test_rhyme_tables_loaded_once,
+        test_shared_scorer_thread_safety,
+        test_streaming_top_k_extraction,
+        test_score_bound_pruning,
+        test_schema_resolution,
+        test_score_stats_merge,
+        test_sharded_extraction_merge,
+        test_jsonl_index,
+        test_projected_reader,
+        test_json_codec,
+        test_compressed_io,
+        test_parquet_io,
+        test_poem_form,
+        test_title_filter,
+        test_reservoir_sampling,
+        test_dedup,
+        test_pipeline,
+        test_add_fields,
+        test_poem_pack,
+        test_score_store,
+        test_json_array_reader,
+    )
+    skipped = []
+    try:
+        for test in tests:
+            try:
+                test()
+            except SkipTest as e:
+                print(f"⏭️ 跳过 {test.__name__}: {e}")
+                skipped.append(test.__name__)
     except Exception as e:
         print(f"\n❌ 测试失败: {e}")
-        sys.exit(1)
+        return 1
+    if skipped:
+        print(f"\n✅ 测试通过（{len(tests) - len(skipped)} 项通过，{len(skipped)} 项跳过: {', '.join(skipped)}）")
+    else:
+        print("\n✅ 所有测试通过！")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+诗题过滤
+按标题排除组诗、词和其他非目标诗歌（规则见 dataset_split/poemsplit.py）。
+词牌名、需排除的标题和词牌特征字编译成一个 Aho-Corasick 自动机，每个标题只扫描一遍，
+不必对几百个关键词逐个做子串查找；组诗的几种写法合成一个预编译的正则。
+同一标题（无题、绝句等大量重复）只判断一次，结果缓存在字典里
+"""
+
+import re
+
+# 标题中的序号：汉字数字或阿拉伯数字
+_NUMERAL = r'[一二三四五六七八九十\d]'
+# 组诗：总标题（杂诗七首、古风五章）、子篇（其二、第三首、（其四））
+SERIES_PATTERN = re.compile(
+    rf'{_NUMERAL}[首篇章阕]'
+    rf'|其{_NUMERAL}+\s*$'
+    rf'|[（\(]其{_NUMERAL}+[）\)]'
+)
+# 判断词牌前从标题中去掉的字符：间隔号、括号、点、数字和空白
+_TITLE_NOISE = re.compile(r'[·（）().\d一二三四五六七八九十\s]')
+# 词牌特征字
+CI_FEATURE_CHARS = '令引近慢犯摊破减字'
+# 诗题常见结尾
+TITLE_ENDINGS = frozenset('诗吟歌行引谣篇辞叹作题')
+# 出现在标题任意位置即视为诗题的字
+COMMON_ENDINGS = frozenset('诗吟歌行引谣篇辞')
+
+
+class AhoCorasick:
+    """多关键词子串匹配自动机，只回答文本中是否出现了任一关键词"""
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: 关键词列表，空字符串匹配任意文本
+        """
+        # 各状态的转移、失败指针，以及到达该状态时是否已匹配到关键词（含经失败指针可达的后缀）
+        self._goto = [{}]
+        self._fail = [0]
+        self._match = [False]
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(False)
+                state = next_state
+            self._match[state] = True
+
+        # 按广度优先顺序计算失败指针
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._match[next_state] = self._match[next_state] or self._match[self._fail[next_state]]
+                queue.append(next_state)
+
+    def search(self, text: str) -> bool:
+        """文本中是否出现任一关键词"""
+        goto, fail, match = self._goto, self._fail, self._match
+        if match[0]:
+            return True
+        state = 0
+        for ch in text:
+            next_state = goto[state].get(ch)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(ch)
+            state = next_state or 0
+            if match[state]:
+                return True
+        return False
+
+
+class TitleFilter:
+    """
+    按标题判断是否排除一首诗，判断结果与逐个关键词查找、逐个正则匹配的写法完全相同
+    """
+
+    # 缓存的最大标题数，超出后不再缓存新标题
+    CACHE_SIZE = 1 << 20
+
+    def __init__(self, ci_keywords, reject_titles=(), series_whitelist=()):
+        """
+        Args:
+            ci_keywords: 词牌名及其他非目标诗歌的关键词，在去掉序号和括号后的标题中查找
+            reject_titles: 直接排除的标题关键词，在原标题中查找
+            series_whitelist: 保留的组诗，标题中含有时不按组诗排除
+        """
+        self._ci = AhoCorasick(list(ci_keywords) + list(CI_FEATURE_CHARS))
+        self._reject = AhoCorasick(reject_titles) if reject_titles else None
+        self._whitelist = AhoCorasick(series_whitelist) if series_whitelist else None
+        self._cache = {}
+
+    def is_part_of_series(self, title: str) -> bool:
+        """标题是否为组诗（总称或其中一篇），白名单中的组诗除外"""
+        if not title or not SERIES_PATTERN.search(title):
+            return False
+        return self._whitelist is None or not self._whitelist.search(title)
+
+    def is_likely_ci(self, title: str) -> bool:
+        """标题是否为词或非目标诗歌"""
+        if not title:
+            return False
+        clean_title = _TITLE_NOISE.sub('', title)
+        # 词牌名、词牌特征字
+        if self._ci.search(clean_title):
+            return True
+        # 启发式：长标题且不含诗题常见结尾
+        return (len(clean_title) >= 3 and clean_title[-1] not in TITLE_ENDINGS
+                and COMMON_ENDINGS.isdisjoint(clean_title))
+
+    def rejects(self, title: str) -> bool:
+        """
+        是否按标题排除：组诗、直接排除的标题或词
+        Args:
+            title: 诗题
+        Returns:
+            True 表示应排除
+        """
+        result = self._cache.get(title)
+        if result is None:
+            result = (self.is_part_of_series(title)
+                      or (self._reject is not None and self._reject.search(title))
+                      or self.is_likely_ci(title))
+            if len(self._cache) < self.CACHE_SIZE:
+                self._cache[title] = result
+        return result